@@ -0,0 +1,116 @@
+"""Micro-benchmark of `clean_text` against the original two-pass implementation.
+
+    python -m benchmark.bench_clean_text --num-reports 2000 --lines 120
+"""
+import argparse
+import random
+import re
+import time
+
+from pythainlp.util import normalize
+
+from benchmark.synthetic_archive import REPORT_LINES, synthetic_report
+from preprocess.text_cleaning import clean_text, clean_texts, filter_report_lines
+
+
+def legacy_clean_text(text: str, normalize_fn=normalize) -> str:
+    """The original implementation, kept as the byte-for-byte reference."""
+    url_pattern = re.compile(r'https?://\S+')
+    date_line_pattern = re.compile(r'^\s*\d+.*น\.\s*$')
+
+    first_cleaned_lines = []
+    for line in text.splitlines():
+        stripped_line = line.strip()
+        if stripped_line.isdigit():
+            continue
+        if url_pattern.search(line):
+            continue
+        if date_line_pattern.match(line):
+            continue
+
+        line = line.replace(" า", " ำ")
+        line = line.replace("ต ่า", "ต่ำ")
+        line = line.replace("ก ำ", "กำ")
+        line = line.replace("ก  ำ", "กำ")
+        line = line.replace("ดำห์", "ดาห์")
+        line = line.replace("มำ", "มา")
+
+        first_cleaned_lines.append(line)
+
+    first_cleaned_text = "\n".join(first_cleaned_lines)
+
+    cleaned_lines = []
+    for line in first_cleaned_text.splitlines():
+        if "ที่มา:" in line:
+            continue
+        if "สภาพอากาศ" == line.strip():
+            continue
+        if "สัปดาห์ที่ผ่านมา" == line.strip():
+            continue
+        if "ข้อมูลเพิ่มเติม:" == line.strip():
+            continue
+        if "สัปดาห์ที่ผ่านมาสภาพอากาศ" == line.strip():
+            continue
+        if "ลักษณะกลุ่มเมฆจากภาพถ่ายดาวเทียม" in line.strip():
+            continue
+        if "กลุ่มเมฆและแผนที่อากาศ" == line.strip():
+            continue
+        if "ภาพแผนที่อากาศ กรมอุตุนิยมวิทยา" == line.strip():
+            continue
+        if "Digital Typhoon" in line.strip():
+            continue
+        cleaned_lines.append(line)
+
+    output_text = " ".join(cleaned_lines)
+    return normalize_fn(output_text).strip()
+
+
+FUZZ_ALPHABET = ["ก", "ต", "ด", "ม", "ห์", "า", "ำ", "่", " ", "  ", "\n", "\n\n", "\r\n", " ", "1", "๑", "น.", ":", "ที่มา:", "x"]
+
+
+def fuzz_texts(rng, count):
+    texts = []
+    for _ in range(count):
+        pieces = [rng.choice(FUZZ_ALPHABET) for _ in range(rng.randint(0, 40))]
+        if rng.random() < 0.5:
+            pieces.insert(rng.randint(0, len(pieces)), "\n" + rng.choice(REPORT_LINES) + "\n")
+        texts.append("".join(pieces))
+    return texts
+
+
+def best_of(fn, texts, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(texts)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-reports", type=int, default=2000)
+    parser.add_argument("--lines", type=int, default=120, help="lines per synthetic report")
+    parser.add_argument("--fuzz", type=int, default=20000, help="random texts checked for identical output")
+    parser.add_argument("--num-proc", type=int, default=None)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for text in fuzz_texts(rng, args.fuzz):
+        assert clean_text(text) == legacy_clean_text(text), repr(text)
+
+    reports = [synthetic_report(rng, args.lines) for _ in range(args.num_reports)]
+    assert [clean_text(r) for r in reports] == [legacy_clean_text(r) for r in reports]
+    print(f"outputs identical on {args.fuzz} fuzzed texts and {args.num_reports} reports")
+
+    legacy_time = best_of(lambda texts: [legacy_clean_text(t, normalize_fn=str) for t in texts], reports)
+    compiled_time = best_of(lambda texts: [filter_report_lines(t) for t in texts], reports)
+    print(f"line filtering only: legacy {legacy_time:.3f}s, compiled {compiled_time:.3f}s ({legacy_time / compiled_time:.2f}x)")
+
+    legacy_time = best_of(lambda texts: [legacy_clean_text(t) for t in texts], reports)
+    compiled_time = best_of(lambda texts: [clean_text(t) for t in texts], reports)
+    print(f"legacy clean_text:   {legacy_time:.3f}s ({args.num_reports / legacy_time:.0f} reports/s)")
+    print(f"compiled clean_text: {compiled_time:.3f}s ({args.num_reports / compiled_time:.0f} reports/s, {legacy_time / compiled_time:.2f}x)")
+    if args.num_proc:
+        batch_time = best_of(lambda texts: clean_texts(texts, num_proc=args.num_proc), reports, repeat=1)
+        print(f"clean_texts num_proc={args.num_proc}: {batch_time:.3f}s ({args.num_reports / batch_time:.0f} reports/s)")
@@ -0,0 +1,91 @@
+"""Benchmark report discovery in `create_dataset_list` on a synthetic archive.
+
+    python -m benchmark.bench_create_dataset_list --num-reports 10000 --num-proc 8 --legacy-reports 1000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmark.synthetic_archive import generate_archive
+from preprocess.file_extraction import clean_text, create_dataset_list, extract_date_from_filename
+
+
+def legacy_create_dataset_list(mapped_images_folder):
+    """The per-report `os.listdir` implementation, kept as the reference for records and timings."""
+    dataset = []
+    text_folder = os.path.join(mapped_images_folder, "text")
+    img_folder = os.path.join(mapped_images_folder, "img_final")
+    air_img_folder = os.path.join(mapped_images_folder, "img_air_pressure")
+    img_metadata_folder = os.path.join(mapped_images_folder, "img_metadata")
+
+    for text_file in os.listdir(text_folder):
+        if text_file.endswith(".txt"):
+            base_name = os.path.splitext(text_file)[0]
+            with open(os.path.join(text_folder, text_file), "r", encoding="utf-8") as f:
+                caption = f.read().strip()
+
+            matched_images = [
+                os.path.join(img_folder, img_file)
+                for img_file in os.listdir(img_folder)
+                if img_file.startswith(base_name) and img_file.lower().endswith((".jpg", ".png", ".jpeg"))
+            ] + [
+                os.path.join(air_img_folder, img_file)
+                for img_file in os.listdir(air_img_folder)
+                if img_file.startswith(base_name) and img_file.lower().endswith((".jpg", ".png", ".jpeg"))
+            ]
+            matched_images = sorted(matched_images)
+
+            matched_images_metadata = []
+            for img_metadata_file in sorted(os.listdir(img_metadata_folder)):
+                if img_metadata_file.startswith(base_name) and img_metadata_file.lower().endswith((".json")):
+                    with open(os.path.join(img_metadata_folder, img_metadata_file), 'r') as f:
+                        data = json.load(f)
+                        for image, details in data.items():
+                            cloud_count = sum(1 for det in details['detections'] if det['class_id'] == 0)
+                            typhoon_count = sum(1 for det in details['detections'] if det['class_id'] == 1)
+                            matched_images_metadata.append({"Cloudy": cloud_count, "Typhoon": typhoon_count})
+
+            report_date = extract_date_from_filename(base_name)
+            caption = clean_text(caption)
+
+            if matched_images:
+                dataset.append({"image": matched_images, "text": caption, "filename": base_name, "reportdate": report_date, 'image_metadata': matched_images_metadata})
+    return dataset
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-reports", type=int, default=10000)
+    parser.add_argument("--num-proc", type=int, default=os.cpu_count())
+    parser.add_argument("--legacy-reports", type=int, default=1000, help="archive size for the legacy comparison (0 to skip)")
+    parser.add_argument("--workdir", type=str, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmp:
+        root = os.path.join(tmp, "data")
+        generate_archive(root, args.num_reports, empty_images=True)
+
+        _, serial_time = timed(create_dataset_list, root)
+        records, parallel_time = timed(create_dataset_list, root, num_proc=args.num_proc)
+        print(f"{args.num_reports} reports: indexed {serial_time:.2f}s, indexed num_proc={args.num_proc} {parallel_time:.2f}s "
+              f"({args.num_reports / parallel_time:.0f} reports/s)")
+
+        if args.legacy_reports:
+            legacy_root = os.path.join(tmp, "legacy")
+            generate_archive(legacy_root, args.legacy_reports, empty_images=True)
+            expected, legacy_time = timed(legacy_create_dataset_list, legacy_root)
+            # The old split_train_val_test formatted the metadata later, through str() and ast.literal_eval
+            for record in expected:
+                record["image_metadata"] = "\n".join(f"วันที่ {i+1}: {entry}" for i, entry in enumerate(record["image_metadata"]))
+            records, indexed_time = timed(create_dataset_list, legacy_root, num_proc=args.num_proc)
+            assert records == expected, "indexed create_dataset_list records differ from the legacy implementation"
+            print(f"{args.legacy_reports} reports: legacy {legacy_time:.2f}s, indexed {indexed_time:.2f}s "
+                  f"({legacy_time / indexed_time:.1f}x), records identical")
@@ -0,0 +1,90 @@
+"""Benchmark the content-addressed vision feature cache on overlapping windows of images.
+
+A weekly report encodes the images of 7 consecutive days, and the windows slide by `--stride` days, so
+most images were encoded for an earlier window. Each window goes through the vision tower as a list of
+images (as the low-resolution branch does), and as one batch of video frames. The cache is run with its
+memory tier, then from a fresh process-like cache that only has the disk tier. A reduced OryxViT (random
+weights) keeps the run short on CPU:
+
+    python -m benchmark.bench_feature_cache --days 28 --window 7 --stride 1
+"""
+import argparse
+import tempfile
+import time
+
+import torch
+
+from oryx.model.multimodal_encoder.feature_cache import VisionFeatureCache, cached_forward
+from oryx.model.multimodal_encoder.oryx_vit import VisionTransformer
+
+
+def run(encode, windows, cache=None):
+    outputs = []
+    start = time.perf_counter()
+    with torch.no_grad():
+        for images in windows:
+            if cache is None:
+                outputs.append(encode(images))
+            else:
+                outputs.append(cached_forward(cache, encode, images, namespace="bench"))
+    return outputs, len(windows) / (time.perf_counter() - start)
+
+
+def identical(a, b):
+    features_a, sizes_a = a
+    features_b, sizes_b = b
+    if isinstance(features_a, torch.Tensor):
+        return torch.equal(features_a, features_b) and tuple(sizes_a) == tuple(sizes_b)
+    return all(torch.equal(x, y) for x, y in zip(features_a, features_b)) and \
+        [tuple(s) for s in sizes_a] == [tuple(s) for s in sizes_b]
+
+
+def report(name, rate, base_rate, cache):
+    stats = cache.stats()
+    print(f"  {name:<13} {rate:7.2f} windows/s ({rate / base_rate:5.2f}x)  hit rate {stats['hit_rate']:6.1%}  "
+          f"memory {stats['memory_bytes'] / 1024 ** 2:7.1f} MB  served {stats['hit_bytes'] / 1024 ** 2:7.1f} MB  "
+          f"disk read {stats['disk_read_bytes'] / 1024 ** 2:7.1f} MB  written {stats['disk_write_bytes'] / 1024 ** 2:7.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=28)
+    parser.add_argument("--window", type=int, default=7)
+    parser.add_argument("--stride", type=int, default=1)
+    parser.add_argument("--image-size", type=int, default=384)
+    parser.add_argument("--memory-mb", type=float, default=512)
+    parser.add_argument("--width", type=int, default=384)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--heads", type=int, default=6)
+    args = parser.parse_args()
+
+    vit = VisionTransformer(img_size=2048, patch_size=16, embed_dim=args.width, depth=args.depth, num_heads=args.heads,
+                            class_token=False, global_pool="map", dynamic_img_pad=False, strict_img_size=False,
+                            weight_init="skip", num_classes=0).eval()
+
+    def encode(images):
+        features, sizes, _ = vit(images)
+        return features, sizes
+
+    generator = torch.Generator().manual_seed(0)
+    days = [torch.randn(1, 3, args.image_size, args.image_size, generator=generator) for _ in range(args.days)]
+    starts = range(0, args.days - args.window + 1, args.stride)
+    print(f"{len(starts)} windows of {args.window} of {args.days} images ({args.image_size}px), "
+          f"ViT {args.depth}x{args.width}, {torch.get_num_threads()} threads")
+
+    for mode in ("list", "frames"):
+        if mode == "list":
+            windows = [days[start:start + args.window] for start in starts]
+        else:
+            windows = [torch.cat(days[start:start + args.window]) for start in starts]
+        encode(windows[0])  # warm-up
+        reference, base_rate = run(encode, windows)
+        print(f"{mode}: no cache {base_rate:7.2f} windows/s")
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = VisionFeatureCache(max_bytes=int(args.memory_mb * 1024 ** 2), cache_dir=cache_dir)
+            cached, rate = run(encode, windows, cache)
+            report("memory + disk", rate, base_rate, cache)
+            disk_cache = VisionFeatureCache(max_bytes=int(args.memory_mb * 1024 ** 2), cache_dir=cache_dir)
+            from_disk, disk_rate = run(encode, windows, disk_cache)
+            report("disk, rerun", disk_rate, base_rate, disk_cache)
+        print(f"  identical to uncached: {all(identical(a, b) for a, b in zip(reference, cached + from_disk))}")
@@ -0,0 +1,67 @@
+"""Benchmark image loading for the Arrow shards: full decode vs. draft (reduced-scale) JPEG decode.
+
+    python -m benchmark.bench_image_loading --num-images 400 --image-size 1920 1080 --num-proc 8
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from PIL import Image
+from io import BytesIO
+
+from benchmark.synthetic_archive import encode_jpeg
+from preprocess.file_extraction import DRAFT_REDUCING_GAP, TARGET_SIZE, load_resized_image
+
+
+def legacy_load_resized_image(image_path):
+    """Full decode and default PNG compression, as the shards were first written."""
+    with Image.open(image_path) as img:
+        img = img.convert("RGB").resize(TARGET_SIZE)
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def images_per_second(paths, load, num_proc):
+    start = time.perf_counter()
+    if num_proc and num_proc > 1:
+        with ProcessPoolExecutor(max_workers=num_proc) as executor:
+            results = list(executor.map(load, paths, chunksize=16))
+    else:
+        results = [load(path) for path in paths]
+    return len(paths) / (time.perf_counter() - start), results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-images", type=int, default=400)
+    parser.add_argument("--image-size", type=int, nargs=2, default=[1920, 1080])
+    parser.add_argument("--num-proc", type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        payloads = [encode_jpeg(tuple(args.image_size), seed) for seed in range(8)]
+        for i in range(args.num_images):
+            path = os.path.join(tmp, f"{i}.jpeg")
+            with open(path, "wb") as f:
+                f.write(payloads[i % len(payloads)])
+            paths.append(path)
+
+        legacy_rate, _ = images_per_second(paths, legacy_load_resized_image, args.num_proc)
+        full_rate, full = images_per_second(paths, partial(load_resized_image, reducing_gap=None), args.num_proc)
+        draft_rate, draft = images_per_second(paths, partial(load_resized_image, reducing_gap=DRAFT_REDUCING_GAP), args.num_proc)
+
+        diffs = [
+            np.abs(np.asarray(Image.open(BytesIO(a)), dtype=np.int16) - np.asarray(Image.open(BytesIO(b)), dtype=np.int16)).mean()
+            for a, b in zip(full[:len(payloads)], draft[:len(payloads)])
+        ]
+        print(f"{args.num_images} JPEGs {args.image_size[0]}x{args.image_size[1]} -> {TARGET_SIZE[0]}x{TARGET_SIZE[1]}, num_proc={args.num_proc}")
+        print(f"before (full decode, PNG level 6): {legacy_rate:.1f} images/s")
+        print(f"full decode, PNG level 1:          {full_rate:.1f} images/s ({full_rate / legacy_rate:.2f}x)")
+        print(f"draft decode, PNG level 1:         {draft_rate:.1f} images/s ({draft_rate / legacy_rate:.2f}x), "
+              f"mean abs pixel difference to full decode {np.mean(diffs):.2f}")
@@ -0,0 +1,69 @@
+"""Benchmark the positional-embedding cache of OryxViT on repeated patch grids.
+
+The full-size SigLIP positional embedding (a 128x128 grid, 1152 wide) is rescaled to the grid of every
+image. Video frames and bucketed images repeat the same grids; with the cache each grid is rescaled once.
+Also checks that cached embeddings equal freshly rescaled ones, and that modifying `pos_embed` in place
+invalidates the cache:
+
+    python -m benchmark.bench_pos_embed_cache --num-images 256 --grids 24x24 30x40 36x64
+"""
+import argparse
+import random
+import time
+
+import torch
+
+from oryx.mm_utils import ResolutionPolicy
+from oryx.model.multimodal_encoder.oryx_vit import VisionTransformer
+
+
+def parse_grid(value):
+    h, w = value.split("x")
+    return int(h), int(w)
+
+
+def rescale_all(vit, grids):
+    start = time.perf_counter()
+    with torch.no_grad():
+        for grid in grids:
+            vit.rescale_positional_embedding(grid)
+    return len(grids) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-images", type=int, default=256)
+    parser.add_argument("--grids", type=parse_grid, nargs="+", default=[(24, 24), (30, 40), (36, 64), (64, 36), (32, 32)])
+    parser.add_argument("--cache-size", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vit = VisionTransformer(img_size=2048, patch_size=16, embed_dim=1152, depth=1, num_heads=16, class_token=False,
+                            global_pool="map", dynamic_img_pad=False, strict_img_size=False, weight_init="skip",
+                            num_classes=0, pos_embed_cache_size=args.cache_size).eval()
+    rng = random.Random(args.seed)
+    grids = [rng.choice(args.grids) for _ in range(args.num_images)]
+
+    vit.pos_embed_cache_size = 0
+    uncached_rate = rescale_all(vit, grids)
+    vit.pos_embed_cache_size = args.cache_size
+    cached_rate = rescale_all(vit, grids)
+    print(f"{args.num_images} images over {len(set(grids))} grids, pos_embed {tuple(vit.pos_embed.shape)}")
+    print(f"rescale every image: {uncached_rate:9.1f} images/s")
+    print(f"cached:              {cached_rate:9.1f} images/s ({cached_rate / uncached_rate:.1f}x)")
+
+    with torch.no_grad():
+        cached = vit.rescale_positional_embedding(grids[0])
+        vit.pos_embed_cache_size = 0
+        fresh = vit.rescale_positional_embedding(grids[0])
+        vit.pos_embed_cache_size = args.cache_size
+        print(f"cached equals rescaled: {torch.equal(cached, fresh)}")
+        vit.pos_embed.mul_(2)
+        updated = vit.rescale_positional_embedding(grids[0])
+        print(f"invalidated by an in-place update: {torch.allclose(updated, fresh * 2)}")
+
+    policy = ResolutionPolicy(video_resize=(0, 64), highres_base=(0, 32), max_res=1536, video_max_res=480, video_min_res=288)
+    warm_grids = policy.warm_grids()
+    start = time.perf_counter()
+    vit.warm_pos_embed_cache(warm_grids)
+    print(f"pre-warmed {len(warm_grids)} grids of the default script policy in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,104 @@
+"""Benchmark aspect-ratio bucketing of any-resolution images: how many batches stack, and the ViT throughput gain.
+
+Image sizes are drawn from a mix of camera, screen and cropped aspect ratios. Without buckets every
+high-resolution image keeps its own shape and goes through the ViT alone; with buckets the images of
+one bucket are stacked into one pass. Batches are formed at random, and grouped by bucket as the
+`group_by_resolution_bucket` training sampler does. A small timm ViT with dynamic image size stands in
+for OryxViT:
+
+    python -m benchmark.bench_resolution_buckets --num-images 256 --batch-size 8 --base-sizes 448
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+import torch
+
+from oryx.mm_utils import ResolutionPolicy, aspect_buckets, group_by_shape
+
+ASPECT_RATIOS = (4 / 3, 3 / 4, 16 / 9, 9 / 16, 3 / 2, 2 / 3, 1, 2, 1 / 2)
+
+
+def mixed_sizes(num_images, seed):
+    """(width, height) of photos, screenshots and crops: a common aspect ratio with some jitter, 300 to 2000 pixels on the long side."""
+    rng = random.Random(seed)
+    sizes = []
+    for _ in range(num_images):
+        aspect_ratio = rng.choice(ASPECT_RATIOS) * rng.uniform(0.93, 1.07)
+        long_side = rng.randint(300, 2000)
+        width, height = (long_side, round(long_side / aspect_ratio)) if aspect_ratio >= 1 else (round(long_side * aspect_ratio), long_side)
+        sizes.append((width, height))
+    return sizes
+
+
+def bucket_grouped(plans, batch_size, seed):
+    """`plans` reordered like `get_bucket_grouped_indices`: shuffled, sorted by bucket, and the batches shuffled."""
+    rng = random.Random(seed)
+    indices = sorted(rng.sample(range(len(plans)), len(plans)), key=lambda i: plans[i].size)
+    batches = [indices[i:i + batch_size] for i in range(0, len(indices), batch_size)]
+    rng.shuffle(batches)
+    return [plans[i] for batch in batches for i in batch]
+
+
+def batch_stats(plans, batch_size):
+    """Fraction of batches whose images share one shape, and ViT passes per batch when each shape is one pass."""
+    batches = [plans[i:i + batch_size] for i in range(0, len(plans), batch_size)]
+    shapes = [len({plan.size for plan in batch}) for batch in batches]
+    return np.mean([count == 1 for count in shapes]), np.mean(shapes)
+
+
+def vit_images_per_second(vit, plans, batch_size, stack):
+    batches = [plans[i:i + batch_size] for i in range(0, len(plans), batch_size)]
+    for plan in {plan.size: plan for plan in plans}.values():
+        with torch.inference_mode():
+            vit.forward_features(torch.zeros(1, 3, plan.size[1], plan.size[0]))  # warm-up of each shape
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for batch in batches:
+            images = [torch.zeros(1, 3, plan.size[1], plan.size[0]) for plan in batch]
+            groups = group_by_shape(images) if stack else [[idx] for idx in range(len(images))]
+            for group in groups:
+                vit.forward_features(torch.cat([images[idx] for idx in group]))
+    return len(plans) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-images", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-res", type=int, default=512)
+    parser.add_argument("--base-sizes", type=int, nargs="+", default=[448])
+    parser.add_argument("--max-distortion", type=float, default=0.1)
+    parser.add_argument("--max-pad", type=float, default=0.25)
+    parser.add_argument("--vit", type=str, default="vit_tiny_patch16_224")
+    parser.add_argument("--vit-images", type=int, default=64, help="images of the set run through the ViT")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    sizes = mixed_sizes(args.num_images, args.seed)
+    native = ResolutionPolicy(highres_base=(0, 32), max_res=args.max_res)
+    bucketed = ResolutionPolicy(highres_base=(0, 32), max_res=args.max_res, buckets=aspect_buckets(args.base_sizes),
+                                bucket_max_distortion=args.max_distortion, bucket_max_pad=args.max_pad)
+    native_plans = [native.plan(*size) for size in sizes]
+    bucketed_plans = [bucketed.plan(*size) for size in sizes]
+
+    print(f"{args.num_images} images, batches of {args.batch_size}, {len(bucketed.buckets)} buckets at base sizes {args.base_sizes}")
+    grouped_plans = bucket_grouped(bucketed_plans, args.batch_size, args.seed)
+    for name, plans in (("native", native_plans), ("bucketed", bucketed_plans), ("grouped", grouped_plans)):
+        stackable, passes = batch_stats(plans, args.batch_size)
+        tokens = np.mean([plan.grid[0] * plan.grid[1] for plan in plans])
+        print(f"{name:<9} distinct shapes {len({plan.size for plan in plans}):4d}  stackable batches {stackable:6.1%}  "
+              f"ViT passes/batch {passes:5.2f}  tokens/image {tokens:7.1f}")
+    snapped = [plan for plan in bucketed_plans if plan.size in bucketed.buckets]
+    print(f"snapped to a bucket: {len(snapped) / len(sizes):.1%}, of them padded: {np.mean([plan.pad for plan in snapped]):.1%}")
+
+    import timm
+    vit = timm.create_model(args.vit, pretrained=False, num_classes=0, dynamic_img_size=True).eval()
+    vit_images = min(args.vit_images, args.num_images)
+    native_rate = vit_images_per_second(vit, native_plans[:vit_images], args.batch_size, stack=False)
+    bucketed_rate = vit_images_per_second(vit, bucketed_plans[:vit_images], args.batch_size, stack=True)
+    grouped_rate = vit_images_per_second(vit, grouped_plans[:vit_images], args.batch_size, stack=True)
+    print(f"ViT ({args.vit}, {vit_images} images): per image {native_rate:7.2f} images/s  "
+          f"per bucket {bucketed_rate:7.2f} images/s ({bucketed_rate / native_rate:.2f}x)  "
+          f"per bucket, grouped batches {grouped_rate:7.2f} images/s ({grouped_rate / native_rate:.2f}x)")
@@ -0,0 +1,91 @@
+"""Benchmark reading images from packed shard files: open/seek/read per sample vs. pooled memory maps.
+
+Packs synthetic JPEGs into a few shard files the way the training data is packed (`patch`, `start_num`,
+`size` per sample), then reads them back in random order:
+
+    python -m benchmark.bench_shard_reader --num-images 2000 --num-shards 8
+"""
+import argparse
+import base64
+import io
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from benchmark.synthetic_archive import encode_jpeg
+from oryx.shard_reader import PackedShardReader
+
+
+def legacy_read_image_patch(patch_info, data_folder):
+    """The per-sample open/seek/read of `read_image_patch` before the shard reader."""
+    image_file_name = os.path.join(data_folder, patch_info['patch'])
+    with open(image_file_name, 'rb') as f:
+        f.seek(int(patch_info['start_num']))
+        data = f.read(int(patch_info['size']))
+    if patch_info.get('image_encoding') == 'base64':
+        data = base64.b64decode(data.decode())
+    return Image.open(io.BytesIO(data)).convert("RGB")
+
+
+def legacy_fetch(patch_info, data_folder):
+    with open(os.path.join(data_folder, patch_info['patch']), 'rb') as f:
+        f.seek(int(patch_info['start_num']))
+        return len(f.read(int(patch_info['size'])))
+
+
+def pack_shards(folder, num_images, num_shards, image_size, base64_every):
+    payloads = [encode_jpeg(image_size, seed) for seed in range(16)]
+    patch_infos = []
+    files = [open(os.path.join(folder, f"patch_{k:03d}"), "wb") for k in range(num_shards)]
+    try:
+        for i in range(num_images):
+            shard = i % num_shards
+            data = payloads[i % len(payloads)]
+            info = {'patch': f"patch_{shard:03d}", 'start_num': files[shard].tell()}
+            if base64_every and i % base64_every == 0:
+                data = base64.b64encode(data)
+                info['image_encoding'] = 'base64'
+            files[shard].write(data)
+            info['size'] = len(data)
+            patch_infos.append(info)
+    finally:
+        for f in files:
+            f.close()
+    return patch_infos
+
+
+def images_per_second(read, patch_infos):
+    start = time.perf_counter()
+    images = read(patch_infos)
+    return len(patch_infos) / (time.perf_counter() - start), images
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-images", type=int, default=2000)
+    parser.add_argument("--num-shards", type=int, default=8)
+    parser.add_argument("--image-size", type=int, nargs=2, default=[336, 336])
+    parser.add_argument("--base64-every", type=int, default=10, help="base64-encode every n-th record (0 for none)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        patch_infos = pack_shards(folder, args.num_images, args.num_shards, tuple(args.image_size), args.base64_every)
+        random.Random(args.seed).shuffle(patch_infos)
+
+        reader = PackedShardReader(folder)
+        fetch_legacy_rate, _ = images_per_second(lambda infos: [legacy_fetch(info, folder) for info in infos], patch_infos)
+        fetch_mapped_rate, _ = images_per_second(lambda infos: [sum(len(view) for view in reader.read_views(info)) for info in infos], patch_infos)
+        legacy_rate, legacy = images_per_second(lambda infos: [legacy_read_image_patch(info, folder) for info in infos], patch_infos)
+        mapped_rate, mapped = images_per_second(lambda infos: [reader.read_image(info) for info in infos], patch_infos)
+        identical = all(np.array_equal(np.asarray(a), np.asarray(b)) for a, b in zip(legacy, mapped))
+        print(f"{args.num_images} images {args.image_size[0]}x{args.image_size[1]} in {args.num_shards} shards, random order")
+        print(f"raw record fetch, open/seek/read: {fetch_legacy_rate:10.1f} records/s")
+        print(f"raw record fetch, pooled mmap:    {fetch_mapped_rate:10.1f} records/s ({fetch_mapped_rate / fetch_legacy_rate:.2f}x)")
+        print(f"open/seek/read per sample: {legacy_rate:8.1f} images/s")
+        print(f"pooled mmap, read_image:   {mapped_rate:8.1f} images/s ({mapped_rate / legacy_rate:.2f}x)")
+        print(f"identical images: {identical}")
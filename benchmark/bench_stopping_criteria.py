@@ -0,0 +1,122 @@
+"""Benchmark the per-step overhead of the keyword stopping criterion in a simulated decode loop.
+
+The previous criterion supports batch size 1 only, so for larger batches it is run on every row; the
+vectorized criterion matches token ids for the whole batch in one call and decodes only the tails of the
+rows that have not stopped. Rows generate random tokens and emit the ChatML
+stop string `<|im_end|>` at random steps:
+
+    python -m benchmark.bench_stopping_criteria --batch-sizes 1 8 32 --steps 256
+"""
+import argparse
+import time
+
+import torch
+
+from benchmark.bench_tokenizer_image_token import report_prompts, train_tokenizer
+from oryx.mm_utils import KeywordsStoppingCriteria
+
+
+class LegacyKeywordsStoppingCriteria:
+    """`KeywordsStoppingCriteria` before the vectorized suffix match."""
+
+    def __init__(self, keywords, tokenizer, input_ids):
+        self.keywords = keywords
+        self.keyword_ids = []
+        for keyword in keywords:
+            cur_keyword_ids = tokenizer(keyword).input_ids
+            if len(cur_keyword_ids) > 1 and cur_keyword_ids[0] == tokenizer.bos_token_id:
+                cur_keyword_ids = cur_keyword_ids[1:]
+            self.keyword_ids.append(torch.tensor(cur_keyword_ids))
+        self.tokenizer = tokenizer
+        self.start_len = input_ids.shape[1]
+
+    def __call__(self, output_ids, scores, **kwargs):
+        assert output_ids.shape[0] == 1, "Only support batch size 1 (yet)"
+        offset = min(output_ids.shape[1] - self.start_len, 3)
+        self.keyword_ids = [keyword_id.to(output_ids.device) for keyword_id in self.keyword_ids]
+        for keyword_id in self.keyword_ids:
+            if output_ids[0, -keyword_id.shape[0]:] == keyword_id:
+                return True
+        outputs = self.tokenizer.batch_decode(output_ids[:, -offset:], skip_special_tokens=True)[0]
+        for keyword in self.keywords:
+            if keyword in outputs:
+                return True
+        return False
+
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def simulated_tokens(batch_size, steps, vocab_size, stop_id, seed):
+    """Random generated tokens of shape (batch_size, steps) with each row's stop token at a random step."""
+    generator = torch.Generator().manual_seed(seed)
+    tokens = torch.randint(0, vocab_size, (batch_size, steps), generator=generator)
+    tokens[tokens == stop_id] = 0
+    stop_steps = torch.randint(steps // 4, steps, (batch_size,), generator=generator)
+    tokens[torch.arange(batch_size), stop_steps] = stop_id
+    return tokens
+
+
+def decode_loop(make_criteria, per_row, prompt_ids, tokens, device, inputs_embeds=False, criteria=None):
+    """Runs the criterion after every simulated step; returns seconds per step and each row's first stop step.
+
+    With `inputs_embeds`, the output ids hold only the generated tokens, as `generate` returns them when the
+    prompt is passed as embeddings (as `OryxQwenForCausalLM.generate` does). `criteria` reuses a criterion.
+    """
+    batch_size, steps = tokens.shape
+    prompt_len = 0 if inputs_embeds else prompt_ids.shape[1]
+    output_ids = tokens.to(device) if inputs_embeds else torch.cat([prompt_ids.expand(batch_size, -1), tokens], dim=1).to(device)
+    if criteria is None:
+        criteria = [make_criteria(prompt_ids.to(device)) for _ in range(batch_size)] if per_row else make_criteria(prompt_ids.to(device))
+    stopped_at = [None] * batch_size
+    elapsed = 0.0
+    for step in range(steps):
+        current = output_ids[:, :prompt_len + step + 1]
+        synchronize(device)
+        start = time.perf_counter()
+        if per_row:
+            finished = [criteria[row](current[row:row + 1], None) for row in range(batch_size)]
+        else:
+            finished = criteria(current, None).tolist()
+        synchronize(device)
+        elapsed += time.perf_counter() - start
+        for row, done in enumerate(finished):
+            if done and stopped_at[row] is None:
+                stopped_at[row] = step
+    return elapsed / steps, stopped_at
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--steps", type=int, default=256)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    tokenizer = train_tokenizer(report_prompts(200, args.seed), 4000)
+    stop_str = "<|im_end|>"
+    stop_id = tokenizer.convert_tokens_to_ids(stop_str)
+    prompt_ids = torch.tensor([tokenizer(report_prompts(1, args.seed + 1, with_answer=False)[0].replace("<image>", "")).input_ids])
+
+    print(f"{args.steps} decode steps, prompt of {prompt_ids.shape[1]} tokens, device {args.device}")
+    for batch_size in args.batch_sizes:
+        tokens = simulated_tokens(batch_size, args.steps, len(tokenizer), stop_id, args.seed + batch_size)
+        legacy_step, legacy_stops = decode_loop(lambda ids: LegacyKeywordsStoppingCriteria([stop_str], tokenizer, ids), True, prompt_ids, tokens, args.device)
+        batch_step, batch_stops = decode_loop(lambda ids: KeywordsStoppingCriteria([stop_str], tokenizer, ids), False, prompt_ids, tokens, args.device)
+        print(f"batch {batch_size:3d}: per row with decode {legacy_step * 1e6:9.1f} us/step  "
+              f"vectorized {batch_step * 1e6:7.1f} us/step ({legacy_step / batch_step:6.1f}x)  "
+              f"same stop steps: {legacy_stops == batch_stops}")
+
+    # Prompt passed as `inputs_embeds` (output ids are only the generated tokens), with a prompt longer than the
+    # output, and one criterion reused for a second generation
+    long_prompt_ids = prompt_ids.repeat(1, 500 // prompt_ids.shape[1] + 1)
+    tokens = simulated_tokens(4, 64, len(tokenizer), stop_id, args.seed)
+    _, legacy_stops = decode_loop(lambda ids: LegacyKeywordsStoppingCriteria([stop_str], tokenizer, ids), True, long_prompt_ids, tokens, args.device, inputs_embeds=True)
+    criteria = KeywordsStoppingCriteria([stop_str], tokenizer, long_prompt_ids.to(args.device))
+    _, first_stops = decode_loop(None, False, long_prompt_ids, tokens, args.device, inputs_embeds=True, criteria=criteria)
+    _, reused_stops = decode_loop(None, False, long_prompt_ids, tokens, args.device, inputs_embeds=True, criteria=criteria)
+    print(f"inputs_embeds, prompt of {long_prompt_ids.shape[1]} tokens: same stop steps as legacy {legacy_stops == first_stops}, "
+          f"all rows stop {None not in first_stops}, reused criterion {reused_stops == first_stops}")
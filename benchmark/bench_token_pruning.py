@@ -0,0 +1,85 @@
+"""Throughput vs. accuracy of in-encoder patch token pruning on high-resolution map-like images.
+
+The images are mostly smooth fields (as satellite and pressure maps are) with a few detailed regions.
+Each setting prunes after block `--layers` to a `--keep` fraction of tokens, scored by attention from the
+mean token or by feature norm, and fills the pruned slots with the features of the nearest kept token or
+the frozen features of the pruning block. Accuracy is the cosine similarity of the filled feature grid to
+the unpruned one: over all tokens, and over the kept ones. A reduced OryxViT (random weights) keeps the
+run short on CPU, so the similarities show the relative effect of the settings, not trained accuracy:
+
+    python -m benchmark.bench_token_pruning --image-size 1024 --layers 2 4 --keep 0.25 0.5 0.75
+"""
+import argparse
+import itertools
+import time
+
+import torch
+import torch.nn.functional as F
+
+import oryx.model.multimodal_encoder.oryx_vit as oryx_vit
+from oryx.model.multimodal_encoder.oryx_vit import VisionTransformer
+
+
+def map_images(num_images, size, seed):
+    """Smooth random fields with a few high-frequency patches, in [-1, 1] as the image processor normalizes them."""
+    generator = torch.Generator().manual_seed(seed)
+    coarse = torch.randn(num_images, 3, 8, 8, generator=generator)
+    images = F.interpolate(coarse, size=(size, size), mode="bicubic", align_corners=False)
+    for idx in range(num_images):
+        for _ in range(4):
+            top, left = torch.randint(0, size - size // 6, (2,), generator=generator).tolist()
+            images[idx, :, top:top + size // 6, left:left + size // 6] += torch.randn(3, size // 6, size // 6, generator=generator)
+    return images.clamp(-1, 1)
+
+
+def encode(vit, images, repeats):
+    with torch.no_grad():
+        start = time.perf_counter()
+        for _ in range(repeats):
+            features, _, _ = vit(images)
+    return features, images.shape[0] * repeats / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-images", type=int, default=2)
+    parser.add_argument("--image-size", type=int, default=1024)
+    parser.add_argument("--layers", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--keep", type=float, nargs="+", default=[0.25, 0.5, 0.75])
+    parser.add_argument("--scores", type=str, nargs="+", default=["norm", "attn"])
+    parser.add_argument("--fills", type=str, nargs="+", default=["nearest", "frozen"])
+    parser.add_argument("--width", type=int, default=384)
+    parser.add_argument("--depth", type=int, default=8)
+    parser.add_argument("--heads", type=int, default=6)
+    parser.add_argument("--repeats", type=int, default=1)
+    args = parser.parse_args()
+
+    vit = VisionTransformer(img_size=2048, patch_size=16, embed_dim=args.width, depth=args.depth, num_heads=args.heads,
+                            class_token=False, global_pool="map", dynamic_img_pad=False, strict_img_size=False,
+                            weight_init="skip", num_classes=0).eval()
+    images = map_images(args.num_images, args.image_size, seed=0)
+    tokens = (args.image_size // 16) ** 2
+    oryx_vit.VIT_PRUNE_MIN_TOKENS = 0
+
+    oryx_vit.VIT_PRUNE_LAYER = -1
+    encode(vit, images[:1], 1)  # warm-up
+    reference, base_rate = encode(vit, images, args.repeats)
+    print(f"{args.num_images} images of {args.image_size}px ({tokens} tokens), ViT {args.depth}x{args.width}, "
+          f"{torch.get_num_threads()} threads")
+    print(f"no pruning: {base_rate:6.2f} images/s")
+
+    oryx_vit.VIT_PRUNE_LAYER, oryx_vit.VIT_PRUNE_KEEP = args.layers[0], args.keep[0]
+    batched, _ = encode(vit, images, 1)
+    with torch.no_grad():
+        packed = torch.cat(vit([image[None] for image in images])[0])
+    print(f"packed list equals batched when pruning: {torch.allclose(batched, packed, atol=1e-5)}")
+
+    print(f"{'layer':>5} {'keep':>5} {'score':>6} {'fill':>8} {'images/s':>9} {'speed-up':>8} {'cos all':>8} {'cos kept':>8}")
+    for layer, keep, score, fill in itertools.product(args.layers, args.keep, args.scores, args.fills):
+        oryx_vit.VIT_PRUNE_LAYER, oryx_vit.VIT_PRUNE_KEEP = layer, keep
+        oryx_vit.VIT_PRUNE_SCORE, oryx_vit.VIT_PRUNE_FILL = score, fill
+        features, rate = encode(vit, images, args.repeats)
+        similarity = F.cosine_similarity(features, reference, dim=-1)
+        kept = torch.zeros_like(similarity, dtype=torch.bool).scatter(1, vit.last_kept_tokens[0], True)
+        print(f"{layer:5d} {keep:5.2f} {score:>6} {fill:>8} {rate:9.2f} {rate / base_rate:7.2f}x "
+              f"{similarity.mean().item():8.4f} {similarity[kept].mean().item():8.4f}")
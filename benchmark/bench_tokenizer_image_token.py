@@ -0,0 +1,110 @@
+"""Benchmark `tokenizer_image_token` against the chunk-cached single and batched variants.
+
+Prompts are built the way the report conversations are: the qwen_1_5 (ChatML) conversation template around
+`<image>` placeholders, the Thai `INSTRUCTION` with per-report fields, and a synthetic report as the
+answer. Pass `--tokenizer` to use a real (e.g. Qwen2) tokenizer; otherwise a byte-level BPE tokenizer
+is trained on the prompt set:
+
+    python -m benchmark.bench_tokenizer_image_token --num-prompts 2000 --tokenizer /path/to/Oryx-7B
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer, PreTrainedTokenizerFast
+
+from benchmark.synthetic_archive import synthetic_report
+from oryx.constants import IMAGE_TOKEN_INDEX
+from oryx.mm_utils import PROMPT_TOKEN_CACHE, tokenizer_image_token, tokenizer_image_token_batch
+from preprocess.detection_store import format_class_counts
+from preprocess.conversation import INSTRUCTION
+
+
+def legacy_tokenizer_image_token(prompt, tokenizer, image_token_index=IMAGE_TOKEN_INDEX, return_tensors=None):
+    """`tokenizer_image_token` before the chunk cache."""
+    prompt_chunks = [tokenizer(chunk).input_ids for chunk in prompt.split('<image>')]
+
+    def insert_separator(X, sep):
+        return [ele for sublist in zip(X, [sep]*len(X)) for ele in sublist][:-1]
+
+    input_ids = []
+    offset = 0
+    if len(prompt_chunks) > 0 and len(prompt_chunks[0]) > 0 and prompt_chunks[0][0] == tokenizer.bos_token_id:
+        offset = 1
+        input_ids.append(prompt_chunks[0][0])
+
+    for x in insert_separator(prompt_chunks, [image_token_index] * (offset + 1)):
+        input_ids.extend(x[offset:])
+
+    if return_tensors == 'pt':
+        return torch.tensor(input_ids, dtype=torch.long)
+    return input_ids
+
+
+# conv_templates["qwen_1_5"] formatted; oryx.conversation itself downloads a tokenizer on import
+CHATML_PROMPT = "<|im_start|>system\nYou are a helpful assistant.<|im_end|>\n<|im_start|>user\n{}<|im_end|>\n<|im_start|>assistant\n{}"
+
+
+def report_prompts(num_prompts, seed, with_answer=True):
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    prompts = []
+    for i in range(num_prompts):
+        num_sat, num_air = rng.randint(3, 7), rng.randint(3, 7)
+        counts = np_rng.integers(0, 4, size=(num_sat, 2))
+        date = f"2025{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+        instruction = INSTRUCTION.format(date, f"{i}_{date}", format_class_counts(counts), num_air, num_sat)
+        answer = synthetic_report(np_rng) + "<|im_end|>\n" if with_answer else ""
+        prompts.append(CHATML_PROMPT.format("<image>\n" * (num_sat + num_air) + instruction, answer))
+    return prompts
+
+
+def train_tokenizer(prompts, vocab_size):
+    from tokenizers import Tokenizer, models, pre_tokenizers, decoders, trainers
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    special_tokens = ["<|endoftext|>", "<|im_start|>", "<|im_end|>"]
+    tokenizer.train_from_iterator([prompt.replace("<image>", "") for prompt in prompts],
+                                  trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=special_tokens))
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|endoftext|>", additional_special_tokens=special_tokens[1:])
+
+
+def prompts_per_second(run, prompts, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = run(prompts)
+    return len(prompts) * repeats / (time.perf_counter() - start), result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-prompts", type=int, default=1000)
+    parser.add_argument("--tokenizer", type=str, default=None)
+    parser.add_argument("--vocab-size", type=int, default=8000)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Inference prompts end at the assistant turn, so everything but the report fields repeats
+    prompts = report_prompts(args.num_prompts, args.seed, with_answer=False)
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer) if args.tokenizer else train_tokenizer(report_prompts(500, args.seed + 1), args.vocab_size)
+
+    legacy_rate, legacy = prompts_per_second(lambda ps: [legacy_tokenizer_image_token(p, tokenizer) for p in ps], prompts, args.repeats)
+    PROMPT_TOKEN_CACHE.clear()
+    cold_rate, _ = prompts_per_second(lambda ps: [tokenizer_image_token(p, tokenizer) for p in ps], prompts, 1)
+    cached_rate, cached = prompts_per_second(lambda ps: [tokenizer_image_token(p, tokenizer) for p in ps], prompts, args.repeats)
+    PROMPT_TOKEN_CACHE.clear()
+    batch_cold_rate, _ = prompts_per_second(lambda ps: tokenizer_image_token_batch(ps, tokenizer), prompts, 1)
+    batch_rate, batch = prompts_per_second(lambda ps: tokenizer_image_token_batch(ps, tokenizer), prompts, args.repeats)
+
+    print(f"{len(prompts)} prompts, {np.mean([len(ids) for ids in legacy]):.0f} tokens on average, tokenizer {type(tokenizer).__name__}")
+    print(f"tokenizer_image_token before:  {legacy_rate:9.1f} prompts/s")
+    print(f"cached, first pass:            {cold_rate:9.1f} prompts/s ({cold_rate / legacy_rate:.2f}x)")
+    print(f"cached, warm:                  {cached_rate:9.1f} prompts/s ({cached_rate / legacy_rate:.2f}x)")
+    print(f"batched, first pass:           {batch_cold_rate:9.1f} prompts/s ({batch_cold_rate / legacy_rate:.2f}x)")
+    print(f"batched, warm:                 {batch_rate:9.1f} prompts/s ({batch_rate / legacy_rate:.2f}x)")
+    print(f"cache hits {PROMPT_TOKEN_CACHE.hits}, misses {PROMPT_TOKEN_CACHE.misses}")
+    print(f"identical input ids: {legacy == cached == batch}")
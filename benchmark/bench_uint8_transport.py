@@ -0,0 +1,79 @@
+"""Benchmark host memory and host-to-device volume of float32 vs. uint8 frame transport for one video.
+
+The float path is the previous `process_anyres_video_genli_batch(...).bfloat16().to(device)`; the uint8 path
+keeps the resized frames as pinned uint8 and normalizes them on the device with `normalize_on_device`:
+
+    python -m benchmark.bench_uint8_transport --num-frames 64 --frame-size 1280 720
+"""
+import argparse
+import gc
+import os
+import time
+
+for name, value in (("VIDEO_RESIZE", "0x64"), ("VIDEO_MAXRES", "480"), ("VIDEO_MINRES", "288")):
+    os.environ.setdefault(name, value)
+
+import numpy as np
+import torch
+from PIL import Image
+from io import BytesIO
+from transformers import CLIPImageProcessor
+
+from benchmark.preprocess_suite import PeakRSSSampler
+from benchmark.synthetic_archive import encode_jpeg
+from oryx.mm_utils import process_anyres_video_genli_batch, normalize_on_device
+
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def measure(name, run, device, repeats):
+    sampler = PeakRSSSampler(interval=0.001).start()
+    try:
+        run()  # warm-up
+        synchronize(device)
+        gc.collect()
+        sampler.reset()
+        baseline = sampler.peak
+        start = time.perf_counter()
+        for _ in range(repeats):
+            host, on_device = run()
+            synchronize(device)
+        seconds = (time.perf_counter() - start) / repeats
+        sampler.sample()
+    finally:
+        sampler.stop()
+    host_bytes = sum(tensor.nbytes for tensor in host)
+    print(f"{name:<7} {seconds * 1000:8.1f} ms/video  host tensors {host_bytes / 2**20:7.1f} MB  "
+          f"transferred {host[-1].nbytes / 2**20:7.1f} MB  peak RSS +{(sampler.peak - baseline) / 2**20:7.1f} MB  "
+          f"device tensor {tuple(on_device.shape)} {on_device.dtype}")
+    return on_device
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-frames", type=int, default=64)
+    parser.add_argument("--frame-size", type=int, nargs=2, default=[1280, 720])
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    processor = CLIPImageProcessor(do_resize=False, do_center_crop=False, image_mean=[0.5, 0.5, 0.5], image_std=[0.5, 0.5, 0.5])
+    payloads = [encode_jpeg(tuple(args.frame_size), seed) for seed in range(8)]
+    frames = np.stack([np.asarray(Image.open(BytesIO(payloads[i % len(payloads)])).convert("RGB")) for i in range(args.num_frames)])
+
+    def float_transport():
+        video = process_anyres_video_genli_batch(frames, processor)
+        video_bf16 = video.bfloat16()
+        return (video, video_bf16), video_bf16.to(args.device)
+
+    def uint8_transport():
+        video = process_anyres_video_genli_batch(frames, processor, normalize=False)
+        return (video,), normalize_on_device(video, processor, args.device)
+
+    print(f"{args.num_frames} frames {args.frame_size[0]}x{args.frame_size[1]} -> {args.device}")
+    before = measure("float32", float_transport, args.device, args.repeats)
+    after = measure("uint8", uint8_transport, args.device, args.repeats)
+    print(f"max abs difference on device: {(before.float() - after.float()).abs().max().item():.4f}")
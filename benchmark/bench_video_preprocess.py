@@ -0,0 +1,83 @@
+"""Benchmark per-frame PIL + CLIPImageProcessor preprocessing against the batched tensor path in `oryx.mm_utils`.
+
+Uses the resolution settings of the inference scripts unless they are already set in the environment:
+
+    python -m benchmark.bench_video_preprocess --num-frames 64 --frame-size 1280 720
+"""
+import argparse
+import os
+import time
+
+for name, value in (("LOWRES_RESIZE", "384x32"), ("VIDEO_RESIZE", "0x64"), ("HIGHRES_BASE", "0x32"), ("MAXRES", "1536"),
+                    ("MINRES", "0"), ("VIDEO_MAXRES", "480"), ("VIDEO_MINRES", "288")):
+    os.environ.setdefault(name, value)
+
+import numpy as np
+import torch
+from PIL import Image
+from io import BytesIO
+from transformers import CLIPImageProcessor
+
+from benchmark.synthetic_archive import encode_jpeg
+from oryx.mm_utils import (process_anyres_video_genli, process_anyres_video_genli_batch, process_anyres_highres_image_genli,
+                           process_anyres_highres_image_genli_batch, process_anyres_highres_image_genli_fused)
+
+
+def frames_per_second(num_frames, run, repeats):
+    run()  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = run()
+    return num_frames * repeats / (time.perf_counter() - start), result
+
+
+def max_abs_diff(a, b):
+    return max((x - y).abs().max().item() for x, y in zip(a, b))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-frames", type=int, default=64)
+    parser.add_argument("--frame-size", type=int, nargs=2, default=[1280, 720])
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=None)
+    # The uint8 resize kernels round differently from PIL's by up to 2 levels (1 level is 1 / 127.5 after normalizing)
+    parser.add_argument("--atol", type=float, default=2 / 127.5 + 1e-6, help="allowed max abs difference (2 uint8 levels)")
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    processor = CLIPImageProcessor(do_resize=False, do_center_crop=False, image_mean=[0.5, 0.5, 0.5], image_std=[0.5, 0.5, 0.5])
+    payloads = [encode_jpeg(tuple(args.frame_size), seed) for seed in range(8)]
+    frames = np.stack([np.asarray(Image.open(BytesIO(payloads[i % len(payloads)])).convert("RGB")) for i in range(args.num_frames)])
+
+    per_frame_rate, per_frame = frames_per_second(args.num_frames, lambda: torch.stack(
+        [process_anyres_video_genli(Image.fromarray(frame), processor) for frame in frames]), args.repeats)
+    batch_rate, batch = frames_per_second(args.num_frames, lambda: process_anyres_video_genli_batch(frames, processor), args.repeats)
+    video_diff = (per_frame - batch).abs()
+
+    image_rate, images = frames_per_second(args.num_frames, lambda: [
+        process_anyres_highres_image_genli(Image.fromarray(frame), processor) for frame in frames], args.repeats)
+    image_batch_rate, image_batch = frames_per_second(args.num_frames, lambda: process_anyres_highres_image_genli_batch(frames, processor), args.repeats)
+    lowres_diff = max_abs_diff([lowres for lowres, _ in images], image_batch[0])
+    highres_diff = max_abs_diff([highres for _, highres in images], image_batch[1])
+
+    # Single images straight from the encoded JPEG, as in process_image and OryxImage.generate_until
+    decode_rate, decoded = frames_per_second(len(payloads), lambda: [
+        process_anyres_highres_image_genli(Image.open(BytesIO(payload)).convert("RGB"), processor) for payload in payloads], args.repeats)
+    fused_rate, fused = frames_per_second(len(payloads), lambda: [
+        process_anyres_highres_image_genli_fused(payload, processor) for payload in payloads], args.repeats)
+    fused_diff = max(max_abs_diff(a, b) for a, b in zip(decoded, fused))
+
+    print(f"{args.num_frames} frames {args.frame_size[0]}x{args.frame_size[1]}, {torch.get_num_threads()} threads")
+    print(f"video, per frame:  {per_frame_rate:8.1f} frames/s")
+    print(f"video, batched:    {batch_rate:8.1f} frames/s ({batch_rate / per_frame_rate:.2f}x), output {tuple(batch.shape)}, "
+          f"max abs diff {video_diff.max().item():.4f}, mean {video_diff.mean().item():.6f}")
+    print(f"image, per image:  {image_rate:8.1f} images/s")
+    print(f"image, batched:    {image_batch_rate:8.1f} images/s ({image_batch_rate / image_rate:.2f}x), "
+          f"max abs diff lowres {lowres_diff:.4f}, highres {highres_diff:.4f}")
+    print(f"JPEG, decode+PIL:  {decode_rate:8.1f} images/s")
+    print(f"JPEG, fused:       {fused_rate:8.1f} images/s ({fused_rate / decode_rate:.2f}x), max abs diff {fused_diff:.4f}")
+    worst = max(video_diff.max().item(), lowres_diff, highres_diff, fused_diff)
+    print(f"max abs diff over all paths: {worst:.4f} ({worst * 127.5:.2f} uint8 levels), bound {args.atol * 127.5:.2f} levels")
+    assert worst <= args.atol, "batched preprocessing does not match the per-frame outputs"
@@ -0,0 +1,108 @@
+"""Parity and CPU latency of the OryxViT attention backends (flash, SDPA, chunked).
+
+Parity is checked against the math of the flash-attention calls in float64: non-causal softmax attention
+with the head-dim scale, dense over a batch, and over packed segments (`cu_slens`) that only attend to
+themselves. Latency is of one OryxViT attention layer (1152 wide, 16 heads) at several patch grids, and
+of a packed list of images as in `forward_features_list`:
+
+    python -m benchmark.bench_vit_attention --grids 24x24 32x32 48x48 --threads 4
+"""
+import argparse
+import time
+
+import torch
+
+import oryx.model.multimodal_encoder.oryx_vit as oryx_vit
+from oryx.model.multimodal_encoder.oryx_vit import Attention, flash_attn_func, vit_attention
+
+
+def reference_attention(q, k, v, scale, cu_slens=None):
+    """float64 attention over B×N×heads×head_dim q, k, v, per segment of `cu_slens` if given."""
+    q, k, v = q.double(), k.double(), v.double()
+    bounds = cu_slens.tolist() if cu_slens is not None else [0, q.shape[1]]
+    x = torch.empty_like(q)
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        scores = torch.einsum("bqhd,bkhd->bhqk", q[:, start:end], k[:, start:end]) * scale
+        x[:, start:end] = torch.einsum("bhqk,bkhd->bqhd", scores.softmax(dim=-1), v[:, start:end])
+    return x
+
+
+def cu_seqlens(lengths, device):
+    cu = [0]
+    for length in lengths:
+        cu.append(cu[-1] + length)
+    return torch.tensor(cu, dtype=torch.int32, device=device)
+
+
+def parse_grid(value):
+    h, w = value.split("x")
+    return int(h), int(w)
+
+
+def backends(device, dtype):
+    names = ["sdpa", "chunked"]
+    if flash_attn_func is not None and torch.device(device).type == "cuda" and dtype in (torch.float16, torch.bfloat16):
+        names.insert(0, "flash")
+    return names
+
+
+def check_parity(device, dtype, heads, head_dim):
+    generator = torch.Generator().manual_seed(0)
+    scale = head_dim ** -0.5
+    cases = {
+        "dense, batch 2, 24x24": (torch.randn(3, 2, 576, heads, head_dim, generator=generator), None),
+        "dense, 48x48": (torch.randn(3, 1, 2304, heads, head_dim, generator=generator), None),
+        "packed 24x24+32x20+16x16": (torch.randn(3, 1, 576 + 640 + 256, heads, head_dim, generator=generator), [576, 640, 256]),
+        "packed 3 x 16x16": (torch.randn(3, 1, 3 * 256, heads, head_dim, generator=generator), [256, 256, 256]),
+        "packed 24x24+16x16 x 2": (torch.randn(3, 1, 2 * (576 + 256), heads, head_dim, generator=generator), [576, 256, 576, 256]),
+    }
+    tolerance = 1e-4 if dtype == torch.float32 else 2e-2
+    all_close = True
+    for name, (qkv, lengths) in cases.items():
+        q, k, v = qkv.to(device, dtype).unbind(0)
+        cu_slens = cu_seqlens(lengths, device) if lengths else None
+        expected = reference_attention(q, k, v, scale, cu_slens)
+        for backend in backends(device, dtype):
+            error = (vit_attention(q, k, v, scale, cu_slens, backend=backend).double() - expected).abs().max().item()
+            all_close &= error <= tolerance
+            print(f"parity {name:<26} {backend:<8} max abs error {error:.2e}")
+    return all_close
+
+
+def latency(attention, x, cu_slens, backend, repeats):
+    oryx_vit.VIT_ATTN_BACKEND = backend
+    with torch.inference_mode():
+        attention(x, cu_slens=cu_slens)  # warm-up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            attention(x, cu_slens=cu_slens)
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grids", type=parse_grid, nargs="+", default=[(24, 24), (32, 32), (48, 48)])
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--dtype", type=str, default="float32", choices=["float32", "float16", "bfloat16"])
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    dtype = getattr(torch, args.dtype)
+    oryx_vit.VIT_ATTN_CHUNK = args.chunk_size
+
+    print(f"parity: {'ok' if check_parity(args.device, dtype, 16, 72) else 'FAILED'}")
+
+    attention = Attention(1152, num_heads=16, qkv_bias=True).to(args.device, dtype).eval()
+    cases = [(f"{h}x{w}", torch.randn(1, h * w, 1152), None) for h, w in args.grids]
+    lengths = [h * w for h, w in args.grids]
+    cases.append(("packed " + "+".join(f"{h}x{w}" for h, w in args.grids), torch.randn(1, sum(lengths), 1152), lengths))
+    print(f"one attention layer on {args.device}, {args.dtype}, {torch.get_num_threads()} threads, chunk {args.chunk_size}")
+    for name, x, lengths in cases:
+        x = x.to(args.device, dtype)
+        cu_slens = cu_seqlens(lengths, args.device) if lengths else None
+        timings = "  ".join(f"{backend} {latency(attention, x, cu_slens, backend, args.repeats) * 1000:8.1f} ms"
+                            for backend in backends(args.device, dtype))
+        print(f"{name:<28} {x.shape[1]:6d} tokens  {timings}")
@@ -0,0 +1,125 @@
+"""Compile overhead and warm latency of the shape-bucketed torch.compile mode of OryxViT on CPU (inductor).
+
+Images of several patch grids go through the ViT eagerly and with `enable_compile`, which pads each token
+sequence to its bucket and runs it compiled with the padding masked out, with a static token count per
+bucket and a dynamic batch size. For every grid: the first (compiling) call, the warm latency against
+eager, the difference to eager, and the graphs compiled when further grids of the same bucket arrive.
+Further batch sizes of a bucket then reuse its graph. A tiny ViT runs through more buckets than dynamo's
+default recompile limit, each bucket still compiling instead of falling back to eager. A reduced OryxViT
+(random weights) keeps compilation short:
+
+    python -m benchmark.bench_vit_compile --grids 16x16 20x24 24x24 30x32 32x32 --buckets 576 1024
+"""
+import argparse
+import time
+
+import torch
+import torch._dynamo
+
+from oryx.model.multimodal_encoder.oryx_vit import VisionTransformer
+
+
+def parse_grid(value):
+    h, w = value.split("x")
+    return int(h), int(w)
+
+
+def timed(vit, images, repeats=1):
+    with torch.no_grad():
+        start = time.perf_counter()
+        for _ in range(repeats):
+            features, _, _ = vit(images)
+    return features, (time.perf_counter() - start) / repeats
+
+
+def graphs():
+    return torch._dynamo.utils.counters["stats"]["unique_graphs"]
+
+
+def build_vit(width, depth, heads):
+    return VisionTransformer(img_size=2048, patch_size=16, embed_dim=width, depth=depth, num_heads=heads,
+                             class_token=False, global_pool="map", dynamic_img_pad=False, strict_img_size=False,
+                             weight_init="skip", num_classes=0).eval()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grids", type=parse_grid, nargs="+", default=[(16, 16), (20, 24), (24, 24), (30, 32), (32, 32)])
+    parser.add_argument("--buckets", type=int, nargs="+", default=[576, 1024])
+    parser.add_argument("--batch", type=int, default=2)
+    parser.add_argument("--width", type=int, default=384)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--heads", type=int, default=6)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--many-buckets", type=int, default=10, help="buckets of the recompile limit check, 0 to skip")
+    args = parser.parse_args()
+
+    vit = build_vit(args.width, args.depth, args.heads)
+    generator = torch.Generator().manual_seed(0)
+    images = {grid: torch.randn(args.batch, 3, grid[0] * 16, grid[1] * 16, generator=generator) for grid in args.grids}
+    print(f"ViT {args.depth}x{args.width}, batches of {args.batch}, buckets {args.buckets} tokens, "
+          f"{torch.get_num_threads()} threads")
+
+    eager = {}
+    for grid, x in images.items():
+        timed(vit, x)  # warm-up
+        eager[grid] = timed(vit, x, args.repeats)
+
+    vit.enable_compile(args.buckets)
+    start_graphs = graphs()
+    print(f"{'grid':>6} {'tokens':>6} {'bucket':>6} {'first call':>10} {'eager':>9} {'compiled':>9} {'speed-up':>8} "
+          f"{'new graphs':>10} {'max abs diff':>12}")
+    for grid, x in images.items():
+        bucket = vit.compile_bucket(grid[0] * grid[1])
+        before = graphs()
+        _, first = timed(vit, x)
+        features, latency = timed(vit, x, args.repeats)
+        eager_features, eager_latency = eager[grid]
+        print(f"{grid[0]:>3}x{grid[1]:<2} {grid[0] * grid[1]:6d} {str(bucket):>6} {first:9.2f}s {eager_latency * 1000:7.1f}ms "
+              f"{latency * 1000:7.1f}ms {eager_latency / latency:7.2f}x {graphs() - before:10d} "
+              f"{(features - eager_features).abs().max().item():12.2e}")
+
+    used_buckets = {vit.compile_bucket(grid[0] * grid[1]) for grid in args.grids} - {None}
+    print(f"graphs compiled: {graphs() - start_graphs}, buckets used: {len(used_buckets)}")
+
+    # Other batch sizes of a bucket reuse its dynamic-batch graph
+    grid, x = next(iter(images.items()))
+    before = graphs()
+    with torch.no_grad():
+        features, _, _ = vit(torch.cat([x, x[:1]]))
+        vit.compile_buckets = None
+        eager_features, _, _ = vit(torch.cat([x, x[:1]]))
+        vit.compile_buckets = sorted(args.buckets)
+    print(f"batch of {x.shape[0] + 1} at {grid[0]}x{grid[1]}: new graphs {graphs() - before}, "
+          f"max abs diff to eager {(features - eager_features).abs().max().item():.2e}")
+
+    # A packed list of mixed grids: each bucket's images are stacked into that bucket's graph
+    x_list = [x[:1] for x in images.values()]
+    with torch.no_grad():
+        vit.compile_buckets = None
+        eager_list, _, _ = vit(x_list)
+        vit.compile_buckets = sorted(args.buckets)
+        before = graphs()
+        compiled_list, _, _ = vit(x_list)
+    error = max((a - b).abs().max().item() for a, b in zip(eager_list, compiled_list))
+    print(f"packed list of {len(x_list)} images: max abs diff to eager {error:.2e}, "
+          f"new graphs {graphs() - before} (batches of 1 of their buckets)")
+
+    if args.many_buckets:
+        # More buckets than dynamo's default recompile limit: the limit is raised to fit them, so none falls back to eager
+        tiny = build_vit(64, 1, 2)
+        buckets = [16 * (idx + 1) ** 2 for idx in range(args.many_buckets)]
+        tiny.enable_compile(buckets)
+        before = graphs()
+        error = 0.0
+        with torch.no_grad():
+            for bucket in buckets:
+                x = torch.randn(1, 3, 16 * int(bucket ** 0.5) - 16, 16 * int(bucket ** 0.5) - 16)
+                compiled, _, _ = tiny(x)
+                tiny.compile_buckets = None
+                eager_features, _, _ = tiny(x)
+                tiny.compile_buckets = buckets
+                error = max(error, (compiled - eager_features).abs().max().item())
+        limit = getattr(torch._dynamo.config, "recompile_limit", None) or torch._dynamo.config.cache_size_limit
+        print(f"{len(buckets)} buckets (default recompile limit {limit}): graphs compiled "
+              f"{graphs() - before}, max abs diff to eager {error:.2e}")
@@ -0,0 +1,103 @@
+"""Peak memory and parity of streamed (token-budgeted) OryxViT inference on long videos.
+
+A video of `--frames` frames goes through the ViT as one batch of frames (`forward_features`, as the
+high-resolution video branch does) and as a list of frames (`forward_features_list`), in one pass and
+streamed in groups of at most `--budget` patch tokens (VIT_STREAM_TOKENS). Each run is a separate process,
+so its peak RSS above the loaded model and input frames is the activation memory. The ViT has the width of
+OryxViT (1152, 16 heads) but few blocks, since inference frees the activations of every block:
+
+    python -m benchmark.bench_vit_streaming --frames 16 32 64 --frame-size 288x480 --budget 4096
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import torch
+
+import oryx.model.multimodal_encoder.oryx_vit as oryx_vit
+from oryx.model.multimodal_encoder.oryx_vit import VisionTransformer
+
+
+def parse_size(value):
+    height, width = value.split("x")
+    return int(height), int(width)
+
+
+def build_vit(depth):
+    return VisionTransformer(img_size=2048, patch_size=16, embed_dim=1152, depth=depth, num_heads=16, mlp_ratio=3.7362,
+                             class_token=False, global_pool="map", dynamic_img_pad=False, strict_img_size=False,
+                             weight_init="skip", num_classes=0).eval()
+
+
+def video(frames, frame_size):
+    generator = torch.Generator().manual_seed(0)
+    return torch.randn(frames, 3, *frame_size, generator=generator)
+
+
+def encode(vit, frames, mode):
+    with torch.no_grad():
+        if mode == "frames":
+            return vit(frames)[0]
+        return torch.cat(vit(list(frames.split(1)))[0], dim=1)
+
+
+def child(args):
+    """One run in this process: activation peak RSS in MB above the model and input, and seconds."""
+    vit = build_vit(args.depth)
+    frames = video(args.child_frames, args.frame_size)
+    oryx_vit.VIT_STREAM_TOKENS = args.child_budget
+    encode(vit, frames[:1], args.child_mode)  # warm-up
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    encode(vit, frames, args.child_mode)
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"peak_mb": (peak - baseline) / 1024, "seconds": seconds}))
+
+
+def measure(args, frames, mode, budget):
+    command = [sys.executable, "-m", "benchmark.bench_vit_streaming", "--child-frames", str(frames), "--child-mode", mode,
+               "--child-budget", str(budget), "--frame-size", f"{args.frame_size[0]}x{args.frame_size[1]}",
+               "--depth", str(args.depth)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, nargs="+", default=[16, 32, 64])
+    parser.add_argument("--frame-size", type=parse_size, default=(288, 480))
+    parser.add_argument("--budget", type=int, default=4096)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--parity-frames", type=int, default=8)
+    parser.add_argument("--child-frames", type=int, default=None)
+    parser.add_argument("--child-mode", type=str, default="frames")
+    parser.add_argument("--child-budget", type=int, default=0)
+    args = parser.parse_args()
+    if args.child_frames is not None:
+        child(args)
+        sys.exit()
+
+    vit = build_vit(args.depth)
+    frames = video(args.parity_frames, args.frame_size)
+    tokens = (args.frame_size[0] // 16) * (args.frame_size[1] // 16)
+    parity_budget = max(1, tokens * args.parity_frames // 3)
+    for mode in ("frames", "list"):
+        oryx_vit.VIT_STREAM_TOKENS = 0
+        single = encode(vit, frames, mode)
+        oryx_vit.VIT_STREAM_TOKENS = parity_budget
+        streamed = encode(vit, frames, mode)
+        print(f"parity {mode:<6} {args.parity_frames} frames, budget {parity_budget}: identical {torch.equal(single, streamed)}, "
+              f"max abs difference {(single - streamed).abs().max().item():.2e}")
+
+    print(f"frames of {args.frame_size[0]}x{args.frame_size[1]} ({tokens} tokens), ViT {args.depth}x1152, "
+          f"streamed budget {args.budget} tokens, {torch.get_num_threads()} threads")
+    for num_frames in args.frames:
+        for mode in ("frames", "list"):
+            single = measure(args, num_frames, mode, 0)
+            streamed = measure(args, num_frames, mode, args.budget)
+            print(f"{num_frames:3d} frames as {mode:<6} one pass: peak +{single['peak_mb']:7.1f} MB {single['seconds']:6.2f}s  "
+                  f"streamed: peak +{streamed['peak_mb']:7.1f} MB {streamed['seconds']:6.2f}s")
@@ -0,0 +1,144 @@
+"""End-to-end preprocessing benchmark on a synthetic report archive.
+
+Times every stage of `preprocess/` on a generated `data/` tree and records wall time, per-stage time and
+peak RSS as JSON, so throughput regressions show up before they reach the nightly refresh:
+
+    python -m benchmark.preprocess_suite --num-reports 500 --sat-images 7 --air-images 7 --output suite.json
+"""
+import argparse
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from benchmark.synthetic_archive import generate_archive
+from preprocess.file_extraction import create_dataset_list, split_train_val_test
+from preprocess.text_cleaning import clean_texts
+
+
+def current_rss():
+    """Resident set size of this process in bytes (Linux), or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class PeakRSSSampler:
+    """Samples the RSS of this process in a background thread and keeps the peak since `reset`."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        rss = current_rss()
+        if rss is not None:
+            self.peak = max(self.peak, rss)
+
+    def reset(self):
+        self.peak = 0
+        self.sample()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class StageTimer:
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name, **info):
+        self.sampler.reset()
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        self.sampler.sample()
+        self.stages[name] = {"seconds": round(seconds, 4), "peak_rss_mb": round(self.sampler.peak / 2**20, 1), **info}
+        print(f"{name:<28} {seconds:8.2f}s  peak RSS {self.sampler.peak / 2**20:8.1f} MB")
+
+
+def run_suite(root, cache_dir, num_proc=None):
+    sampler = PeakRSSSampler().start()
+    timer = StageTimer(sampler)
+    start = time.perf_counter()
+    try:
+        with timer.stage("create_dataset_list"):
+            records = create_dataset_list(root, num_proc=num_proc)
+
+        text_folder = os.path.join(root, "text")
+        texts = []
+        for name in sorted(os.listdir(text_folder)):
+            with open(os.path.join(text_folder, name), "r", encoding="utf-8") as f:
+                texts.append(f.read().strip())
+        with timer.stage("clean_text", reports=len(texts)):
+            clean_texts(texts, num_proc=num_proc)
+
+        shard_dir = os.path.join(cache_dir, "shards")
+        with timer.stage("split_train_val_test", images=sum(len(r["image"]) for r in records)):
+            splits = split_train_val_test(records, shard_dir=shard_dir, num_proc=num_proc)
+        with timer.stage("split_train_val_test_cached"):
+            splits = split_train_val_test(records, shard_dir=shard_dir, num_proc=num_proc)
+
+        with timer.stage("conversation_conversion", samples=sum(len(split) for split in splits)):
+            for split in splits:
+                for sample in split:
+                    for message in sample["messages"]:
+                        for item in message["content"]:
+                            if item["type"] == "image":
+                                item["image"].load()
+    finally:
+        sampler.stop()
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {
+        "wall_time": round(time.perf_counter() - start, 4),
+        "stages": timer.stages,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_worker_rss_mb": round(children / 1024, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-reports", type=int, default=200)
+    parser.add_argument("--sat-images", type=int, default=7)
+    parser.add_argument("--air-images", type=int, default=7)
+    parser.add_argument("--image-size", type=int, nargs=2, default=[1024, 768])
+    parser.add_argument("--num-proc", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", type=str, default=None, help="where the synthetic archive is generated (default: a temp dir)")
+    parser.add_argument("--output", type=str, default=None, help="JSON file for the results")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmp:
+        root = os.path.join(tmp, "data")
+        generate_start = time.perf_counter()
+        generate_archive(root, args.num_reports, args.sat_images, args.air_images, tuple(args.image_size), seed=args.seed)
+        print(f"generated {args.num_reports} reports in {time.perf_counter() - generate_start:.2f}s")
+
+        results = run_suite(root, os.path.join(tmp, "train_cache"), num_proc=args.num_proc)
+
+    results["config"] = {key: value for key, value in vars(args).items() if key not in ("output", "workdir")}
+    print(f"wall time {results['wall_time']:.2f}s, peak RSS {results['peak_rss_mb']:.1f} MB")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,119 @@
+"""Synthetic report archive in the `data/` layout read by `preprocess.file_extraction`.
+
+    <root>/text/<base>.txt                      Thai weekly report
+    <root>/img_final/<base>_sat_<i>.jpeg        satellite frames
+    <root>/img_air_pressure/<base>_air_<i>.jpeg air-pressure maps
+    <root>/img_metadata/<base>_sat_<i>.json     cloud / typhoon detections
+"""
+import argparse
+import json
+import os
+import random
+from datetime import date, timedelta
+from io import BytesIO
+
+REPORT_LINES = [
+    "สภาพอากาศ",
+    "สัปดาห์ที่ผ่านมา",
+    "ลักษณะกลุ่มเมฆจากภาพถ่ายดาวเทียม",
+    "บริเวณความกดอากาศต ่าปกคลุมภาคเหนือและภาคตะวันออกเฉียงเหนือ ท าให้มีฝนตกหนักบางแห่ง",
+    "ร่องมรสุมพาดผ่านภาคกลาง ภาคตะวันออก และภาคใต้ตอนบน มีก าลังค่อนข้างแรง",
+    "12 พฤษภาคม 2567 เวลา 07.00 น.",
+    "ที่มา: กรมอุตุนิยมวิทยา",
+    "https://www.tmd.go.th/weather/map",
+    "ภาพแผนที่อากาศ กรมอุตุนิยมวิทยา",
+    "คลื่นลมทะเลอันดามันมีก าลังปานกลาง คลื่นสูง 1-2 เมตร ในช่วงสัปดาห์นี้",
+    "พายุไต้ฝุ่นบริเวณทะเลจีนใต้ตอนบนมีแนวโน้มเคลื่อนตัวทางทิศตะวันตกเฉียงเหนือ",
+    "Digital Typhoon: Typhoon Images and Information",
+    "อุณหภูมิต ่าสุด 22-25 องศาเซลเซียส อุณหภูมิสูงสุด 33-36 องศาเซลเซียส",
+    "3",
+    "ข้อมูลเพิ่มเติม:",
+]
+
+
+def synthetic_report(rng, num_lines=40):
+    return "\n".join(rng.choice(REPORT_LINES) for _ in range(num_lines))
+
+
+def synthetic_detections(rng, image_names, max_detections=6):
+    return {
+        name: {
+            "detections": [
+                {
+                    "class_id": rng.randint(0, 1),
+                    "bbox": [rng.randint(0, 200), rng.randint(0, 200), rng.randint(8, 56), rng.randint(8, 56)],
+                    "score": round(rng.random(), 4),
+                }
+                for _ in range(rng.randint(0, max_detections))
+            ]
+        }
+        for name in image_names
+    }
+
+
+def encode_jpeg(size, seed):
+    """Returns JPEG bytes of a gradient with cloud-like blobs and light noise, roughly as compressible as a weather map."""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    w, h = size
+    y, x = np.mgrid[0:h, 0:w]
+    base = np.stack([(x * 255 // max(w - 1, 1)), (y * 255 // max(h - 1, 1)), ((x + y) * 127 // max(w + h - 2, 1))], axis=-1)
+    blobs = np.kron(rng.integers(-60, 60, size=(h // 32 + 1, w // 32 + 1, 3)), np.ones((32, 32, 1), dtype=np.int64))[:h, :w]
+    pixels = np.clip(base + blobs + rng.integers(-6, 7, size=base.shape), 0, 255).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def generate_archive(root, num_reports=100, sat_images=7, air_images=7, image_size=(1024, 768), num_variants=8, seed=0, empty_images=False):
+    """Writes `num_reports` weekly reports under `root` and returns their base names.
+
+    JPEG payloads are drawn from `num_variants` pre-encoded images so large archives stay fast to create;
+    with `empty_images` the image files are left empty, which is enough for listing-only benchmarks.
+    """
+    rng = random.Random(seed)
+    folders = {name: os.path.join(root, name) for name in ("text", "img_final", "img_air_pressure", "img_metadata")}
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok=True)
+
+    payloads = [b""] if empty_images else [encode_jpeg(image_size, seed + i) for i in range(num_variants)]
+
+    base_names = []
+    start = date(2018, 1, 1)
+    for i in range(num_reports):
+        # Reports are weekly; the index keeps base names unique once the calendar wraps past 2025
+        report_day = start + timedelta(weeks=i % 400)
+        base_name = f"{i}_{report_day.strftime('%Y%m%d')}"
+        base_names.append(base_name)
+
+        with open(os.path.join(folders["text"], base_name + ".txt"), "w", encoding="utf-8") as f:
+            f.write(synthetic_report(rng))
+
+        for j in range(sat_images):
+            image_name = f"{base_name}_sat_{j}.jpeg"
+            with open(os.path.join(folders["img_final"], image_name), "wb") as f:
+                f.write(payloads[rng.randrange(len(payloads))])
+            with open(os.path.join(folders["img_metadata"], f"{base_name}_sat_{j}.json"), "w") as f:
+                json.dump(synthetic_detections(rng, [image_name]), f)
+
+        for j in range(air_images):
+            with open(os.path.join(folders["img_air_pressure"], f"{base_name}_air_{j}.jpeg"), "wb") as f:
+                f.write(payloads[rng.randrange(len(payloads))])
+
+    return base_names
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root", type=str)
+    parser.add_argument("--num-reports", type=int, default=100)
+    parser.add_argument("--sat-images", type=int, default=7)
+    parser.add_argument("--air-images", type=int, default=7)
+    parser.add_argument("--image-size", type=int, nargs=2, default=[1024, 768])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--empty-images", action="store_true")
+    args = parser.parse_args()
+
+    generate_archive(args.root, args.num_reports, args.sat_images, args.air_images, tuple(args.image_size), seed=args.seed, empty_images=args.empty_images)
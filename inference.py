@@ -7,12 +7,11 @@ import numpy as np
 from typing import Dict, Optional, Sequence, List
 import transformers
 from transformers import AutoConfig
-from PIL import Image
 
 from oryx.conversation import conv_templates, SeparatorStyle
 from oryx.model.builder import load_pretrained_model
 from oryx.utils import disable_torch_init
-from oryx.mm_utils import tokenizer_image_token, get_model_name_from_path, KeywordsStoppingCriteria, process_anyres_video_genli
+from oryx.mm_utils import tokenizer_image_token, get_model_name_from_path, KeywordsStoppingCriteria, process_anyres_video_genli, process_anyres_video_genli_batch, normalize_on_device
 from oryx.constants import IGNORE_INDEX, DEFAULT_IMAGE_TOKEN, IMAGE_TOKEN_INDEX
 
 from decord import VideoReader, cpu
@@ -116,7 +115,6 @@ def eval_model(args):
     uniform_sampled_frames = np.linspace(0, total_frame_num - 1, args.frames_upbound, dtype=int)
     frame_idx = uniform_sampled_frames.tolist()
     spare_frames = vr.get_batch(frame_idx).asnumpy()
-    video = [Image.fromarray(frame) for frame in spare_frames]
 
     args.conv_mode = "qwen_1_5"
     
@@ -133,18 +131,14 @@ def eval_model(args):
     elif '34b' in model_path:
         input_ids = tokenizer_image_token(prompt, tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt").unsqueeze(0).to('cuda:0')
 
-    video_processed = []
-    for idx, frame in enumerate(video):
-        image_processor.do_resize = False
-        image_processor.do_center_crop = False
-        frame = process_anyres_video_genli(frame, image_processor)
+    image_processor.do_resize = False
+    image_processor.do_center_crop = False
+    video_processed = process_anyres_video_genli_batch(spare_frames, image_processor, normalize=False)
 
-        video_processed.append(frame.unsqueeze(0))
-    
     if frame_idx is None:
         frame_idx = np.arange(0, len(video_processed), dtype=int).tolist()
     
-    video_processed = torch.cat(video_processed, dim=0).bfloat16().cuda()
+    video_processed = normalize_on_device(video_processed, image_processor, 'cuda', torch.bfloat16)
     video_processed = (video_processed, video_processed)
 
     video_data = (video_processed, (384, 384), "video")
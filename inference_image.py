@@ -11,7 +11,7 @@ from PIL import Image
 from oryx.conversation import conv_templates, SeparatorStyle
 from oryx.model.builder import load_pretrained_model
 from oryx.utils import disable_torch_init
-from oryx.mm_utils import tokenizer_image_token, get_model_name_from_path, KeywordsStoppingCriteria, process_anyres_video_genli, process_anyres_highres_image_genli
+from oryx.mm_utils import tokenizer_image_token, get_model_name_from_path, KeywordsStoppingCriteria, process_anyres_video_genli, process_anyres_highres_image_genli, process_anyres_highres_image_genli_fused
 from oryx.constants import IGNORE_INDEX, DEFAULT_IMAGE_TOKEN, IMAGE_TOKEN_INDEX
 
 from decord import VideoReader, cpu
@@ -124,7 +124,7 @@ def eval_model(args):
     image_processor.do_resize = False
     image_processor.do_center_crop = False
 
-    image_tensor_, image_highres_tensor_ = process_anyres_highres_image_genli(visual, image_processor)
+    image_tensor_, image_highres_tensor_ = process_anyres_highres_image_genli_fused(visual, image_processor)
 
     image_tensor.append(image_tensor_)
     image_highres_tensor.append(image_highres_tensor_)
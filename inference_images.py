@@ -12,13 +12,14 @@ from PIL import Image
 from oryx.conversation import conv_templates, SeparatorStyle
 from oryx.model.builder import load_pretrained_model
 from oryx.utils import disable_torch_init
-from oryx.mm_utils import tokenizer_image_token, get_model_name_from_path, KeywordsStoppingCriteria, process_anyres_video_genli, process_anyres_highres_image_genli
+from oryx.mm_utils import tokenizer_image_token, get_model_name_from_path, KeywordsStoppingCriteria, process_anyres_video_genli, process_anyres_highres_image_genli_batch, normalize_on_device
 from oryx.constants import IGNORE_INDEX, DEFAULT_IMAGE_TOKEN, IMAGE_TOKEN_INDEX
 
 from decord import VideoReader, cpu
 
 # --- Add: Import dataset creation and splitting ---
 from preprocess.file_extraction import create_dataset_list, split_train_val_test
+from preprocess.image_cache import ResizedImageCache
 
 def split_list(lst, n):
     """Split a list into n (roughly) equal-sized chunks"""
@@ -83,7 +84,7 @@ def preprocess_qwen(sources, tokenizer: transformers.PreTrainedTokenizer, has_im
     targets = torch.tensor(targets, dtype=torch.long)
     return input_ids
 
-def eval_model(args, image_files, prompt):
+def eval_model(args, image_files, prompt, image_cache=None):
     # Model
     disable_torch_init()
     model_path = args.model_path
@@ -110,7 +111,7 @@ def eval_model(args, image_files, prompt):
     conv.append_message(conv.roles[1], None)
     prompt = conv.get_prompt()
 
-    image_tensor, image_highres_tensor = [], []
+    visuals_resized = []
     image_sizes = []
     
     image_processor.do_resize = False
@@ -122,22 +123,23 @@ def eval_model(args, image_files, prompt):
             visual = Image.open(image_file)
         else:
             visual = image_file  # Already a PIL image
-        visual_resized = visual.resize((384, 384), Image.BICUBIC)
-        image_tensor_, image_highres_tensor_ = process_anyres_highres_image_genli(visual_resized, image_processor)
-        image_tensor.append(image_tensor_)
-        image_highres_tensor.append(image_highres_tensor_)
+        # Only original files are worth caching; hashing decoded (already small) images costs as much as resizing them
+        if image_cache is not None and isinstance(image_file, str):
+            visual_resized = Image.fromarray(np.asarray(image_cache.resized_file(image_file, (384, 384))))
+        else:
+            visual_resized = visual.resize((384, 384), Image.BICUBIC)
+        visuals_resized.append(visual_resized)
         image_sizes.append(visual.size)
+    # All images are 384x384 here, so they are preprocessed in one batch
+    image_tensor, image_highres_tensor = process_anyres_highres_image_genli_batch(visuals_resized, image_processor, normalize=False)
 
     if '7b' in model_path:
         input_ids = preprocess_qwen([{'from': 'human','value': prompt},{'from': 'gpt','value': None}], tokenizer, has_image=True).cuda()
     elif '34b' in model_path:
         input_ids = tokenizer_image_token(prompt, tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt").unsqueeze(0).to('cuda:0')
 
-    image_tensor = torch.stack(image_tensor, dim=0)
-    image_highres_tensor = torch.stack(image_highres_tensor, dim=0)
-
-    image_tensor = image_tensor.to(dtype=torch.bfloat16, device='cuda')
-    image_highres_tensor = image_highres_tensor.to(dtype=torch.bfloat16, device='cuda')
+    image_tensor = normalize_on_device(image_tensor, image_processor, 'cuda')
+    image_highres_tensor = normalize_on_device(image_highres_tensor, image_processor, 'cuda')
     
     stop_str = conv.sep if conv.sep_style != SeparatorStyle.TWO else conv.sep2
     keywords = [stop_str]
@@ -180,14 +182,10 @@ if __name__ == "__main__":
     args = parser.parse_args()
     
     # --- Load test dataset from preprocessing ---
-    dataset_list = create_dataset_list(args.mapped_images_folder)
+    dataset_list = create_dataset_list(args.mapped_images_folder, num_proc=os.cpu_count(), manifest_path="train_cache/manifest.json", detection_store_path="train_cache/detections.npz")
     os.makedirs("train_cache", exist_ok=True)
-    _, _, test_conversation_dataset = split_train_val_test(
-        dataset_list,
-        train_json_path="train_cache/train_conversation.json",
-        validation_json_path="train_cache/validation_conversation.json",
-        test_json_path="train_cache/test_conversation.json"
-    )
+    image_cache = ResizedImageCache("train_cache/images")
+    _, _, test_conversation_dataset = split_train_val_test(dataset_list, shard_dir="train_cache/shards", num_proc=os.cpu_count(), image_cache=image_cache)
 
     if len(test_conversation_dataset) == 0:
         print("No test samples found.")
@@ -209,7 +207,7 @@ if __name__ == "__main__":
         print(f"Processing sample with prompt: {prompt}")
         print(f"Image files: {image_files}")
         
-        output = eval_model(args, image_files, prompt)
+        output = eval_model(args, image_files, prompt, image_cache=image_cache)
         outputs.append(output)
         
     # Save outputs to a file
@@ -24,7 +24,7 @@ import os
 from oryx.model.language_model.oryx_llama import OryxConfig
 
 from oryx.model.builder import load_pretrained_model
-from oryx.mm_utils import tokenizer_image_token, get_model_name_from_path, KeywordsStoppingCriteria, process_anyres_video_genli
+from oryx.mm_utils import tokenizer_image_token, get_model_name_from_path, KeywordsStoppingCriteria, process_anyres_video_genli, process_anyres_video_genli_batch, normalize_on_device
 from oryx.constants import IMAGE_TOKEN_INDEX, DEFAULT_IMAGE_TOKEN, DEFAULT_IM_START_TOKEN, DEFAULT_IM_END_TOKEN
 from oryx.conversation import conv_templates, SeparatorStyle
 
@@ -288,12 +288,9 @@ class Oryx(lmms):
                     frames = [visuals[i] for i in indices]
                     video = np.stack([np.array(x) for x in frames])
                     modality = 'video'
-                    frames = []
-                    for frame in video:
-                        self._image_processor.do_resize = False
-                        self._image_processor.do_center_crop = False
-                        frames.append(process_anyres_video_genli(Image.fromarray(frame).convert('RGB'), self._image_processor))
-                    video = torch.stack(frames, dim=0).bfloat16().to(self.device)
+                    self._image_processor.do_resize = False
+                    self._image_processor.do_center_crop = False
+                    video = normalize_on_device(process_anyres_video_genli_batch(video, self._image_processor, normalize=False), self._image_processor, self.device)
                     videos.append(video)
                     modalities.append(modality)
                 else:
@@ -303,12 +300,9 @@ class Oryx(lmms):
                         elif self.video_decode_backend == "pyav":
                             video, modality = read_video_pyav(visual, num_frm=self.max_frames_num)
                         # video = self.load_video(visual, self.max_frames_num)
-                        frames = []
-                        for frame in video:
-                            self._image_processor.do_resize = False
-                            self._image_processor.do_center_crop = False
-                            frames.append(process_anyres_video_genli(Image.fromarray(frame).convert('RGB'), self._image_processor))
-                        video = torch.stack(frames, dim=0).bfloat16().to(self.device)
+                        self._image_processor.do_resize = False
+                        self._image_processor.do_center_crop = False
+                        video = normalize_on_device(process_anyres_video_genli_batch(video, self._image_processor, normalize=False), self._image_processor, self.device)
                         videos.append(video)
                         modalities.append(modality)
             except Exception as e:
@@ -22,7 +22,7 @@ import os
 
 from oryx.model.language_model.oryx_llama import OryxConfig
 from oryx.model.builder import load_pretrained_model
-from oryx.mm_utils import tokenizer_image_token, get_model_name_from_path, KeywordsStoppingCriteria,process_anyres_highres_image_genli
+from oryx.mm_utils import tokenizer_image_token, tokenizer_image_token_batch, get_model_name_from_path, KeywordsStoppingCriteria,process_anyres_highres_image_genli,process_anyres_highres_image_genli_fused,normalize_on_device,group_by_shape
 from oryx.constants import IMAGE_TOKEN_INDEX, DEFAULT_IMAGE_TOKEN, DEFAULT_IM_START_TOKEN, DEFAULT_IM_END_TOKEN
 from oryx.conversation import conv_templates, SeparatorStyle
 
@@ -230,7 +230,7 @@ class OryxImage(lmms):
             visuals = self.flatten(visuals)
             videos = []
             for visual in visuals:
-                image_tensor_, image_highres_tensor_ = process_anyres_highres_image_genli(visual, self._image_processor)
+                image_tensor_, image_highres_tensor_ = process_anyres_highres_image_genli_fused(visual, self._image_processor, normalize=False)
                 image_tensor.append(image_tensor_)
                 image_highres_tensor.append(image_highres_tensor_)
             if all(x.shape == image_tensor[0].shape for x in image_tensor):
@@ -238,13 +238,13 @@ class OryxImage(lmms):
             if all(x.shape == image_highres_tensor[0].shape for x in image_highres_tensor):
                 image_highres_tensor = torch.stack(image_highres_tensor, dim=0)
             if type(image_tensor) is list:
-                image_tensor = [_image.to(dtype=torch.bfloat16, device=self.device) for _image in image_tensor]
+                image_tensor = [normalize_on_device(_image, self._image_processor, self.device) for _image in image_tensor]
             else:
-                image_tensor = image_tensor.to(dtype=torch.bfloat16, device=self.device)
+                image_tensor = normalize_on_device(image_tensor, self._image_processor, self.device)
             if type(image_highres_tensor) is list:
-                image_highres_tensor = [_image.to(dtype=torch.bfloat16, device=self.device) for _image in image_highres_tensor]
+                image_highres_tensor = [normalize_on_device(_image, self._image_processor, self.device) for _image in image_highres_tensor]
             else:
-                image_highres_tensor = image_highres_tensor.to(dtype=torch.bfloat16, device=self.device)
+                image_highres_tensor = normalize_on_device(image_highres_tensor, self._image_processor, self.device)
 
             qs = contexts
             if self.model.config.mm_use_im_start_end:
@@ -358,7 +358,7 @@ class OryxImage(lmms):
                 self._image_processor.do_center_crop = False
                 image_tensor, image_highres_tensor = [], []
                 for visual in visuals:
-                    image_tensor_, image_highres_tensor_ = process_anyres_highres_image_genli(visual, self._image_processor)
+                    image_tensor_, image_highres_tensor_ = process_anyres_highres_image_genli_fused(visual, self._image_processor, normalize=False)
                     image_tensor.append(image_tensor_)
                     image_highres_tensor.append(image_highres_tensor_)
                 if all(x.shape == image_tensor[0].shape for x in image_tensor):
@@ -366,18 +366,25 @@ class OryxImage(lmms):
                 if all(x.shape == image_highres_tensor[0].shape for x in image_highres_tensor):
                     image_highres_tensor = torch.stack(image_highres_tensor, dim=0)
                 if type(image_tensor) is list:
-                    image_tensor = [_image.to(dtype=torch.bfloat16, device=self.device) for _image in image_tensor]
+                    image_tensor = [normalize_on_device(_image, self._image_processor, self.device) for _image in image_tensor]
                 else:
-                    image_tensor = image_tensor.to(dtype=torch.bfloat16, device=self.device)
+                    image_tensor = normalize_on_device(image_tensor, self._image_processor, self.device)
                 if type(image_highres_tensor) is list:
-                    image_highres_tensor = [_image.to(dtype=torch.bfloat16, device=self.device) for _image in image_highres_tensor]
+                    # One transfer per resolution bucket; the model runs each bucket through the vision tower in one pass
+                    highres_tensors = [None] * len(image_highres_tensor)
+                    for group in group_by_shape(image_highres_tensor):
+                        normalized = normalize_on_device(torch.cat([image_highres_tensor[idx] for idx in group]), self._image_processor, self.device)
+                        for idx, _image in zip(group, normalized.split(1)):
+                            highres_tensors[idx] = _image
+                    image_highres_tensor = highres_tensors
                 else:
-                    image_highres_tensor = image_highres_tensor.to(dtype=torch.bfloat16, device=self.device)
+                    image_highres_tensor = normalize_on_device(image_highres_tensor, self._image_processor, self.device)
                 
             else:
                 image_tensor = None
 
             question_input = []
+            stop_strs = []
 
             for visual, context in zip(visuals, contexts):
                 if image_tensor is not None and len(image_tensor) != 0 and DEFAULT_IMAGE_TOKEN not in context:
@@ -398,6 +405,7 @@ class OryxImage(lmms):
                 conv.append_message(conv.roles[1], None)
                 prompt_question = conv.get_prompt()
                 question_input.append(prompt_question)
+                stop_strs.append(conv.sep if conv.sep_style != SeparatorStyle.TWO else conv.sep2)
 
             # The above for loop has bugs. When there is no visuals, e.g. pure text,
             # there will be no for loop execute resulting in an empty question_input (because no visuals)
@@ -410,6 +418,7 @@ class OryxImage(lmms):
                     conv.append_message(conv.roles[1], None)
                     prompt_question = conv.get_prompt()
                     question_input.append(prompt_question)
+                    stop_strs.append(conv.sep if conv.sep_style != SeparatorStyle.TWO else conv.sep2)
 
             # input_ids = tokenizer_image_token(prompt, self.tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt").unsqueeze(0).to(self.device)
             # preconfigure gen_kwargs with defaults
@@ -423,10 +432,12 @@ class OryxImage(lmms):
             if "num_beams" not in gen_kwargs:
                 gen_kwargs["num_beams"] = 1
 
-            input_ids_list = [tokenizer_image_token(prompt, self.tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt") for prompt in question_input]
+            input_ids_list = tokenizer_image_token_batch(question_input, self.tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt")
             pad_token_ids = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
             input_ids = self.pad_sequence(input_ids_list, batch_first=True, padding_value=pad_token_ids).to(self.device)
             attention_masks = input_ids.ne(pad_token_ids).to(self.device)
+            # Stop strings of the templates these prompts were built from, not of a leftover `conv`
+            stopping_criteria = KeywordsStoppingCriteria(list(dict.fromkeys(stop_strs)), self.tokenizer, input_ids)
             # These steps are not in LLaVA's original code, but are necessary for generation to work
             # TODO: pay attention to this major generation step...
 
@@ -440,6 +451,7 @@ class OryxImage(lmms):
                         images=image_tensor,
                         images_highres=image_highres_tensor,
                         image_sizes=gen_kwargs["image_sizes"],
+                        stopping_criteria=[stopping_criteria],
                         do_sample=True if gen_kwargs["temperature"] > 0 else False,
                         temperature=gen_kwargs["temperature"],
                         top_p=gen_kwargs["top_p"],
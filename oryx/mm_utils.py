@@ -3,79 +3,208 @@ from io import BytesIO
 import base64
 import math
 import ast
+import functools
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import NamedTuple, Optional, Tuple
 
+import numpy as np
 import torch
+import torch.nn.functional as F
 from transformers import StoppingCriteria
 from oryx.constants import IMAGE_TOKEN_INDEX
+from oryx.shard_reader import shard_reader
 import os
 
-if 'VIDEO_RESIZE' in os.environ:
-    # highresxpatch
-    VIDEO_RESIZE = os.environ['VIDEO_RESIZE']
-    video_base, video_ps = VIDEO_RESIZE.split('x')
-    video_base = int(video_base)
-    video_ps = int(video_ps)
-    print(f"VIDEO_RESIZE is set as {VIDEO_RESIZE}, {video_base}, {video_ps}")
-else:
-    HIGHRES_BASE = None
-
-if 'HIGHRES_BASE' in os.environ:
-    # highresxpatch
-    HIGHRES_BASE = os.environ['HIGHRES_BASE']
-    highres_base, highres_ps = HIGHRES_BASE.split('x')
-    highres_base = int(highres_base)
-    highres_ps = int(highres_ps)
-    print(f"HIGHRES_BASE is set as {HIGHRES_BASE}, {highres_base}, {highres_ps}")
-else:
-    HIGHRES_BASE = None
-
-if 'MAXRES' in os.environ:
-    # highresxpatch
-    MAXRES = int(os.environ['MAXRES'])
-    print(f"MAXRES is set as {MAXRES}")
-else:
-    MAXRES = 1536
-
-if 'MINRES' in os.environ:
-    # highresxpatch
-    MINRES = int(os.environ['MINRES'])
-    print(f"MINRES is set as {MINRES}")
-else:
-    MINRES = 0
-
-if 'VIDEO_MAXRES' in os.environ:
-    # highresxpatch
-    VIDEO_MAXRES = int(os.environ['VIDEO_MAXRES'])
-    print(f"VIDEO_MAXRES is set as {VIDEO_MAXRES}")
-else:
-    VIDEO_MAXRES = 1536
-
-if 'VIDEO_MINRES' in os.environ:
-    # highresxpatch
-    VIDEO_MINRES = int(os.environ['VIDEO_MINRES'])
-    print(f"VIDEO_MINRES is set as {VIDEO_MINRES}")
-else:
-    MINRES = 0
-
-if 'PAD2STRIDE' in os.environ:
-    # highresxpatch
-    PAD2STRIDE = True
-    print(f"PAD2STRIDE is set")
-else:
-    PAD2STRIDE = False
-
-if 'LOWRES_RESIZE' in os.environ:
-    LOWRES_RESIZE = os.environ['LOWRES_RESIZE']
-    print(f"LOWRES_RESIZE is set as {LOWRES_RESIZE}")
-    if 'x' in LOWRES_RESIZE:
-        size, ps = LOWRES_RESIZE.split('x')
-        size = int(size)
-        ps = int(ps)
-        LOWRES_RESIZE = (size, ps)
-    else:
-        LOWRES_RESIZE = int(LOWRES_RESIZE)
-else:
-    LOWRES_RESIZE = None
+class ResizePlan(NamedTuple):
+    """How inputs of one (width, height, modality) are resized. Sizes are (width, height).
+
+    `size` is the output (for images, the high-resolution) size, reached by resizing or, with `pad`, by
+    centering on a 127-gray canvas. Images are first resized to `prescale_size` if set: images smaller than
+    32 pixels, and bucketed images that are padded to their bucket. `grid` is the ViT patch grid of `size`.
+    """
+    size: Tuple[int, int]
+    pad: bool
+    grid: Tuple[int, int]
+    prescale_size: Optional[Tuple[int, int]] = None
+    lowres_size: Optional[Tuple[int, int]] = None
+    lowres_pad: bool = False
+
+
+def _parse_resize(value):
+    base_size, patch_size = value.split('x')
+    return int(base_size), int(patch_size)
+
+
+def _parse_buckets(value):
+    return tuple(tuple(int(side) for side in bucket.split('x')) for bucket in value.split(',') if bucket.strip())
+
+
+def aspect_buckets(base_sizes, aspect_ratios=(1 / 2, 9 / 16, 2 / 3, 3 / 4, 1, 4 / 3, 3 / 2, 16 / 9, 2), patch_size=32):
+    """Patch-aligned (width, height) buckets of about `base_size`² pixels for each base size and width/height aspect ratio."""
+    buckets = []
+    for base_size in base_sizes:
+        for aspect_ratio in aspect_ratios:
+            width = max(patch_size, round(base_size * math.sqrt(aspect_ratio) / patch_size) * patch_size)
+            height = max(patch_size, round(base_size / math.sqrt(aspect_ratio) / patch_size) * patch_size)
+            if (width, height) not in buckets:
+                buckets.append((width, height))
+    return tuple(buckets)
+
+
+@dataclass(frozen=True)
+class ResolutionPolicy:
+    """Resolution settings of the any-resolution image and video preprocessing.
+
+    `video_resize`, `highres_base` and `lowres_resize` are (base_size, patch_size) pairs, where a base size
+    of 0 keeps the input area between the min and max resolution. Policies are immutable and hashable,
+    so several can be used side by side, and `plan` is memoized across all of them.
+
+    With `buckets`, a set of patch-aligned (width, height) sizes, high-resolution images are snapped to a
+    bucket (see `snap_to_bucket`) so that images of similar aspect ratio share one shape and can be stacked.
+    """
+    video_resize: Optional[Tuple[int, int]] = None
+    highres_base: Optional[Tuple[int, int]] = None
+    max_res: int = 1536
+    min_res: int = 0
+    video_max_res: int = 1536
+    video_min_res: int = 0
+    pad2stride: bool = False
+    lowres_resize: Optional[Tuple[int, int]] = None
+    vit_patch_size: int = 16
+    buckets: Optional[Tuple[Tuple[int, int], ...]] = None
+    bucket_max_distortion: float = 0.1
+    bucket_max_pad: float = 0.25
+
+    def __post_init__(self):
+        if self.buckets is not None:
+            buckets = tuple((int(width), int(height)) for width, height in self.buckets)
+            for width, height in buckets:
+                if width <= 0 or height <= 0 or width % self.vit_patch_size or height % self.vit_patch_size:
+                    raise ValueError(f"Bucket {width}x{height} is not a multiple of the ViT patch size {self.vit_patch_size}")
+            object.__setattr__(self, 'buckets', buckets)
+
+    @classmethod
+    def from_env(cls, environ=None):
+        """The policy set by the VIDEO_RESIZE, HIGHRES_BASE, MAXRES, MINRES, VIDEO_MAXRES, VIDEO_MINRES, PAD2STRIDE, LOWRES_RESIZE,
+        RES_BUCKETS (e.g. "768x768,896x640,640x896"), BUCKET_MAX_DISTORTION and BUCKET_MAX_PAD variables."""
+        environ = os.environ if environ is None else environ
+        kwargs = {}
+        for name, field, parse in (
+            ('VIDEO_RESIZE', 'video_resize', _parse_resize),
+            ('HIGHRES_BASE', 'highres_base', _parse_resize),
+            ('MAXRES', 'max_res', int),
+            ('MINRES', 'min_res', int),
+            ('VIDEO_MAXRES', 'video_max_res', int),
+            ('VIDEO_MINRES', 'video_min_res', int),
+            ('LOWRES_RESIZE', 'lowres_resize', _parse_resize),
+            ('RES_BUCKETS', 'buckets', _parse_buckets),
+            ('BUCKET_MAX_DISTORTION', 'bucket_max_distortion', float),
+            ('BUCKET_MAX_PAD', 'bucket_max_pad', float),
+        ):
+            if name in environ:
+                kwargs[field] = parse(environ[name])
+                print(f"{name} is set as {environ[name]}")
+        if 'PAD2STRIDE' in environ:
+            kwargs['pad2stride'] = True
+            print(f"PAD2STRIDE is set")
+        if 'VIDEO_MINRES' not in environ:
+            # As with the former module globals, an unset VIDEO_MINRES resets MINRES to 0
+            kwargs['min_res'] = 0
+        return cls(**kwargs)
+
+    def target_size(self, width, height, patch_size, base_size, max_res, min_res):
+        """Stride-aligned (width, height) for `patch_size`, and whether the input is padded to it instead of resized."""
+        if base_size == 0:
+            if width * height > max_res * max_res:
+                scale = math.sqrt(max_res * max_res / (width * height))
+            elif width * height < min_res * min_res:
+                scale = math.sqrt(min_res * min_res / (width * height))
+            else:
+                scale = None
+        else:
+            scale = math.sqrt(base_size * base_size / (width * height))
+
+        if scale is not None:
+            return (int(width * scale / patch_size) * patch_size, int(height * scale / patch_size) * patch_size), False
+        elif self.pad2stride:
+            return (math.ceil(width / patch_size) * patch_size, math.ceil(height / patch_size) * patch_size), True
+        return (int(width / patch_size) * patch_size, int(height / patch_size) * patch_size), False
+
+    def snap_to_bucket(self, width, height):
+        """The bucket for a `width`×`height` image, and the size its content is resized to, or None if no bucket fits.
+
+        A bucket fits if stretching the image to it changes the aspect ratio by at most `bucket_max_distortion`
+        (the content size is then the bucket), or if the aspect-preserving fit leaves at most `bucket_max_pad`
+        of it as padding. Stretching is preferred over padding, then the bucket that rescales the content least.
+        """
+        best = None
+        for bucket_width, bucket_height in self.buckets:
+            distortion = abs(math.log(bucket_width * height / (bucket_height * width)))
+            if distortion <= math.log1p(self.bucket_max_distortion):
+                content_size, cost = (bucket_width, bucket_height), distortion
+            else:
+                scale = min(bucket_width / width, bucket_height / height)
+                content_size = (min(bucket_width, max(1, round(width * scale))), min(bucket_height, max(1, round(height * scale))))
+                cost = 1 - content_size[0] * content_size[1] / (bucket_width * bucket_height)
+                if cost > self.bucket_max_pad:
+                    continue
+            candidate = (content_size != (bucket_width, bucket_height), abs(math.log(content_size[0] * content_size[1] / (width * height))), cost,
+                         (bucket_width, bucket_height), content_size)
+            if best is None or candidate[:3] < best[:3]:
+                best = candidate
+        return None if best is None else best[3:]
+
+    @functools.lru_cache(maxsize=4096)
+    def plan(self, width, height, modality='image'):
+        """The memoized ResizePlan of a `width`×`height` input of `modality` ('image', 'video' or 'video_long')."""
+        if modality in ('video', 'video_long'):
+            if self.video_resize is None:
+                raise ValueError("VIDEO_RESIZE is not set")
+            video_base, video_ps = self.video_resize
+            size, pad = self.target_size(width, height, video_ps * 2 if modality == 'video_long' else video_ps, video_base, self.video_max_res, self.video_min_res)
+            return ResizePlan(size, pad, (size[0] // self.vit_patch_size, size[1] // self.vit_patch_size))
+        if modality != 'image':
+            raise ValueError(f"Unknown modality: {modality}")
+
+        prescale_size = None
+        if width < 32 or height < 32:
+            ratio = 64 / min(width, height) if width < 32 and height < 32 else 64 / (width if width < 32 else height)
+            width, height = prescale_size = (int(width * ratio), int(height * ratio))
+        size, pad = (width, height), False
+        if self.highres_base is not None:
+            size, pad = self.target_size(width, height, self.highres_base[1], self.highres_base[0], self.max_res, self.min_res)
+        if self.buckets and min(size) > 0:
+            bucket = self.snap_to_bucket(*size)
+            if bucket is not None:
+                size, content_size = bucket
+                pad = content_size != size
+                if pad:
+                    # Resized straight to its place in the bucket, then centered on it
+                    prescale_size = content_size
+        if self.lowres_resize is not None:
+            lowres_size, lowres_pad = self.target_size(size[0], size[1], self.lowres_resize[1], self.lowres_resize[0], self.max_res, self.min_res)
+        else:
+            lowres_size, lowres_pad = (384, 384), False
+        return ResizePlan(size, pad, (size[0] // self.vit_patch_size, size[1] // self.vit_patch_size), prescale_size, lowres_size, lowres_pad)
+
+    def warm_grids(self, sizes=((1920, 1080), (1280, 720), (1080, 1920), (1024, 768), (768, 1024), (1000, 1000), (640, 480))):
+        """The ViT patch grids (h, w) of the low- and high-resolution images, video frames and buckets of common input `sizes`."""
+        grids = set()
+        for width, height in sizes:
+            plan = self.plan(width, height, 'image')
+            grids.add((plan.grid[1], plan.grid[0]))
+            grids.add((plan.lowres_size[1] // self.vit_patch_size, plan.lowres_size[0] // self.vit_patch_size))
+            if self.video_resize is not None:
+                for modality in ('video', 'video_long'):
+                    plan = self.plan(width, height, modality)
+                    grids.add((plan.grid[1], plan.grid[0]))
+        for width, height in self.buckets or ():
+            grids.add((height // self.vit_patch_size, width // self.vit_patch_size))
+        return sorted(grid for grid in grids if min(grid) > 0)
+
+
+DEFAULT_RESOLUTION_POLICY = ResolutionPolicy.from_env()
 
 def pad_image(image, target_resolution, value=0):
     """
@@ -97,122 +226,40 @@ def pad_image(image, target_resolution, value=0):
     new_image.paste(image, (paste_x, paste_y))
     return new_image
 
-def resize_images(image, patch_size=14, base_size=896):
-    h, w = image.size
-    if base_size == 0:
-        if h * w > MAXRES * MAXRES:
-            # print(f'{h}x{w} larger than max size {MAXRES}, resize to {MAXRES}')
-            scale = MAXRES * MAXRES / (h * w)
-            scale = math.sqrt(scale)
-        elif h * w < MINRES * MINRES:
-            # print(f'{h}x{w} smaller than max size {MINRES}, resize to {MINRES}')
-            scale = MINRES * MINRES / (h * w)
-            scale = math.sqrt(scale)
-        else:
-            scale = None
-    else:
-        scale = base_size * base_size / (h * w)
-        scale = math.sqrt(scale)
-
-
-    if scale is not None:
-        new_h = int(h * scale / patch_size) * patch_size
-        new_w = int(w * scale / patch_size) * patch_size
-        image = image.resize((new_h, new_w))
-    elif PAD2STRIDE:
-        if h % patch_size == 0:
-            new_h = h
-        else:
-            new_h = (h // patch_size + 1) * patch_size
-        
-        if w % patch_size == 0:
-            new_w = w
-        else:
-            new_w = (w // patch_size + 1) * patch_size
-        image = pad_image(image, (new_h, new_w), value=127)
-    else:
-        scale = 1.0
-        new_h = int(h * scale / patch_size) * patch_size
-        new_w = int(w * scale / patch_size) * patch_size
-        image = image.resize((new_h, new_w))
-
-    return image
-
-def resize_video(image, patch_size=14, base_size=896):
-    h, w = image.size
-    if base_size == 0:
-        if h * w > VIDEO_MAXRES * VIDEO_MAXRES:
-            # print(f'{h}x{w} larger than max size {MAXRES}, resize to {MAXRES}')
-            scale = VIDEO_MAXRES * VIDEO_MAXRES / (h * w)
-            scale = math.sqrt(scale)
-        elif h * w < VIDEO_MINRES * VIDEO_MINRES:
-            # print(f'{h}x{w} smaller than max size {MINRES}, resize to {MINRES}')
-            scale = VIDEO_MINRES * VIDEO_MINRES / (h * w)
-            scale = math.sqrt(scale)
-        else:
-            scale = None
-    else:
-        scale = base_size * base_size / (h * w)
-        scale = math.sqrt(scale)
-
-    if scale is not None:
-        new_h = int(h * scale / patch_size) * patch_size
-        new_w = int(w * scale / patch_size) * patch_size
-        image = image.resize((new_h, new_w))
-    elif PAD2STRIDE:
-        if h % patch_size == 0:
-            new_h = h
-        else:
-            new_h = (h // patch_size + 1) * patch_size
-        
-        if w % patch_size == 0:
-            new_w = w
-        else:
-            new_w = (w // patch_size + 1) * patch_size
-        image = pad_image(image, (new_h, new_w), value=127)
-    else:
-        scale = 1.0
-        new_h = int(h * scale / patch_size) * patch_size
-        new_w = int(w * scale / patch_size) * patch_size
-        image = image.resize((new_h, new_w))
-
-    return image
-
-def process_anyres_video_genli(image, processor):
-    if VIDEO_RESIZE is not None:
-        image = resize_video(image, patch_size=video_ps, base_size=video_base)
-        image = processor.preprocess(image, return_tensors='pt')['pixel_values'][0]
-        return image.unsqueeze(0)
-    else:
-        raise ValueError("VIDEO_RESIZE is not set")
-
-def process_anyres_video_genli_long(image, processor):
-    if VIDEO_RESIZE is not None:
-        image = resize_video(image, patch_size=video_ps * 2, base_size=video_base)
-        image = processor.preprocess(image, return_tensors='pt')['pixel_values'][0]
-        return image.unsqueeze(0)
-    else:
-        raise ValueError("VIDEO_RESIZE is not set")
-
-def process_anyres_highres_image_genli(image, processor):
-    h, w = image.size
-    if h < 32 and w < 32:
-        min_size = min(h, w)
-        ratio = 64 / min_size
-        image = image.resize((int(h * ratio), int(w * ratio)))
-    elif h < 32:
-        ratio = 64 / h
-        image = image.resize((int(h * ratio), int(w * ratio)))
-    elif w < 32:
-        ratio = 64 / w
-        image = image.resize((int(h * ratio), int(w * ratio)))
-    if HIGHRES_BASE is not None:
-        image = resize_images(image, patch_size=highres_ps, base_size=highres_base)
-
-    if LOWRES_RESIZE is not None:
-        image_original_resize = resize_images(image, patch_size=LOWRES_RESIZE[1], base_size=LOWRES_RESIZE[0])
-    else:
-        image_original_resize = image.resize((384, 384))
+def resize_to_plan(image, size, pad=False):
+    """Resizes a PIL image to `size` (width, height), or with `pad` centers it on a 127-gray canvas of that size."""
+    if pad:
+        return pad_image(image, size, value=127)
+    return image.resize(size)
+
+def resize_images(image, patch_size=14, base_size=896, policy=None):
+    policy = policy or DEFAULT_RESOLUTION_POLICY
+    width, height = image.size
+    return resize_to_plan(image, *policy.target_size(width, height, patch_size, base_size, policy.max_res, policy.min_res))
+
+def resize_video(image, patch_size=14, base_size=896, policy=None):
+    policy = policy or DEFAULT_RESOLUTION_POLICY
+    width, height = image.size
+    return resize_to_plan(image, *policy.target_size(width, height, patch_size, base_size, policy.video_max_res, policy.video_min_res))
+
+def process_anyres_video_genli(image, processor, policy=None):
+    plan = (policy or DEFAULT_RESOLUTION_POLICY).plan(*image.size, 'video')
+    image = resize_to_plan(image, plan.size, plan.pad)
+    image = processor.preprocess(image, return_tensors='pt')['pixel_values'][0]
+    return image.unsqueeze(0)
+
+def process_anyres_video_genli_long(image, processor, policy=None):
+    plan = (policy or DEFAULT_RESOLUTION_POLICY).plan(*image.size, 'video_long')
+    image = resize_to_plan(image, plan.size, plan.pad)
+    image = processor.preprocess(image, return_tensors='pt')['pixel_values'][0]
+    return image.unsqueeze(0)
+
+def process_anyres_highres_image_genli(image, processor, policy=None):
+    plan = (policy or DEFAULT_RESOLUTION_POLICY).plan(*image.size, 'image')
+    if plan.prescale_size is not None:
+        image = image.resize(plan.prescale_size)
+    image = resize_to_plan(image, plan.size, plan.pad)
+    image_original_resize = resize_to_plan(image, plan.lowres_size, plan.lowres_pad)
 
     # image_patches = [image_original_resize] + [image_original_resize]
     # image_patches = [processor.preprocess(image_patch, return_tensors='pt')['pixel_values'][0]
@@ -223,44 +270,214 @@ def process_anyres_highres_image_genli(image, processor):
     return image_patches.unsqueeze(0), image_padded.unsqueeze(0)
 
 
+def frames_to_tensor(frames, device=None):
+    """An N×H×W×3 uint8 array or tensor (e.g. decord's `get_batch`), or a list of same-size PIL images, as an N×3×H×W uint8 tensor."""
+    if isinstance(frames, (list, tuple)):
+        frames = np.stack([np.asarray(frame.convert('RGB')) for frame in frames])
+    if not torch.is_tensor(frames):
+        frames = torch.from_numpy(np.ascontiguousarray(frames))
+    return frames.to(device).permute(0, 3, 1, 2)
+
+def resize_frames(frames, size, pad=False):
+    """Resizes an N×3×H×W uint8 tensor to `size` (width, height) with antialiased bicubic, as PIL's `resize` does.
+
+    With `pad`, the frames are centered on a 127-gray canvas instead, as in `pad_image`.
+    """
+    width, height = size
+    in_height, in_width = frames.shape[-2:]
+    if (in_width, in_height) == (width, height):
+        return frames
+    if pad:
+        left, top = (width - in_width) // 2, (height - in_height) // 2
+        return F.pad(frames, (left, width - in_width - left, top, height - in_height - top), value=127)
+    if frames.device.type == 'cpu':
+        # The CPU uint8 kernel follows PIL's two-pass resampling, rounding between passes
+        return F.interpolate(frames, size=(height, width), mode='bicubic', align_corners=False, antialias=True)
+    resized = F.interpolate(frames.float(), size=(height, width), mode='bicubic', align_corners=False, antialias=True)
+    return resized.round_().clamp_(0, 255).to(torch.uint8)
+
+def normalize_frames(frames, processor=None, dtype=torch.float32):
+    """Rescales and normalizes an N×3×H×W uint8 tensor with the processor's mean/std (0.5 for OryxViT), like `processor.preprocess`.
+
+    The rescale and the normalization are folded into one multiply-add per pixel.
+    """
+    mean = torch.tensor(getattr(processor, 'image_mean', None) or [0.5, 0.5, 0.5], dtype=torch.float32, device=frames.device).view(1, -1, 1, 1)
+    std = torch.tensor(getattr(processor, 'image_std', None) or [0.5, 0.5, 0.5], dtype=torch.float32, device=frames.device).view(1, -1, 1, 1)
+    rescale_factor = getattr(processor, 'rescale_factor', 1 / 255)
+    return frames.float().mul_(rescale_factor / std).sub_(mean / std).to(dtype)
+
+def pin_frames(frames):
+    """Contiguous uint8 frames, in pinned memory when CUDA is available so they can be copied to the GPU asynchronously."""
+    frames = frames.contiguous()
+    if frames.device.type == 'cpu' and torch.cuda.is_available():
+        frames = frames.pin_memory()
+    return frames
+
+def normalize_on_device(frames, processor, device, dtype=torch.bfloat16):
+    """Moves uint8 frames from a `normalize=False` preprocessor to `device` and normalizes them there, straight to `dtype`."""
+    return normalize_frames(frames.to(device, non_blocking=True), processor, dtype)
+
+def process_anyres_video_genli_batch(frames, processor, long=False, device=None, policy=None, normalize=True):
+    """Batched `process_anyres_video_genli` (or `process_anyres_video_genli_long` with `long`) over N same-size frames.
+
+    The whole video shares one resize plan. Returns an N×1×3×H×W float tensor, the same as stacking the per-frame outputs.
+    With `normalize=False` the resized frames are returned as pinned uint8 instead, for `normalize_on_device`.
+    """
+    frames = frames_to_tensor(frames, device)
+    height, width = frames.shape[-2:]
+    plan = (policy or DEFAULT_RESOLUTION_POLICY).plan(width, height, 'video_long' if long else 'video')
+    frames = resize_frames(frames, plan.size, plan.pad).unsqueeze(1)
+    return normalize_frames(frames, processor) if normalize else pin_frames(frames)
+
+def anyres_highres_frames(images, policy=None):
+    """The low-resolution and high-resolution uint8 frames of `process_anyres_highres_image_genli` for an N×3×H×W uint8 tensor.
+
+    Both are derived from the same buffer: the high-resolution frames are resized from `images`, the
+    low-resolution ones from the high-resolution frames, as in the PIL path.
+    """
+    height, width = images.shape[-2:]
+    plan = (policy or DEFAULT_RESOLUTION_POLICY).plan(width, height, 'image')
+    if plan.prescale_size is not None:
+        images = resize_frames(images, plan.prescale_size)
+    images = resize_frames(images, plan.size, plan.pad)
+    return resize_frames(images, plan.lowres_size, plan.lowres_pad), images
+
+def process_anyres_highres_image_genli_batch(images, processor, device=None, policy=None, normalize=True):
+    """Batched `process_anyres_highres_image_genli` over N same-size images.
+
+    Returns the low-resolution and the high-resolution N×1×3×H×W float tensors, the same as stacking the per-image outputs,
+    or pinned uint8 tensors with `normalize=False`.
+    """
+    images_original_resize, images = anyres_highres_frames(frames_to_tensor(images, device), policy)
+    if not normalize:
+        return pin_frames(images_original_resize.unsqueeze(1)), pin_frames(images.unsqueeze(1))
+    return normalize_frames(images_original_resize, processor).unsqueeze(1), normalize_frames(images, processor).unsqueeze(1)
+
+def group_by_shape(tensors):
+    """Indices of `tensors` grouped by shape, in order of first appearance, so each group can be stacked (e.g. one resolution bucket)."""
+    groups = {}
+    for idx, tensor in enumerate(tensors):
+        groups.setdefault(tuple(tensor.shape), []).append(idx)
+    return list(groups.values())
+
+def load_image_array(image):
+    """Decodes an image path, encoded bytes or PIL image into one H×W×3 uint8 RGB array."""
+    if isinstance(image, np.ndarray):
+        return image
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(BytesIO(image))
+    elif isinstance(image, str):
+        image = Image.open(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return np.array(image)
+
+def process_anyres_highres_image_genli_fused(image, processor, size=None, device=None, policy=None, normalize=True):
+    """Single-decode `process_anyres_highres_image_genli`, returning the same (lowres, highres) pair of 1×3×H×W tensors.
+
+    `image` (a path, encoded bytes, PIL image or H×W×3 uint8 array) is decoded once into a uint8 buffer,
+    optionally resized to `size` (width, height) first, and both resolutions are resized from it and
+    normalized as tensors, without intermediate PIL images. With `normalize=False` both are returned as pinned uint8.
+    """
+    frames = frames_to_tensor(load_image_array(image)[None], device)
+    if size is not None:
+        frames = resize_frames(frames, size)
+    images_original_resize, images = anyres_highres_frames(frames, policy)
+    if not normalize:
+        return pin_frames(images_original_resize), pin_frames(images)
+    return normalize_frames(images_original_resize, processor), normalize_frames(images, processor)
+
 def read_image_patch(patch_info):
     if 'img_path' in patch_info.keys():
         image = Image.open(patch_info['img_path']).convert('RGB')
     else:
         if 'image_encoing' in patch_info.keys():
             patch_info['image_encoding'] = patch_info['image_encoing']
-        image_file_name = patch_info['patch']
-        start_bytes = int(patch_info['start_num'])
-        file_size = int(patch_info['size'])
-
-        with open(image_file_name, 'rb') as f:
-            f.seek(start_bytes)
-            if 'image_encoding' in patch_info.keys() and patch_info['image_encoding'] == 'base64':
-                image = Image.open(io.BytesIO(base64.b64decode(f.read(file_size).decode()))).convert("RGB")
-            else:
-                image = Image.open(io.BytesIO(f.read(file_size))).convert("RGB")
+        image = shard_reader().read_image(patch_info)
     return image
 
-def tokenizer_image_token(prompt, tokenizer, image_token_index=IMAGE_TOKEN_INDEX, return_tensors=None):
-    prompt_chunks = [tokenizer(chunk).input_ids for chunk in prompt.split('<image>')]
+class ChunkTokenCache:
+    """LRU memo of the input ids of prompt chunks, keyed by tokenizer (and its vocabulary size) and chunk text.
 
-    def insert_separator(X, sep):
-        return [ele for sublist in zip(X, [sep]*len(X)) for ele in sublist][:-1]
+    Prompts share long instruction templates and conversation headers, so most chunks are only tokenized once.
+    """
 
-    input_ids = []
-    offset = 0
-    if len(prompt_chunks) > 0 and len(prompt_chunks[0]) > 0 and prompt_chunks[0][0] == tokenizer.bos_token_id:
-        offset = 1
-        input_ids.append(prompt_chunks[0][0])
+    def __init__(self, maxsize=8192):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def encode(self, tokenizer, chunks):
+        """The input ids of each chunk as int64 arrays. Uncached chunks are tokenized together in one call."""
+        vocab_size = len(tokenizer)
+        results = []
+        missing = {}
+        for chunk in chunks:
+            key = (tokenizer, vocab_size, chunk)
+            ids = self._entries.get(key)
+            if ids is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                missing.setdefault(chunk, key)
+                self.misses += 1
+            results.append(ids)
+
+        if missing:
+            encoded = {}
+            for (chunk, key), ids in zip(missing.items(), tokenizer(list(missing)).input_ids):
+                ids = np.asarray(ids, dtype=np.int64)
+                ids.flags.writeable = False
+                encoded[chunk] = self._entries[key] = ids
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            results = [ids if ids is not None else encoded[chunk] for chunk, ids in zip(chunks, results)]
+        return results
+
+    def clear(self):
+        self._entries.clear()
+
+
+PROMPT_TOKEN_CACHE = ChunkTokenCache()
 
-    for x in insert_separator(prompt_chunks, [image_token_index] * (offset + 1)):
-        input_ids.extend(x[offset:])
+
+def tokenizer_image_token_batch(prompts, tokenizer, image_token_index=IMAGE_TOKEN_INDEX, return_tensors=None):
+    """`tokenizer_image_token` for many prompts.
+
+    The `<image>`-separated chunks of all prompts go through `PROMPT_TOKEN_CACHE` in one tokenizer call,
+    and each prompt's ids are assembled into a preallocated array with the image tokens written at the
+    chunk boundaries.
+    """
+    split = [prompt.split('<image>') for prompt in prompts]
+    encoded = PROMPT_TOKEN_CACHE.encode(tokenizer, [chunk for chunks in split for chunk in chunks])
+
+    batch = []
+    position = 0
+    for chunks in split:
+        prompt_chunks = encoded[position:position + len(chunks)]
+        position += len(chunks)
+        # A leading BOS is kept once, and dropped from the start of every chunk
+        offset = 1 if len(prompt_chunks[0]) > 0 and prompt_chunks[0][0] == tokenizer.bos_token_id else 0
+        lengths = np.array([max(len(x) - offset, 0) for x in prompt_chunks], dtype=np.int64)
+        starts = offset + np.concatenate([[0], np.cumsum(lengths[:-1] + 1)])
+        input_ids = np.empty(offset + lengths.sum() + len(prompt_chunks) - 1, dtype=np.int64)
+        if offset:
+            input_ids[0] = prompt_chunks[0][0]
+        input_ids[starts[1:] - 1] = image_token_index
+        for start, length, x in zip(starts, lengths, prompt_chunks):
+            input_ids[start:start + length] = x[offset:]
+        batch.append(input_ids)
 
     if return_tensors is not None:
         if return_tensors == 'pt':
-            return torch.tensor(input_ids, dtype=torch.long)
+            return [torch.from_numpy(input_ids) for input_ids in batch]
         raise ValueError(f'Unsupported tensor type: {return_tensors}')
-    return input_ids
+    return [input_ids.tolist() for input_ids in batch]
+
+
+def tokenizer_image_token(prompt, tokenizer, image_token_index=IMAGE_TOKEN_INDEX, return_tensors=None):
+    return tokenizer_image_token_batch([prompt], tokenizer, image_token_index, return_tensors)[0]
 
 
 def get_model_name_from_path(model_path):
@@ -273,26 +490,68 @@ def get_model_name_from_path(model_path):
 
 
 class KeywordsStoppingCriteria(StoppingCriteria):
+    """Stops each row of a batch once its generated tokens end with the token ids of one of `keywords`.
+
+    The keyword ids are tokenized once and kept on the device, right-aligned in one padded tensor, so every
+    step is a single vectorized suffix comparison. Rows it does not match fall back, as before, to decoding
+    their last few generated tokens and searching them for a keyword, which catches keywords tokenized
+    differently in context. `finished` is the per-row mask of rows that have stopped; it is returned to
+    `generate`, which stops those rows independently.
+    """
+
     def __init__(self, keywords, tokenizer, input_ids):
         self.keywords = keywords
-        self.keyword_ids = []
+        self.tokenizer = tokenizer
+        keyword_ids = []
         for keyword in keywords:
             cur_keyword_ids = tokenizer(keyword).input_ids
             if len(cur_keyword_ids) > 1 and cur_keyword_ids[0] == tokenizer.bos_token_id:
                 cur_keyword_ids = cur_keyword_ids[1:]
-            self.keyword_ids.append(torch.tensor(cur_keyword_ids))
-        self.tokenizer = tokenizer
+            if len(cur_keyword_ids) > 0:
+                keyword_ids.append(cur_keyword_ids)
+        if len(keyword_ids) == 0:
+            raise ValueError(f'No stopping keyword in {keywords} has any tokens')
+        self.max_keyword_len = max(len(ids) for ids in keyword_ids)
+        self.keyword_ids = torch.zeros(len(keyword_ids), self.max_keyword_len, dtype=torch.long)
+        self.keyword_mask = torch.zeros(len(keyword_ids), self.max_keyword_len, dtype=torch.bool)
+        for i, ids in enumerate(keyword_ids):
+            self.keyword_ids[i, -len(ids):] = torch.tensor(ids)
+            self.keyword_mask[i, -len(ids):] = True
+        self._to(input_ids.device)
         self.start_len = input_ids.shape[1]
-
-    def __call__(self, output_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
-        assert output_ids.shape[0] == 1, "Only support batch size 1 (yet)"  # TODO
-        offset = min(output_ids.shape[1] - self.start_len, 3)
-        self.keyword_ids = [keyword_id.to(output_ids.device) for keyword_id in self.keyword_ids]
-        for keyword_id in self.keyword_ids:
-            if output_ids[0, -keyword_id.shape[0]:] == keyword_id:
-                return True
-        outputs = self.tokenizer.batch_decode(output_ids[:, -offset:], skip_special_tokens=True)[0]
-        for keyword in self.keywords:
-            if keyword in outputs:
-                return True
-        return False
+        self.finished = None
+        self.last_len = 0
+        self.generated = 0
+
+    def _to(self, device):
+        self.keyword_ids = self.keyword_ids.to(device)
+        self.keyword_mask = self.keyword_mask.to(device)
+
+    def __call__(self, output_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if self.keyword_ids.device != output_ids.device:
+            self._to(output_ids.device)
+        # A new generation (output no longer than at the last step, or another batch) starts with no row finished
+        if self.finished is None or self.finished.shape[0] != output_ids.shape[0] or output_ids.shape[1] <= self.last_len:
+            self.finished = torch.zeros(output_ids.shape[0], dtype=torch.bool, device=output_ids.device)
+            self.generated = 0
+        self.last_len = output_ids.shape[1]
+        # One call per generated token; counted rather than derived from start_len, which `inputs_embeds` breaks
+        self.generated += 1
+
+        # output_ids hold the prompt and the generated tokens, or only the generated ones with `inputs_embeds`;
+        # positions before the first token are padded with -1, which no keyword id matches
+        tail = output_ids[:, -self.max_keyword_len:]
+        if tail.shape[1] < self.max_keyword_len:
+            tail = F.pad(tail, (self.max_keyword_len - tail.shape[1], 0), value=-1)
+        matched = ((tail.unsqueeze(1) == self.keyword_ids) | ~self.keyword_mask).all(dim=-1)
+        self.finished |= matched.any(dim=-1)
+
+        pending = [row for row, finished in enumerate(self.finished.tolist()) if not finished]
+        if pending:
+            offset = min(self.generated, 3)
+            recent = output_ids[:, -offset:].tolist()
+            outputs = self.tokenizer.batch_decode([recent[row] for row in pending], skip_special_tokens=True)
+            for row, output in zip(pending, outputs):
+                if any(keyword in output for keyword in self.keywords):
+                    self.finished[row] = True
+        return self.finished
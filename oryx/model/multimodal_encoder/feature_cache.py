@@ -0,0 +1,194 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def _checksums(data):
+    """Position-weighted sums of the 32-bit words of contiguous `data`, computed on its device."""
+    data = data.view(-1).view(torch.uint8)
+    if data.numel() % 4 or data.storage_offset() % 4:
+        data = torch.cat([data, data.new_zeros(-data.numel() % 4)])
+    words = data.view(torch.int32).long()
+    position = torch.arange(words.numel(), device=words.device)
+    return torch.stack([
+        words.sum(),
+        (words * (position % 65521 + 1)).sum(),
+        (words * (position * 2654435761 % 4294967291 + 1)).sum(),
+    ]).tolist()
+
+
+def tensor_key(x, namespace=''):
+    """Content hash of a pixel tensor: its bytes, shape and dtype, within `namespace` (e.g. the tower and its dtype).
+
+    Host tensors are hashed directly. Device tensors are not copied to the host for it: they are reduced on the
+    device to three checksums (see `_checksums`), so their keys differ from those of the same pixels on the host.
+    """
+    data = x.detach().contiguous()
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f'{namespace}|{tuple(data.shape)}|{data.dtype}|'.encode())
+    if data.device.type == 'cpu':
+        h.update(data.view(-1).view(torch.uint8).numpy().data)
+    else:
+        h.update(f'{data.device.type}|{_checksums(data)}'.encode())
+    return h.hexdigest()
+
+
+def weights_fingerprint(module, names=None):
+    """Content hash of the parameters `names` of `module` (by default all of them), identifying the weights it was
+    loaded with."""
+    params = dict(module.named_parameters())
+    names = names or list(params)
+    return hashlib.blake2b('|'.join(tensor_key(params[name], name) for name in names).encode(), digest_size=10).hexdigest()
+
+
+class VisionFeatureCache:
+    """Cache of vision tower outputs `(features, (h, w))` keyed by `tensor_key` of the preprocessed pixels.
+
+    The memory tier is an LRU of up to `max_bytes` of features, kept in host memory so that it does not hold
+    device memory; hits are copied to `device`. With `cache_dir`, every encoded entry is also written there and
+    memory misses are loaded from it memory-mapped, so entries outlive the process and are shared between
+    evaluation runs. `stats()` reports the hit rate and bytes of both tiers.
+    """
+
+    def __init__(self, max_bytes=2 * 1024 ** 3, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.disk_read_bytes = 0
+        self.disk_write_bytes = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, environ=None):
+        """A cache from VISION_FEATURE_CACHE_MB (memory tier size) and VISION_FEATURE_CACHE_DIR, or None if neither is set."""
+        environ = os.environ if environ is None else environ
+        if 'VISION_FEATURE_CACHE_MB' not in environ and 'VISION_FEATURE_CACHE_DIR' not in environ:
+            return None
+        max_bytes = int(float(environ.get('VISION_FEATURE_CACHE_MB', 2048)) * 1024 ** 2)
+        cache_dir = environ.get('VISION_FEATURE_CACHE_DIR')
+        print(f"Vision feature cache: {max_bytes / 1024 ** 2:.0f} MB in memory, on disk: {cache_dir}")
+        return cls(max_bytes=max_bytes, cache_dir=cache_dir)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.pt')
+
+    def get(self, key, device=None):
+        """The cached `(features, (h, w))` of `key` on `device`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.hit_bytes += _nbytes(entry[0])
+        if entry is None and self.cache_dir is not None and os.path.exists(self._path(key)):
+            try:
+                saved = torch.load(self._path(key), map_location='cpu', mmap=True, weights_only=True)
+            except Exception as e:
+                print(f"Ignoring unreadable vision feature cache entry {key}: {e}")
+                saved = None
+            if saved is not None:
+                entry = (saved['features'], tuple(saved['size']))
+                nbytes = _nbytes(entry[0])
+                with self._lock:
+                    self.disk_hits += 1
+                    self.hit_bytes += nbytes
+                    self.disk_read_bytes += nbytes
+                self._insert(key, entry)
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        features, size = entry
+        return (features.to(device) if device is not None else features), size
+
+    def put(self, key, features, size):
+        """Caches the tower output of `key`: `features` of one input and its patch grid `size`."""
+        # A host copy that owns its storage: the features of a batch or packed forward are views of one tensor
+        features = features.detach().to('cpu', copy=True).contiguous()
+        size = tuple(size)
+        self._insert(key, (features, size))
+        if self.cache_dir is not None and not os.path.exists(self._path(key)):
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            torch.save({'features': features, 'size': size}, tmp_path)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self.disk_write_bytes += _nbytes(features)
+
+    def _insert(self, key, entry):
+        nbytes = _nbytes(entry[0])
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.memory_bytes -= _nbytes(self._entries.pop(key)[0])
+            self._entries[key] = entry
+            self.memory_bytes += nbytes
+            while self.memory_bytes > self.max_bytes:
+                _, (features, _) = self._entries.popitem(last=False)
+                self.memory_bytes -= _nbytes(features)
+
+    def clear(self):
+        """Empties the memory tier; the disk tier is kept."""
+        with self._lock:
+            self._entries.clear()
+            self.memory_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'lookups': lookups,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            'entries': len(self._entries),
+            'memory_bytes': self.memory_bytes,
+            'hit_bytes': self.hit_bytes,
+            'disk_read_bytes': self.disk_read_bytes,
+            'disk_write_bytes': self.disk_write_bytes,
+        }
+
+
+def _nbytes(tensor):
+    return tensor.numel() * tensor.element_size()
+
+
+def cached_forward(cache, encode, images, namespace='', device=None):
+    """`encode(images)` -> (features, sizes) through `cache`, encoding only the inputs it misses.
+
+    `images` is a list of B×3×H×W tensors, each cached whole, with features and sizes returned per item as
+    for `forward_features_list`; or one B×3×H×W tensor, cached per image, with its B×N×C features and one
+    (h, w) returned as for `forward_features`.
+    """
+    if type(images) is list:
+        keys = [tensor_key(x, namespace) for x in images]
+        entries = [cache.get(key, device) for key in keys]
+        missing = [idx for idx, entry in enumerate(entries) if entry is None]
+        if missing:
+            features, sizes = encode([images[idx] for idx in missing])
+            for idx, feature, size in zip(missing, features, sizes):
+                cache.put(keys[idx], feature, size)
+                entries[idx] = (feature, tuple(size))
+        return [entry[0] for entry in entries], [entry[1] for entry in entries]
+
+    keys = [tensor_key(x, namespace) for x in images]
+    entries = [cache.get(key, device) for key in keys]
+    missing = [idx for idx, entry in enumerate(entries) if entry is None]
+    if missing:
+        features, size = encode(images[missing])
+        for idx, feature in zip(missing, features.split(1)):
+            cache.put(keys[idx], feature, size)
+            entries[idx] = (feature, tuple(size))
+    return torch.cat([entry[0] for entry in entries]), entries[0][1]
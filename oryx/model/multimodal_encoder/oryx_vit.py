@@ -16,10 +16,14 @@ from typing import (
     Union,
 )
 
+from collections import OrderedDict
 from huggingface_hub import snapshot_download
 
+from .feature_cache import VisionFeatureCache, cached_forward, weights_fingerprint
+
 from torch.utils.checkpoint import checkpoint
 import torch
+import torch._dynamo
 import torch.nn as nn
 import torch.nn.functional as F
 try:
@@ -36,7 +40,10 @@ try:
 except:
     print('Wrong timm version')
 
-from flash_attn import flash_attn_func, flash_attn_varlen_func
+try:
+    from flash_attn import flash_attn_func, flash_attn_varlen_func
+except ImportError:
+    flash_attn_func = flash_attn_varlen_func = None
 
 from typing import Optional
 
@@ -52,6 +59,129 @@ if 'EVAL_LARGE' in os.environ:
 else:
     EVAL_LARGE = False
 
+# Pre-rescale the positional embeddings of the patch grids of the resolution policy at the first inference forward,
+# once the tower has its final device and dtype
+WARM_POS_EMBED = 'WARM_POS_EMBED' in os.environ
+
+# 'flash', 'sdpa', 'chunked', or 'auto' for flash-attention on CUDA half-precision inputs when installed, SDPA otherwise
+VIT_ATTN_BACKEND = os.environ.get('VIT_ATTN_BACKEND', 'auto')
+if VIT_ATTN_BACKEND not in ('auto', 'flash', 'sdpa', 'chunked'):
+    raise ValueError(f"Unknown VIT_ATTN_BACKEND: {VIT_ATTN_BACKEND}")
+VIT_ATTN_CHUNK = int(os.environ.get('VIT_ATTN_CHUNK', 1024))
+
+# Inference runs the ViT over groups of images or frames of at most this many patch tokens (0 for one pass),
+# or of at most about this many MB of block activations
+VIT_STREAM_TOKENS = int(os.environ.get('VIT_STREAM_TOKENS', 0))
+VIT_STREAM_MB = float(os.environ.get('VIT_STREAM_MB', 0))
+
+# Inference token pruning: after block VIT_PRUNE_LAYER (-1 for none), images of at least VIT_PRUNE_MIN_TOKENS patches
+# keep their VIT_PRUNE_KEEP fraction of most important tokens, scored by 'norm' (feature norm) or 'attn' (attention
+# from the mean token). Pruned slots get the final features of their 'nearest' kept token at the pruning block,
+# or keep their 'frozen' features of the pruning block
+VIT_PRUNE_LAYER = int(os.environ.get('VIT_PRUNE_LAYER', -1))
+VIT_PRUNE_KEEP = float(os.environ.get('VIT_PRUNE_KEEP', 0.5))
+VIT_PRUNE_MIN_TOKENS = int(os.environ.get('VIT_PRUNE_MIN_TOKENS', 1024))
+VIT_PRUNE_SCORE = os.environ.get('VIT_PRUNE_SCORE', 'norm')
+if VIT_PRUNE_SCORE not in ('attn', 'norm'):
+    raise ValueError(f"Unknown VIT_PRUNE_SCORE: {VIT_PRUNE_SCORE}")
+VIT_PRUNE_FILL = os.environ.get('VIT_PRUNE_FILL', 'nearest')
+if VIT_PRUNE_FILL not in ('nearest', 'frozen'):
+    raise ValueError(f"Unknown VIT_PRUNE_FILL: {VIT_PRUNE_FILL}")
+
+# Inference runs the blocks compiled with torch.compile, on token sequences padded to the smallest of these token
+# counts (patch grids 16x16 to 96x96) that fits; longer sequences run eagerly
+VIT_COMPILE = 'VIT_COMPILE' in os.environ
+VIT_COMPILE_BUCKETS = [int(tokens) for tokens in os.environ.get('VIT_COMPILE_BUCKETS', '256,576,1024,1600,2304,4096,9216').split(',')]
+# Named cache_size_limit before torch 2.6
+_RECOMPILE_LIMIT = 'recompile_limit' if hasattr(torch._dynamo.config, 'recompile_limit') else 'cache_size_limit'
+
+def pack_by_tokens(token_counts, max_tokens):
+    """Greedy first-fit packs of indices of `token_counts`, each within `max_tokens` unless a single item is over it.
+
+    Items are taken in order: each pack starts with the oldest remaining item and is filled with the following
+    items that still fit.
+    """
+    packs = []
+    remaining = list(range(len(token_counts)))
+    while remaining:
+        pack, total, rest = [], 0, []
+        for idx in remaining:
+            if not pack or total + token_counts[idx] <= max_tokens:
+                pack.append(idx)
+                total += token_counts[idx]
+            else:
+                rest.append(idx)
+        packs.append(pack)
+        remaining = rest
+    return packs
+
+def select_attn_backend(x, backend=None):
+    """The attention backend for inputs like `x`: `backend`, or VIT_ATTN_BACKEND, resolved by availability if 'auto'."""
+    backend = backend or VIT_ATTN_BACKEND
+    if backend == 'auto':
+        if flash_attn_func is not None and x.is_cuda and x.dtype in (torch.float16, torch.bfloat16):
+            return 'flash'
+        return 'sdpa'
+    if backend == 'flash' and flash_attn_func is None:
+        raise ImportError("flash_attn is not installed, set VIT_ATTN_BACKEND to 'sdpa' or 'chunked'")
+    return backend
+
+def sdpa_attention(q, k, v, scale, attn_mask=None):
+    """Non-causal attention over B×N×heads×head_dim q, k, v with torch's scaled_dot_product_attention."""
+    x = F.scaled_dot_product_attention(q.transpose(1, 2), k.transpose(1, 2), v.transpose(1, 2), attn_mask=attn_mask,
+                                       scale=scale)
+    return x.transpose(1, 2)
+
+def chunked_attention(q, k, v, scale, chunk_size=None):
+    """Non-causal attention over B×N×heads×head_dim q, k, v, `chunk_size` queries at a time.
+
+    Only a chunk_size×N score matrix per head is materialized, with the softmax in float32.
+    """
+    chunk_size = chunk_size or VIT_ATTN_CHUNK
+    q, k, v = q.transpose(1, 2), k.transpose(1, 2), v.transpose(1, 2)
+    x = torch.empty_like(q)
+    for start in range(0, q.shape[2], chunk_size):
+        scores = torch.matmul(q[:, :, start:start + chunk_size], k.transpose(-1, -2)).float().mul_(scale)
+        x[:, :, start:start + chunk_size] = torch.matmul(scores.softmax(dim=-1).to(v.dtype), v)
+    return x.transpose(1, 2)
+
+def vit_attention(q, k, v, scale, cu_slens=None, backend=None, attn_mask=None):
+    """Non-causal attention over B×N×heads×head_dim q, k, v, returning B×N×heads×head_dim like `flash_attn_func`.
+
+    With `cu_slens` (B == 1), the tokens are packed segments delimited by the cumulative lengths, and
+    each segment only attends to itself, like `flash_attn_varlen_func`. Without flash-attention the
+    segments are attended to one by one, or as one batch if they are all of the same length. A boolean B×1×1×N `attn_mask` of the keys to
+    attend to (e.g. not padding) is applied with SDPA.
+    """
+    if attn_mask is not None:
+        return sdpa_attention(q, k, v, scale, attn_mask=attn_mask)
+    backend = select_attn_backend(q, backend)
+    if backend == 'flash':
+        if cu_slens is None:
+            return flash_attn_func(q, k, v, softmax_scale=scale)
+        max_seqlen = torch.max(cu_slens[1:] - cu_slens[:-1]).item()
+        x = flash_attn_varlen_func(
+            q.squeeze(0),
+            k.squeeze(0),
+            v.squeeze(0),
+            cu_seqlens_q=cu_slens,
+            cu_seqlens_k=cu_slens,
+            max_seqlen_q=max_seqlen,
+            max_seqlen_k=max_seqlen,
+            softmax_scale=scale,
+            causal=False,
+            )
+        return x.unsqueeze(0)
+
+    attend = sdpa_attention if backend == 'sdpa' else chunked_attention
+    if cu_slens is None:
+        return attend(q, k, v, scale)
+    bounds = cu_slens.tolist()
+    lengths = [end - start for start, end in zip(bounds[:-1], bounds[1:])]
+    if len(set(lengths)) == 1:
+        return attend(*(t.reshape(-1, lengths[0], *t.shape[2:]) for t in (q, k, v)), scale).reshape(q.shape)
+    return torch.cat([attend(q[:, start:end], k[:, start:end], v[:, start:end], scale) for start, end in zip(bounds[:-1], bounds[1:])], dim=1)
+
 def _no_grad_trunc_normal_(tensor, mean, std, a, b):
     # Cut & paste from PyTorch official master until it's in a few official releases - RW
     # Method based on https://people.sc.fsu.edu/~jburkardt/presentations/truncated_normal.pdf
@@ -162,7 +292,7 @@ class Attention(nn.Module):
         self.proj = nn.Linear(dim, dim)
         self.proj_drop = nn.Dropout(proj_drop) if proj_drop > 0.0 else nn.Identity()
 
-    def forward(self, x: torch.Tensor, cu_slens=None) -> torch.Tensor:
+    def forward(self, x: torch.Tensor, cu_slens=None, attn_mask=None) -> torch.Tensor:
         B, N, C = x.shape
         qkv = (
             self.qkv(x)
@@ -172,36 +302,14 @@ class Attention(nn.Module):
         q, k, v = qkv.unbind(0)
         q, k = self.q_norm(q), self.k_norm(k)
 
-        if cu_slens is not None:
-            q = q.permute(0, 2, 1, 3)   # B, num_heads, N, C -> B, N, num_heads, C
-            k = k.permute(0, 2, 1, 3)
-            v = v.permute(0, 2, 1, 3)
-            max_seqlen = torch.max(cu_slens[1:] - cu_slens[:-1]).item()
-            x = flash_attn_varlen_func(
-                q.squeeze(0),
-                k.squeeze(0),
-                v.squeeze(0),
-                cu_seqlens_q=cu_slens,
-                cu_seqlens_k=cu_slens,
-                max_seqlen_q=max_seqlen,
-                max_seqlen_k=max_seqlen,
-                softmax_scale=self.scale,
-                causal=False,
-                )
-
-            x = x.reshape(B, N, -1)
-            x = self.proj(x)
-            x = self.proj_drop(x)
+        q = q.permute(0, 2, 1, 3)   # B, num_heads, N, C -> B, N, num_heads, C
+        k = k.permute(0, 2, 1, 3)
+        v = v.permute(0, 2, 1, 3)
+        x = vit_attention(q, k, v, self.scale, cu_slens=cu_slens, attn_mask=attn_mask) # -> b, n, h, c
 
-        else:
-            q = q.permute(0, 2, 1, 3)   # B, num_heads, N, C -> B, N, num_heads, C
-            k = k.permute(0, 2, 1, 3)
-            v = v.permute(0, 2, 1, 3)
-            x = flash_attn_func(q, k, v, softmax_scale=self.scale) # -> b, n, h, c
-
-            x = x.reshape(B, N, -1)
-            x = self.proj(x)
-            x = self.proj_drop(x)
+        x = x.reshape(B, N, -1)
+        x = self.proj(x)
+        x = self.proj_drop(x)
         return x
 
 
@@ -264,8 +372,8 @@ class Block(nn.Module):
         )
         self.drop_path2 = DropPath(drop_path) if drop_path > 0.0 else nn.Identity()
 
-    def forward(self, x: torch.Tensor, cu_slens=None) -> torch.Tensor:
-        x = x + self.drop_path1(self.ls1(self.attn(self.norm1(x), cu_slens=cu_slens)))
+    def forward(self, x: torch.Tensor, cu_slens=None, attn_mask=None) -> torch.Tensor:
+        x = x + self.drop_path1(self.ls1(self.attn(self.norm1(x), cu_slens=cu_slens, attn_mask=attn_mask)))
         x = x + self.drop_path2(self.ls2(self.mlp(self.norm2(x))))
         return x
 
@@ -314,6 +422,7 @@ class VisionTransformer(nn.Module):
         block_fn: Type[nn.Module] = Block,
         mlp_layer: Type[nn.Module] = Mlp,
         ignore_head: bool = False,
+        pos_embed_cache_size: int = 64,
     ) -> None:
         """
         Args:
@@ -341,6 +450,7 @@ class VisionTransformer(nn.Module):
             norm_layer: Normalization layer.
             act_layer: MLP activation layer.
             block_fn: Transformer block layer.
+            pos_embed_cache_size: Number of rescaled positional embeddings kept for inference.
         """
         super().__init__()
         assert global_pool in ("", "avg", "token", "map")
@@ -393,6 +503,12 @@ class VisionTransformer(nn.Module):
             num_patches if no_embed_class else num_patches + self.num_prefix_tokens
         )
         self.pos_embed = nn.Parameter(torch.randn(1, embed_len, embed_dim) * 0.02)
+        self.pos_embed_cache_size = pos_embed_cache_size
+        self._pos_embed_cache = OrderedDict()
+        self._pos_embed_cache_stamp = None
+        self.last_kept_tokens = None
+        self.compile_buckets = None
+        self._compiled_blocks = {}
         self.pos_drop = nn.Dropout(p=pos_drop_rate)
         if patch_drop_rate > 0:
             self.patch_drop = PatchDropout(
@@ -469,10 +585,50 @@ class VisionTransformer(nn.Module):
         )
 
     def rescale_positional_embedding(self, out_size):
+        """`pos_embed` bilinearly rescaled to the (h, w) patch grid `out_size`.
+
+        In inference, the rescaled embeddings are kept in an LRU cache of `pos_embed_cache_size` grids, keyed by
+        (h, w, dtype, device). The cache is cleared when `pos_embed` is replaced or modified in place, and bypassed
+        (and cleared) in training mode or when gradients flow into `pos_embed`.
+        """
         h, w = out_size
         pos_embed_shape = int((self.pos_embed.shape[1]) ** 0.5)
         if (h, w) == (pos_embed_shape, pos_embed_shape):
             return self.pos_embed
+        if self.training or (torch.is_grad_enabled() and self.pos_embed.requires_grad) or self.pos_embed_cache_size <= 0:
+            self._pos_embed_cache.clear()
+            return self._rescale_positional_embedding(h, w, pos_embed_shape)
+
+        stamp = (self.pos_embed.data_ptr(), self.pos_embed._version)
+        if stamp != self._pos_embed_cache_stamp:
+            self._pos_embed_cache.clear()
+            self._pos_embed_cache_stamp = stamp
+        key = (h, w, self.pos_embed.dtype, self.pos_embed.device)
+        rescaled_positional_embedding = self._pos_embed_cache.get(key)
+        if rescaled_positional_embedding is not None:
+            self._pos_embed_cache.move_to_end(key)
+            return rescaled_positional_embedding
+        rescaled_positional_embedding = self._rescale_positional_embedding(h, w, pos_embed_shape)
+        self._pos_embed_cache[key] = rescaled_positional_embedding
+        while len(self._pos_embed_cache) > self.pos_embed_cache_size:
+            self._pos_embed_cache.popitem(last=False)
+        return rescaled_positional_embedding
+
+    def warm_pos_embed_cache(self, grids):
+        """Fills the positional embedding cache for the (h, w) patch `grids`, e.g. `ResolutionPolicy.warm_grids()`.
+
+        The cache grows to hold all of them, so the warm-up does not evict its own first grids.
+        """
+        if self.pos_embed_cache_size <= 0:
+            return
+        grids = list(dict.fromkeys(tuple(grid) for grid in grids))
+        self.pos_embed_cache_size = max(self.pos_embed_cache_size, len(grids))
+        with torch.no_grad():
+            for grid in grids:
+                self.rescale_positional_embedding(grid)
+
+    def _rescale_positional_embedding(self, h, w, pos_embed_shape):
+        out_size = (h, w)
         rescaled_positional_embedding = \
             self.pos_embed.new_zeros(1, h*w, self.pos_embed.shape[2])
         pe_2d = self.pos_embed[0].T.contiguous().view(1, -1, pos_embed_shape, pos_embed_shape)
@@ -566,7 +722,43 @@ class VisionTransformer(nn.Module):
             return tuple(zip(outputs, prefix_tokens))
         return tuple(outputs)
 
+    def stream_token_budget(self, dtype=None):
+        """Patch tokens per group of streamed inference: VIT_STREAM_TOKENS, or the tokens whose block activations fit
+        in VIT_STREAM_MB; 0 to run every image in one pass."""
+        if VIT_STREAM_TOKENS > 0:
+            return VIT_STREAM_TOKENS
+        if VIT_STREAM_MB > 0:
+            dtype = dtype or self.pos_embed.dtype
+            # residual, norm, qkv and attention output of the embedding width, and the MLP hidden layer
+            width = self.embed_dim * 6 + self.blocks[0].mlp.fc1.out_features
+            return max(1, int(VIT_STREAM_MB * 1024 ** 2 // (width * torch.finfo(dtype).bits // 8)))
+        return 0
+
     def forward_features_list(self, x_list):
+        budget = self.stream_token_budget()
+        if budget <= 0 or torch.is_grad_enabled():
+            return self._forward_features_list(x_list)
+
+        # Streamed: groups of images within the token budget, their features written into one preallocated buffer
+        patch_h, patch_w = self.patch_embed.patch_size
+        grids = [(math.ceil(x.shape[2] / patch_h), math.ceil(x.shape[3] / patch_w)) for x in x_list]
+        slen = [h * w for h, w in grids]
+        if sum(slen) <= budget:
+            return self._forward_features_list(x_list)
+        offsets = [0]
+        for length in slen:
+            offsets.append(offsets[-1] + length)
+        out = None
+        for group in pack_by_tokens(slen, budget):
+            feats, _ = self._forward_features_list([x_list[idx] for idx in group])
+            if out is None:
+                out = feats[0].new_empty(feats[0].shape[0], offsets[-1], feats[0].shape[2])
+            for idx, feat in zip(group, feats):
+                out[:, offsets[idx]:offsets[idx + 1]] = feat
+            del feats
+        return out.split(slen, dim=1), grids
+
+    def _forward_features_list(self, x_list):
         x_all = []
         image_sizes = []
         for x in x_list:
@@ -599,6 +791,11 @@ class VisionTransformer(nn.Module):
             cu_indices.append(cu_indices[-1] + i)
 
         cu_slens = torch.tensor(cu_indices, dtype=torch.int32).to(x.device)
+        if self.compile_enabled() and not self.pruning_enabled() and all(self.compile_bucket(n) for n in slen):
+            return self._forward_blocks_compiled(x_all), image_sizes
+        if self.pruning_enabled():
+            x = self._forward_blocks_pruned(x, cu_slens)
+            return x.split(slen, dim=1), image_sizes
         for idx, blk in enumerate(self.blocks):
             if self.grad_checkpointing and not torch.jit.is_scripting():
                 x = checkpoint(blk, x, cu_slens, use_reentrant=True)
@@ -608,6 +805,23 @@ class VisionTransformer(nn.Module):
         return feats, image_sizes
 
     def forward_features(self, x: torch.Tensor) -> torch.Tensor:
+        budget = self.stream_token_budget()
+        tokens = (x.shape[2] // self.patch_embed.patch_size[0]) * (x.shape[3] // self.patch_embed.patch_size[1])
+        if budget <= 0 or torch.is_grad_enabled() or x.shape[0] * tokens <= budget:
+            return self._forward_features(x)
+
+        # Streamed: groups of frames within the token budget, written into one preallocated buffer
+        step = max(1, budget // tokens)
+        out = None
+        for start in range(0, x.shape[0], step):
+            feats, size = self._forward_features(x[start:start + step])
+            if out is None:
+                out = feats.new_empty(x.shape[0], feats.shape[1], feats.shape[2])
+            out[start:start + feats.shape[0]] = feats
+            del feats
+        return out, size
+
+    def _forward_features(self, x: torch.Tensor) -> torch.Tensor:
         if EVAL_LARGE:
             x = x.to('cuda:0')
         bs, _, h, w = x.shape
@@ -619,12 +833,129 @@ class VisionTransformer(nn.Module):
         x = x + self.rescale_positional_embedding(out_size=(h, w))
         x = self.patch_drop(x)
         x = self.norm_pre(x)
-        if self.grad_checkpointing and not torch.jit.is_scripting():
+        if self.pruning_enabled():
+            x = self._forward_blocks_pruned(x)
+        elif self.compile_enabled() and self.compile_bucket(x.shape[1]):
+            x = self._forward_blocks_compiled([x])[0]
+        elif self.grad_checkpointing and not torch.jit.is_scripting():
             x = checkpoint_seq(self.blocks, x)
         else:
             x = self.blocks(x)
         return x, (h, w)
 
+    def enable_compile(self, buckets=None):
+        """Runs the blocks in inference compiled, with a static token count per bucket (VIT_COMPILE_BUCKETS by default)
+        and a dynamic batch size."""
+        self.compile_buckets = sorted(buckets or VIT_COMPILE_BUCKETS)
+        self._compiled_blocks = torch.compile(self._forward_blocks_masked)
+
+    def compile_enabled(self):
+        return self.compile_buckets is not None and not torch.is_grad_enabled()
+
+    def compile_bucket(self, num_tokens):
+        """The smallest bucket of at least `num_tokens` tokens, or None."""
+        return next((bucket for bucket in self.compile_buckets if bucket >= num_tokens), None)
+
+    def _forward_blocks_masked(self, x, mask):
+        attn_mask = mask[:, None, None, :]
+        for blk in self.blocks:
+            x = blk(x, attn_mask=attn_mask)
+        return x
+
+    def _forward_blocks_compiled(self, x_list):
+        """The blocks over each B×N×C sequence of `x_list` (images or frames attending within themselves).
+
+        The sequences of one bucket are zero-padded to its length and stacked, and go through that bucket's
+        compiled graph with the padded keys masked out of the attention. The batch dimension is marked dynamic
+        and the token count is kept static, so each bucket compiles two graphs: one for batches of 1 (which
+        dynamo specializes) and one for all larger batches. Dynamo's recompile limit is raised to fit them.
+        """
+        by_bucket = {}
+        for idx, x in enumerate(x_list):
+            by_bucket.setdefault(self.compile_bucket(x.shape[1]), []).append(idx)
+        out = [None] * len(x_list)
+        for bucket, indices in by_bucket.items():
+            x = torch.cat([F.pad(x_list[idx], (0, 0, 0, bucket - x_list[idx].shape[1])) for idx in indices])
+            lengths = torch.tensor([x_list[idx].shape[1] for idx in indices for _ in range(x_list[idx].shape[0])],
+                                   device=x.device)
+            mask = torch.arange(bucket, device=x.device)[None, :] < lengths[:, None]
+            torch._dynamo.maybe_mark_dynamic(x, 0)
+            torch._dynamo.maybe_mark_dynamic(mask, 0)
+            with torch._dynamo.config.patch(automatic_dynamic_shapes=False, **{_RECOMPILE_LIMIT: max(
+                    getattr(torch._dynamo.config, _RECOMPILE_LIMIT), 2 * len(self.compile_buckets))}):
+                x = self._compiled_blocks(x, mask)
+            for idx, feats in zip(indices, x.split([x_list[idx].shape[0] for idx in indices])):
+                out[idx] = feats[:, :x_list[idx].shape[1]]
+        return out
+
+    def pruning_enabled(self):
+        return 0 <= VIT_PRUNE_LAYER < len(self.blocks) and VIT_PRUNE_KEEP < 1 and not torch.is_grad_enabled()
+
+    def pruning_config(self):
+        """The VIT_PRUNE_* settings the features depend on, or '' without pruning."""
+        if not self.pruning_enabled():
+            return ''
+        return f'prune={VIT_PRUNE_LAYER},{VIT_PRUNE_KEEP},{VIT_PRUNE_MIN_TOKENS},{VIT_PRUNE_SCORE},{VIT_PRUNE_FILL}'
+
+    def token_importance(self, blk, x, bounds):
+        """B×N importance of the tokens of `x` (B×N×C, images between consecutive `bounds`) entering block `blk`."""
+        if VIT_PRUNE_SCORE == 'norm':
+            return x.float().norm(dim=-1)
+        # Attention of the mean token of each image to its tokens, averaged over heads
+        attn = blk.attn
+        h = blk.norm1(x)
+        B, N, C = h.shape
+        weight, bias = attn.qkv.weight, attn.qkv.bias
+        scores = x.new_empty(B, N, dtype=torch.float32)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            q = F.linear(h[:, start:end].mean(dim=1, keepdim=True), weight[:C], None if bias is None else bias[:C])
+            k = F.linear(h[:, start:end], weight[C:2 * C], None if bias is None else bias[C:2 * C])
+            q = attn.q_norm(q.reshape(B, 1, attn.num_heads, attn.head_dim))
+            k = attn.k_norm(k.reshape(B, end - start, attn.num_heads, attn.head_dim))
+            logits = torch.einsum('bqhd,bnhd->bhn', q, k).float() * attn.scale
+            scores[:, start:end] = logits.softmax(dim=-1).mean(dim=1)
+        return scores
+
+    def _forward_blocks_pruned(self, x, cu_slens=None):
+        """The blocks over `x` (B×N×C, packed per `cu_slens`), carrying only the kept tokens of each large image past
+        block VIT_PRUNE_LAYER; see VIT_PRUNE_* for the scores and how pruned slots are filled."""
+        for blk in self.blocks[:VIT_PRUNE_LAYER]:
+            x = blk(x, cu_slens=cu_slens)
+        B, N, C = x.shape
+        bounds = cu_slens.tolist() if cu_slens is not None else [0, N]
+        scores = self.token_importance(self.blocks[VIT_PRUNE_LAYER], x, bounds)
+        keep, kept_bounds = [], [0]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            num_keep = end - start
+            if num_keep >= VIT_PRUNE_MIN_TOKENS:
+                num_keep = max(1, math.ceil(num_keep * VIT_PRUNE_KEEP))
+            keep.append(scores[:, start:end].topk(num_keep, dim=1).indices.sort(dim=1).values + start)
+            kept_bounds.append(kept_bounds[-1] + num_keep)
+        keep = torch.cat(keep, dim=1)
+        self.last_kept_tokens = [keep[:, a:b] - start for a, b, start in zip(kept_bounds[:-1], kept_bounds[1:], bounds[:-1])]
+        if kept_bounds[-1] == N:
+            for blk in self.blocks[VIT_PRUNE_LAYER:]:
+                x = blk(x, cu_slens=cu_slens)
+            return x
+
+        keep_index = keep.unsqueeze(-1).expand(-1, -1, C)
+        kept = x.gather(1, keep_index)
+        kept_cu_slens = torch.tensor(kept_bounds, dtype=torch.int32, device=x.device) if cu_slens is not None else None
+        final = kept
+        for blk in self.blocks[VIT_PRUNE_LAYER:]:
+            final = blk(final, cu_slens=kept_cu_slens)
+
+        if VIT_PRUNE_FILL == 'nearest':
+            # Every token takes the final features of the kept token of its image closest to it at the pruning block
+            normed, kept_normed = F.normalize(x.float(), dim=-1), F.normalize(kept.float(), dim=-1)
+            source = torch.empty(B, N, dtype=torch.long, device=x.device)
+            for start, end, kept_start, kept_end in zip(bounds[:-1], bounds[1:], kept_bounds[:-1], kept_bounds[1:]):
+                for row in range(start, end, 1024):
+                    similarity = normed[:, row:min(row + 1024, end)] @ kept_normed[:, kept_start:kept_end].transpose(1, 2)
+                    source[:, row:min(row + 1024, end)] = similarity.argmax(dim=-1) + kept_start
+            x = final.gather(1, source.unsqueeze(-1).expand(-1, -1, C))
+        return x.scatter(1, keep_index, final)
+
     def forward_head(self, x: torch.Tensor, pre_logits: bool = False) -> torch.Tensor:
         x = self.norm(x)
         if self.attn_pool is not None:
@@ -788,6 +1119,7 @@ class OryxViTWrapper(nn.Module):
         self.select_feature = getattr(args, 'mm_vision_select_feature', 'patch')
 
         self.output_dim = 1152
+        self.feature_cache = VisionFeatureCache.from_env()
 
         if not delay_load:
             self.load_model()
@@ -811,6 +1143,9 @@ class OryxViTWrapper(nn.Module):
         for p in self.vision_tower.parameters():
             p.requires_grad = False
         self.vision_tower.eval()
+        if VIT_COMPILE:
+            self.vision_tower.enable_compile()
+        self.pos_embed_warm = not WARM_POS_EMBED
         self.is_loaded = True
 
     def train(self, mode = True):
@@ -833,9 +1168,31 @@ class OryxViTWrapper(nn.Module):
     
     def forward(self, images, cal_attn_pool=False):
         with torch.no_grad():
+            if not self.pos_embed_warm and not self.training:
+                # Not in `load_model`: moving the tower to its device and dtype afterwards empties the cache
+                from oryx.mm_utils import DEFAULT_RESOLUTION_POLICY
+                self.vision_tower.warm_pos_embed_cache(DEFAULT_RESOLUTION_POLICY.warm_grids())
+                self.pos_embed_warm = True
+            if self.feature_cache is not None and not self.training and not cal_attn_pool:
+                namespace = f'{self.vision_tower_name}|{self.weights_fingerprint}|{self.dtype}|{self.vision_tower.pruning_config()}'
+                return cached_forward(self.feature_cache, lambda x: self.forward_func(x)[:2], images,
+                                      namespace=namespace, device=self.device)
             image_features, img_size, cls_token = self.forward_func(images, cal_attn_pool=cal_attn_pool)
             return image_features, img_size
 
+    @property
+    def weights_fingerprint(self):
+        """Identifies the loaded weights in the feature cache keys: checkpoints loaded from the same `oryx_vit:<path>`
+        or fine-tuned from it share the tower name but not the weights.
+
+        It is recomputed whenever a parameter is replaced or modified in place, e.g. by `load_state_dict`.
+        """
+        stamp = tuple((param.data_ptr(), param._version) for param in self.vision_tower.parameters())
+        if stamp != getattr(self, '_weights_fingerprint_stamp', None):
+            self._weights_fingerprint = weights_fingerprint(self.vision_tower)
+            self._weights_fingerprint_stamp = stamp
+        return self._weights_fingerprint
+
     @property
     def dummy_feature(self):
         return torch.zeros(1, 1152, device=self.device, dtype=self.dtype)
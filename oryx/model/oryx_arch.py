@@ -8,6 +8,7 @@ from .multimodal_resampler.builder import build_vision_resampler
 from .multimodal_projector.builder import build_vision_projector
 
 from oryx.constants import IGNORE_INDEX, IMAGE_TOKEN_INDEX, DEFAULT_IMAGE_PATCH_TOKEN, DEFAULT_IM_START_TOKEN, DEFAULT_IM_END_TOKEN
+from oryx.mm_utils import group_by_shape
 
 import ast
 import torch.distributed as dist
@@ -136,14 +137,18 @@ class OryxMetaForCausalLM(ABC):
                 modalities.append('image')
 
         lowres_img_features, lowres_img_sizes = self.get_model().get_vision_tower()(lowres_img)
-        highres_img_features = []
-        highres_img_sizes = []
-        for idx, img_feat in enumerate(images_highres):
-            if img_feat.ndim == 5:
-                img_feat = img_feat.squeeze(1)
-            highres_img_feature, highres_img_size = self.get_model().get_vision_tower()(img_feat)
-            highres_img_features.append(highres_img_feature)
-            highres_img_sizes.append(highres_img_size)
+        highres_imgs = [img_feat.squeeze(1) if img_feat.ndim == 5 else img_feat for img_feat in images_highres]
+        highres_img_features = [None] * len(highres_imgs)
+        highres_img_sizes = [None] * len(highres_imgs)
+        # Single images of one shape (e.g. one resolution bucket) go through the vision tower in one pass; videos one by one
+        singles = [idx for idx, img_feat in enumerate(highres_imgs) if img_feat.shape[0] == 1]
+        groups = [[idx] for idx, img_feat in enumerate(highres_imgs) if img_feat.shape[0] != 1]
+        groups += [[singles[i] for i in group] for group in group_by_shape([highres_imgs[idx] for idx in singles])]
+        for group in groups:
+            highres_img_feature, highres_img_size = self.get_model().get_vision_tower()(torch.cat([highres_imgs[idx] for idx in group]))
+            for idx, feature in zip(group, highres_img_feature.split(highres_imgs[group[0]].shape[0])):
+                highres_img_features[idx] = feature
+                highres_img_sizes[idx] = highres_img_size
         image_features = []
         for idx in range(len(modalities)):
             img_feat_highres, img_size_highres = self.get_model().vision_resampler(highres_img_features[idx],
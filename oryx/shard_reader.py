@@ -0,0 +1,91 @@
+import io
+import os
+import mmap
+import base64
+import functools
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+
+class PackedShardReader:
+    """Reads records of packed shard files through an LRU pool of read-only memory maps.
+
+    A `patch_info` names its shard in `patch` (relative to `data_folder`) and its records by `start_num`
+    and `size` (a list of sizes of consecutive records for videos). Records are base64 encoded if
+    `image_encoding` is 'base64'.
+    """
+
+    def __init__(self, data_folder=None, max_open=64):
+        self.data_folder = data_folder
+        self.max_open = max_open
+        self._maps = OrderedDict()
+
+    def _path(self, patch_info):
+        return os.path.join(self.data_folder, patch_info['patch']) if self.data_folder else patch_info['patch']
+
+    def _mapping(self, path):
+        mapping = self._maps.get(path)
+        if mapping is not None:
+            self._maps.move_to_end(path)
+            return mapping
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[path] = mapping
+        while len(self._maps) > self.max_open:
+            _, evicted = self._maps.popitem(last=False)
+            try:
+                evicted.close()
+            except BufferError:
+                # Records of it are still being decoded; the mapping is closed once they are released
+                pass
+        return mapping
+
+    def spans(self, patch_info):
+        """The (start, size) byte spans of the records of `patch_info` in its shard."""
+        start = int(patch_info['start_num'])
+        if isinstance(patch_info['size'], list):
+            spans = []
+            for size in patch_info['size']:
+                spans.append((start, int(size)))
+                start += int(size)
+            return spans
+        return [(start, int(patch_info['size']))]
+
+    def read_views(self, patch_info):
+        """Memoryviews of the raw records of `patch_info`; valid until the shard is evicted from the pool."""
+        view = memoryview(self._mapping(self._path(patch_info)))
+        return [view[start:start + size] for start, size in self.spans(patch_info)]
+
+    @staticmethod
+    def decode(view, patch_info, cv2_decode=False):
+        """Decodes one record. Base64 and OpenCV decoding read the mapped view directly."""
+        if patch_info.get('image_encoding') == 'base64':
+            return Image.open(io.BytesIO(base64.b64decode(view))).convert('RGB')
+        if cv2_decode:
+            import cv2
+            # Kept in OpenCV's BGR order, as the cv2-decoded video datasets have always been read
+            return Image.fromarray(cv2.imdecode(np.frombuffer(view, dtype=np.uint8), cv2.IMREAD_COLOR))
+        # PIL needs a file object; one C-level copy into BytesIO is cheaper than a Python file wrapper over the view
+        return Image.open(io.BytesIO(view)).convert('RGB')
+
+    def read_image(self, patch_info):
+        return self.decode(self.read_views(patch_info)[0], patch_info)
+
+    def read_video(self, patch_info, cv2_decode=False):
+        return [self.decode(view, patch_info, cv2_decode) for view in self.read_views(patch_info)]
+
+    def close(self):
+        for mapping in self._maps.values():
+            try:
+                mapping.close()
+            except BufferError:
+                pass
+        self._maps.clear()
+
+
+@functools.lru_cache(maxsize=None)
+def shard_reader(data_folder=None):
+    """The per-process PackedShardReader of `data_folder`."""
+    return PackedShardReader(data_folder)
@@ -210,6 +210,24 @@ def get_modality_length_grouped_indices_auto(lengths, batch_size, world_size, ge
     return [i for megabatch in megabatches for i in megabatch]
 
 
+def get_bucket_grouped_indices(buckets, batch_size, world_size, generator=None):
+    """
+    Return a list of indices so that each slice of `world_size * batch_size` consecutive indices holds samples of
+    the same resolution bucket where possible, so that their images stack. Samples are shuffled within each bucket,
+    and the batches are shuffled.
+    """
+
+    # We need to use torch for the random part as a distributed sampler will set the random seed for torch.
+    indices = torch.randperm(len(buckets), generator=generator).tolist()
+    indices = sorted(indices, key=lambda i: buckets[i])
+    world_batch_size = world_size * batch_size
+    batches = [indices[i : i + world_batch_size] for i in range(0, len(indices), world_batch_size)]
+    batch_indices = torch.randperm(len(batches), generator=generator)
+    batches = [batches[i] for i in batch_indices]
+
+    return [i for batch in batches for i in batch]
+
+
 class LengthGroupedSampler(Sampler):
     r"""
     Sampler that samples indices in a way that groups together features of the dataset of roughly the same length while
@@ -225,6 +243,7 @@ class LengthGroupedSampler(Sampler):
         variable_length: bool = False,
         group_by_modality: bool = False,
         group_by_modality_auto: bool = False,
+        group_by_bucket: bool = False,
     ):
         if lengths is None:
             raise ValueError("Lengths must be provided.")
@@ -236,12 +255,16 @@ class LengthGroupedSampler(Sampler):
         self.variable_length = variable_length
         self.group_by_modality = group_by_modality
         self.group_by_modality_auto = group_by_modality_auto
+        self.group_by_bucket = group_by_bucket
 
     def __len__(self):
         return len(self.lengths)
 
     def __iter__(self):
-        if self.variable_length:
+        if self.group_by_bucket:
+            # `lengths` are the resolution buckets of the samples here
+            indices = get_bucket_grouped_indices(self.lengths, self.batch_size, self.world_size, generator=self.generator)
+        elif self.variable_length:
             assert not self.group_by_modality, "Variable length grouping is not supported with modality grouping."
             indices = get_variable_length_grouped_indices(self.lengths, self.batch_size, self.world_size, generator=self.generator)
         else:
@@ -304,6 +327,13 @@ class OryxTrainer(Trainer):
                 lengths=lengths,
                 group_by_modality_auto=True,
             )
+        elif self.args.group_by_resolution_bucket:
+            return LengthGroupedSampler(
+                self.args.train_batch_size,
+                world_size=self.args.world_size * self.args.gradient_accumulation_steps,
+                lengths=self.train_dataset.resolution_buckets,
+                group_by_bucket=True,
+            )
         elif self.args.group_by_varlen:
             lengths = self.train_dataset.lengths
             return LengthGroupedSampler(
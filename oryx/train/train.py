@@ -1,6 +1,7 @@
 
 import os
 import copy
+import functools
 from dataclasses import dataclass, field
 import json
 import logging
@@ -22,7 +23,8 @@ from oryx.train.oryx_trainer import OryxTrainer
 
 from oryx import conversation as conversation_lib
 from oryx.model import *
-from oryx.mm_utils import tokenizer_image_token, process_anyres_highres_image_genli, process_anyres_video_genli, process_anyres_video_genli_long
+from oryx.shard_reader import shard_reader
+from oryx.mm_utils import tokenizer_image_token, tokenizer_image_token_batch, process_anyres_highres_image_genli, process_anyres_highres_image_genli_fused, process_anyres_video_genli, process_anyres_video_genli_long, process_anyres_video_genli_batch, DEFAULT_RESOLUTION_POLICY
 
 from PIL import Image
 import io
@@ -119,6 +121,7 @@ class TrainingArguments(transformers.TrainingArguments):
     group_by_varlen: bool = field(default=False)
     group_by_modality_length: bool = field(default=False)
     group_by_modality_length_auto: bool = field(default=False)
+    group_by_resolution_bucket: bool = field(default=False, metadata={"help": "Batch images of one RES_BUCKETS bucket together so they stack."})
     do_resize: bool = field(default=False)
     do_center_crop: bool = field(default=False)
 
@@ -461,7 +464,7 @@ def preprocess_llama_2(
     # Tokenize conversations
 
     if has_image:
-        input_ids = torch.stack([tokenizer_image_token(prompt, tokenizer, return_tensors='pt') for prompt in conversations], dim=0)
+        input_ids = torch.stack(tokenizer_image_token_batch(conversations, tokenizer, return_tensors='pt'), dim=0)
     else:
         input_ids = tokenizer(
             conversations,
@@ -542,7 +545,7 @@ def preprocess_llama_3(
     # Tokenize conversations
 
     if has_image:
-        input_ids = torch.stack([tokenizer_image_token(prompt, tokenizer, return_tensors='pt') for prompt in conversations], dim=0)
+        input_ids = torch.stack(tokenizer_image_token_batch(conversations, tokenizer, return_tensors='pt'), dim=0)
     else:
         input_ids = tokenizer(
             conversations,
@@ -651,7 +654,7 @@ def preprocess_v1(
     # Tokenize conversations
 
     if has_image:
-        input_ids = torch.stack([tokenizer_image_token(prompt, tokenizer, return_tensors='pt') for prompt in conversations], dim=0)
+        input_ids = torch.stack(tokenizer_image_token_batch(conversations, tokenizer, return_tensors='pt'), dim=0)
     else:
         input_ids = tokenizer(
             conversations,
@@ -827,7 +830,7 @@ def preprocess_imgsp_v1(
 
     # Tokenize conversations
     if has_image:
-        input_ids = torch.stack([tokenizer_image_token(prompt, tokenizer, return_tensors='pt') for prompt in conversations], dim=0)
+        input_ids = torch.stack(tokenizer_image_token_batch(conversations, tokenizer, return_tensors='pt'), dim=0)
     else:
         input_ids = tokenizer(
             conversations,
@@ -909,7 +912,7 @@ def preprocess_mpt(
     # Tokenize conversations
 
     if has_image:
-        input_ids = torch.stack([tokenizer_image_token(prompt, tokenizer, return_tensors='pt') for prompt in conversations], dim=0)
+        input_ids = torch.stack(tokenizer_image_token_batch(conversations, tokenizer, return_tensors='pt'), dim=0)
     else:
         input_ids = tokenizer(
             conversations,
@@ -1077,43 +1080,21 @@ def read_image_patch(patch_info, data_folder):
     if 'img_path' in patch_info.keys():
         image = Image.open(patch_info['img_path']).convert('RGB')
     else:
-        image_file_name = os.path.join(data_folder, patch_info['patch'])
-        start_bytes = int(patch_info['start_num'])
-        file_size = int(patch_info['size'])
-
-        with open(image_file_name, 'rb') as f:
-            f.seek(start_bytes)
-            if 'image_encoding' in patch_info.keys() and patch_info['image_encoding'] == 'base64':
-                image = Image.open(io.BytesIO(base64.b64decode(f.read(file_size).decode()))).convert("RGB")
-            else:
-                image = Image.open(io.BytesIO(f.read(file_size))).convert("RGB")
+        image = shard_reader(data_folder).read_image(patch_info)
     return image
 
 
+# Packed video shards of these datasets were written with OpenCV and are decoded with it
+CV2_VIDEO_PATCHES = ('sharegpt4o', 'ShareGPT4Video/new_patch', 'cinepile', 'nextqa', 'perceptiontest')
+
+
 def read_video_patch(patch_info, data_folder):
     if 'img_path' in patch_info.keys():
         image = Image.open(patch_info['img_path']).convert('RGB')
     else:
         image_file_name = os.path.join(data_folder, patch_info['patch'])
-        start_bytes = int(patch_info['start_num'])
-        file_size = patch_info['size'] # list of int
-        total_file_size = 0
-        images_all = []
-        with open(image_file_name, 'rb') as f:
-            for idx in range(len(file_size)):
-                f.seek(start_bytes + total_file_size)
-                if 'image_encoding' in patch_info.keys() and patch_info['image_encoding'] == 'base64':
-                    image = Image.open(io.BytesIO(base64.b64decode(f.read(int(file_size[idx])).decode()))).convert("RGB")
-                else:
-                    if 'sharegpt4o' in image_file_name or 'ShareGPT4Video/new_patch' in image_file_name or 'cinepile' in image_file_name or 'nextqa' in image_file_name or 'perceptiontest' in image_file_name:
-                        byte_str = io.BytesIO(f.read(int(file_size[idx])))
-                        array = np.frombuffer(byte_str.getvalue(), dtype=np.uint8)
-                        image = cv2.imdecode(array, cv2.IMREAD_COLOR)
-                        image = Image.fromarray(image)
-                    else:
-                        image = Image.open(io.BytesIO(f.read(int(file_size[idx])))).convert("RGB")
-                images_all.append(image)
-                total_file_size += int(file_size[idx])
+        cv2_decode = any(name in image_file_name for name in CV2_VIDEO_PATCHES)
+        images_all = shard_reader(data_folder).read_video(patch_info, cv2_decode=cv2_decode)
     return images_all
 
 
@@ -1164,15 +1145,42 @@ class LazySupervisedDataset(Dataset):
             length_list.append(cur_len)
         return length_list
 
+    @functools.cached_property
+    def resolution_buckets(self):
+        """Per sample, the high-resolution sizes of its images, read from the image headers once; () for samples
+        without images."""
+        bucket_list = []
+        for sample in self.list_data_dict:
+            image_files = sample.get('image', [])
+            image_files = image_files if type(image_files) is list else [image_files]
+            try:
+                bucket_list.append(tuple(DEFAULT_RESOLUTION_POLICY.plan(*self.image_size(f), 'image').size for f in image_files))
+            except OSError as e:
+                rank0_print(f"Failed to read the size of {image_files}: {e}")
+                bucket_list.append(())
+        return bucket_list
+
+    def image_size(self, image_file):
+        """The (width, height) of an image path or packed image from its header, without decoding it."""
+        if type(image_file) is str:
+            with Image.open(image_file) as image:
+                return image.size
+        data = shard_reader(self.data_args.data_folder).read_views(image_file)[0]
+        if image_file.get('image_encoding') == 'base64':
+            data = base64.b64decode(data)
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size
+
     def process_image(self, image_file):
         if type(image_file) is str:
-            image = Image.open(image_file).convert('RGB')
+            # Decoded and converted to RGB once, in process_anyres_highres_image_genli_fused
+            image = Image.open(image_file)
         elif type(image_file) is dict:
             image = read_image_patch(image_file, self.data_args.data_folder)
         else:
             raise ValueError(f"Unknown image file type: {type(image_file)}, {image_file}")
         image_size = image.size
-        image, image_padded = process_anyres_highres_image_genli(image, self.data_args.image_processor)
+        image, image_padded = process_anyres_highres_image_genli_fused(image, self.data_args.image_processor)
 
         return (image, image_padded), image_size, "image"
     
@@ -1181,7 +1189,6 @@ class LazySupervisedDataset(Dataset):
             video = read_video_file(video_file)
         else:
             video = read_video_patch(video_file)
-        video_processed = []
 
         cur_frames_upbound = self.data_args.frames_upbound
 
@@ -1192,17 +1199,13 @@ class LazySupervisedDataset(Dataset):
             else:
                 frame_idx = None
 
-        for idx, frame in enumerate(video):
-            frame = process_anyres_video_genli(frame, self.data_args.image_processor)
-            if frame_idx is not None and idx in frame_idx:
-                video_processed.append(frame.unsqueeze(0))
-            elif frame_idx is None:
-                video_processed.append(frame.unsqueeze(0))
-        
+        # Only the sampled frames are preprocessed, in one batch
+        if frame_idx is not None:
+            video = [video[idx] for idx in sorted(set(frame_idx))]
+        video_processed = process_anyres_video_genli_batch(video, self.data_args.image_processor)
+
         if frame_idx is None:
             frame_idx = np.arange(0, len(video_processed), dtype=int).tolist()
-        
-        video_processed = torch.cat(video_processed, dim=0)
 
         video_processed = (video_processed, video_processed)
         return (video_processed, (384, 384), "video"), frame_idx
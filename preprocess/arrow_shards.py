@@ -0,0 +1,102 @@
+import os
+import json
+import hashlib
+from typing import Dict, List, Optional
+
+from datasets import Dataset, Features, concatenate_datasets
+from datasets.arrow_writer import ArrowWriter
+
+SPLITS = ("train", "validation", "test")
+STATE_FILE = "shards.json"
+
+class SplitShardWriter:
+    """Streams encoded examples into bounded Arrow shards per split.
+
+    Shards are written as `<split>-<index>.arrow` in the datasets cache format, so they can be reopened
+    memory-mapped with `Dataset.from_file`. Rows are flushed every `writer_batch_size` examples and a new
+    shard is started every `rows_per_shard` rows, so memory does not grow with the archive.
+    """
+
+    def __init__(self, output_dir: str, features: Features, rows_per_shard: int = 1000, writer_batch_size: int = 64):
+        self.output_dir = output_dir
+        self.features = features
+        self.rows_per_shard = rows_per_shard
+        self.writer_batch_size = writer_batch_size
+        self.shards: Dict[str, List[str]] = {split: [] for split in SPLITS}
+        self._writers: Dict[str, ArrowWriter] = {}
+        self._rows: Dict[str, int] = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _open(self, split: str) -> ArrowWriter:
+        name = f"{split}-{len(self.shards[split]):05d}.arrow"
+        self.shards[split].append(name)
+        self._rows[split] = 0
+        self._writers[split] = ArrowWriter(features=self.features, path=os.path.join(self.output_dir, name), writer_batch_size=self.writer_batch_size)
+        return self._writers[split]
+
+    def write(self, split: str, example: Dict) -> None:
+        writer = self._writers.get(split)
+        if writer is None or self._rows[split] >= self.rows_per_shard:
+            if writer is not None:
+                writer.finalize()
+                writer.close()
+            writer = self._open(split)
+        writer.write(self.features.encode_example(example))
+        self._rows[split] += 1
+
+    def close(self) -> Dict[str, List[str]]:
+        for writer in self._writers.values():
+            writer.finalize()
+            writer.close()
+        self._writers = {}
+        return self.shards
+
+def shards_signature(records: List[Dict], image_paths: List[str], options: Dict) -> str:
+    """Fingerprint of everything the shards are built from: the records, the image files and the options."""
+    sha1 = hashlib.sha1()
+    sha1.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    sha1.update(json.dumps(records, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    for path in image_paths:
+        stat = os.stat(path)
+        sha1.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return sha1.hexdigest()
+
+def read_shard_state(output_dir: str) -> Optional[Dict]:
+    path = os.path.join(output_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if not all(os.path.exists(os.path.join(output_dir, name)) for names in state["shards"].values() for name in names):
+        return None
+    return state
+
+def write_shard_state(output_dir: str, signature: str, shards: Dict[str, List[str]]) -> None:
+    """Records a finished build. Written last, so an interrupted run is rebuilt on the next call."""
+    tmp_path = os.path.join(output_dir, STATE_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"signature": signature, "shards": shards}, f)
+    os.replace(tmp_path, os.path.join(output_dir, STATE_FILE))
+
+def remove_shards(output_dir: str) -> None:
+    """Deletes the shards of a previous build before a new one is written."""
+    state_path = os.path.join(output_dir, STATE_FILE)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    if os.path.isdir(output_dir):
+        for name in os.listdir(output_dir):
+            if name.endswith(".arrow") and name.split("-")[0] in SPLITS:
+                os.remove(os.path.join(output_dir, name))
+
+def load_split_shards(output_dir: str, shards: Dict[str, List[str]], features: Features) -> Dict[str, Dataset]:
+    """Opens the shards of every split memory-mapped; images stay encoded until a row is read."""
+    datasets = {}
+    for split in SPLITS:
+        parts = [Dataset.from_file(os.path.join(output_dir, name), in_memory=False) for name in shards.get(split, [])]
+        if not parts:
+            datasets[split] = Dataset.from_dict({key: [] for key in features}, features=features)
+        elif len(parts) == 1:
+            datasets[split] = parts[0]
+        else:
+            datasets[split] = concatenate_datasets(parts)
+    return datasets
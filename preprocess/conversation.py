@@ -1,3 +1,6 @@
+from collections import OrderedDict
+from collections.abc import Sequence
+
 # instruction = "The image are shown in sequence. Please generate analytical report on what will happen next in each region in Thailand (in term of geological event and disaster)? Please answer in Thai."
 INSTRUCTION = """
   นี้คือบริบทที่เกียวข้องกับรูปภาพนี้:
@@ -58,4 +61,41 @@ def convert_to_conversation_test(sample, instruction):
             {"type" : "text",  "text"  : ""} ]
         },
     ]
-    return { "messages" : conversation }
\ No newline at end of file
+    return { "messages" : conversation }
+
+class ConversationDataset(Sequence):
+    """Lazy view of a report split as conversation samples.
+
+    A sample's messages are built, and its images decoded, only when it is indexed, so iterating over a
+    memory-mapped split keeps a constant number of decoded samples alive. The last `cache_size` samples
+    are kept in an LRU cache (0 disables it).
+    """
+
+    def __init__(self, dataset, instruction=INSTRUCTION, converter=convert_to_conversation, cache_size=8):
+        self.dataset = dataset
+        self.instruction = instruction
+        self.converter = converter
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        if not isinstance(index, int):
+            raise TypeError(f"ConversationDataset indices must be integers, not {type(index).__name__}")
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ConversationDataset index out of range")
+
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+
+        sample = self.converter(self.dataset[index], self.instruction)
+        if self.cache_size > 0:
+            self._cache[index] = sample
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return sample
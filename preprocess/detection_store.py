@@ -0,0 +1,168 @@
+import os
+import json
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Detection class ids, in the order they are reported per image
+CLASS_NAMES = ("Cloudy", "Typhoon")
+
+def read_detections(metadata_paths: List[str]) -> Dict[str, np.ndarray]:
+    """Reads the detection JSON files of one report into columns.
+
+    Images keep the order of the files and of the keys within each file; `det_image` indexes into
+    `image_name`. Missing or malformed bbox and score values are stored as NaN.
+    """
+    image_names = []
+    det_image, class_ids, bboxes, scores = [], [], [], []
+    for metadata_path in metadata_paths:
+        with open(metadata_path, 'r') as f:
+            data = json.load(f)
+
+        for image, details in data.items():
+            for det in details['detections']:
+                det_image.append(len(image_names))
+                class_ids.append(det['class_id'])
+                bbox = det.get('bbox')
+                bboxes.append(bbox if isinstance(bbox, (list, tuple)) and len(bbox) == 4 else [np.nan] * 4)
+                scores.append(det.get('score', det.get('confidence', np.nan)))
+            image_names.append(image)
+
+    return {
+        "image_name": np.array(image_names, dtype=str),
+        "det_image": np.array(det_image, dtype=np.int64),
+        "class_id": np.array(class_ids, dtype=np.int64),
+        "bbox": np.array(bboxes, dtype=np.float32).reshape(-1, 4),
+        "score": np.array(scores, dtype=np.float32),
+    }
+
+def format_class_counts(counts: np.ndarray) -> str:
+    """Formats an (images, classes) count matrix as one "วันที่ {i}" line per image."""
+    return "\n".join(
+        f"วันที่ {i+1}: {{{', '.join(f'{name!r}: {count}' for name, count in zip(CLASS_NAMES, row))}}}"
+        for i, row in enumerate(counts.tolist())
+    )
+
+class DetectionStore:
+    """Columnar store of the img_metadata detections of every report.
+
+    Images are rows of (report, image_name) and detections are rows of (image, class_id, bbox, score),
+    each kept as NumPy arrays. The images of a report stay contiguous and in file order, so per-image
+    class counts for any set of reports come from one `np.bincount`.
+    """
+
+    def __init__(self):
+        self.reports: List[str] = []
+        self.image_report = np.zeros(0, dtype=np.int64)
+        self.image_name = np.zeros(0, dtype=str)
+        self.det_image = np.zeros(0, dtype=np.int64)
+        self.class_id = np.zeros(0, dtype=np.int64)
+        self.bbox = np.zeros((0, 4), dtype=np.float32)
+        self.score = np.zeros(0, dtype=np.float32)
+        self._report_index: Dict[str, int] = {}
+
+    def __contains__(self, base_name: str) -> bool:
+        return base_name in self._report_index
+
+    def __len__(self) -> int:
+        return len(self.reports)
+
+    @classmethod
+    def load(cls, path: str) -> "DetectionStore":
+        store = cls()
+        if os.path.exists(path):
+            with np.load(path, allow_pickle=False) as data:
+                store.reports = data["reports"].tolist()
+                for key in ("image_report", "image_name", "det_image", "class_id", "bbox", "score"):
+                    setattr(store, key, data[key])
+            store._report_index = {name: i for i, name in enumerate(store.reports)}
+        return store
+
+    def save(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path, reports=np.array(self.reports, dtype=str), image_report=self.image_report, image_name=self.image_name,
+            det_image=self.det_image, class_id=self.class_id, bbox=self.bbox, score=self.score,
+        )
+        os.replace(tmp_path, path)
+
+    def _drop_reports(self, report_ids: np.ndarray) -> None:
+        keep_images = ~np.isin(self.image_report, report_ids)
+        if keep_images.all():
+            return
+        # Renumber the detections of the kept images
+        new_image_ids = np.cumsum(keep_images) - 1
+        keep_dets = keep_images[self.det_image]
+        self.det_image = new_image_ids[self.det_image[keep_dets]]
+        self.class_id = self.class_id[keep_dets]
+        self.bbox = self.bbox[keep_dets]
+        self.score = self.score[keep_dets]
+        self.image_report = self.image_report[keep_images]
+        self.image_name = self.image_name[keep_images]
+
+    def update(self, detections_by_report: Dict[str, Dict[str, np.ndarray]]) -> None:
+        """Replaces (or adds) the detections of the given reports, as returned by `read_detections`."""
+        if not detections_by_report:
+            return
+        self._drop_reports(np.array([self._report_index[name] for name in detections_by_report if name in self._report_index], dtype=np.int64))
+
+        image_report, image_name = [self.image_report], [self.image_name]
+        det_image, class_id, bbox, score = [self.det_image], [self.class_id], [self.bbox], [self.score]
+        num_images = len(self.image_report)
+        for base_name, detections in detections_by_report.items():
+            if base_name not in self._report_index:
+                self._report_index[base_name] = len(self.reports)
+                self.reports.append(base_name)
+            image_report.append(np.full(len(detections["image_name"]), self._report_index[base_name], dtype=np.int64))
+            image_name.append(detections["image_name"])
+            det_image.append(detections["det_image"] + num_images)
+            class_id.append(detections["class_id"])
+            bbox.append(detections["bbox"])
+            score.append(detections["score"])
+            num_images += len(detections["image_name"])
+
+        self.image_report = np.concatenate(image_report)
+        self.image_name = np.concatenate(image_name)
+        self.det_image = np.concatenate(det_image)
+        self.class_id = np.concatenate(class_id)
+        self.bbox = np.concatenate(bbox)
+        self.score = np.concatenate(score)
+
+    def prune(self, base_names) -> None:
+        """Drops reports that are no longer in the archive."""
+        keep = set(base_names)
+        removed = [i for i, name in enumerate(self.reports) if name not in keep]
+        if not removed:
+            return
+        self._drop_reports(np.array(removed, dtype=np.int64))
+        kept = np.array([name in keep for name in self.reports], dtype=bool)
+        new_report_ids = np.cumsum(kept) - 1
+        self.image_report = new_report_ids[self.image_report]
+        self.reports = [name for name in self.reports if name in keep]
+        self._report_index = {name: i for i, name in enumerate(self.reports)}
+
+    def image_class_counts(self) -> np.ndarray:
+        """(num_images, len(CLASS_NAMES)) detection counts of every stored image."""
+        num_classes = len(CLASS_NAMES)
+        known = (self.class_id >= 0) & (self.class_id < num_classes)
+        flat = self.det_image[known] * num_classes + self.class_id[known]
+        return np.bincount(flat, minlength=len(self.image_report) * num_classes).reshape(-1, num_classes)
+
+    def report_class_counts(self, base_names: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+        """Per-image class counts of each report, in image order."""
+        counts = self.image_class_counts()
+        order = np.argsort(self.image_report, kind="stable")
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(self.image_report, minlength=len(self.reports)))])
+        names = self.reports if base_names is None else base_names
+        result = {}
+        for name in names:
+            report_id = self._report_index[name]
+            result[name] = counts[order[bounds[report_id]:bounds[report_id + 1]]]
+        return result
+
+    def format_image_metadata(self, base_names: Optional[List[str]] = None) -> Dict[str, str]:
+        """The per-sample "วันที่ {i}: {...}" metadata string of each report."""
+        return {name: format_class_counts(counts) for name, counts in self.report_class_counts(base_names).items()}
@@ -1,16 +1,27 @@
 import os
-from typing import List, Dict
+import hashlib
+from typing import List, Dict, Optional
 import re
-from pythainlp.util import normalize
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from datetime import datetime
-import json
-from datasets import Dataset, Features, Sequence, Value, Image as HFImage
+from io import BytesIO
+from datasets import Features, Sequence, Value, Image as HFImage
+import numpy as np
 from PIL import Image, UnidentifiedImageError
-import ast
 
-from preprocess.conversation import convert_to_conversation, convert_to_conversation_test, INSTRUCTION
+from preprocess.arrow_shards import SplitShardWriter, shards_signature, read_shard_state, write_shard_state, remove_shards, load_split_shards
+from preprocess.image_cache import ResizedImageCache
+from preprocess.detection_store import DetectionStore, read_detections
+from preprocess.manifest import PreprocessManifest
+from preprocess.text_cleaning import clean_text
+from preprocess.conversation import ConversationDataset, convert_to_conversation, convert_to_conversation_test, INSTRUCTION
 
 TARGET_SIZE = (256, 256)
+# JPEGs are draft-decoded to no less than this multiple of TARGET_SIZE before the final resize
+DRAFT_REDUCING_GAP = 2.0
 
 # Convert Gregorian date to Thai date
 def thai_parse_date(input_text):
@@ -52,72 +63,62 @@ def extract_date_from_filename(filename):
       return date_text
     return None
 
-def clean_text(text: str) -> str:
-
-    # Pattern to detect URLs
-    url_pattern = re.compile(r'https?://\S+')
-
-    # Pattern to detect lines that start with a number and end with "น."
-    date_line_pattern = re.compile(r'^\s*\d+.*น\.\s*$')
-
-    # Process each line
-    first_cleaned_lines = []
-    for line in text.splitlines():
-        stripped_line = line.strip()
-        # Remove lines that are solely a number
-        if stripped_line.isdigit():
-            continue
-        # Remove lines containing any URL
-        if url_pattern.search(line):
-            continue
-        # Remove lines that match the date/time pattern
-        if date_line_pattern.match(line):
-            continue
-
-        line = line.replace(" า"," ำ")
-        line = line.replace("ต ่า", "ต่ำ")
-        line = line.replace("ก ำ", "กำ")
-        line = line.replace("ก  ำ", "กำ")
-        line = line.replace("ดำห์", "ดาห์")
-        line = line.replace("มำ", "มา")
-
-        first_cleaned_lines.append(line)
-
-    first_cleaned_text = "\n".join(first_cleaned_lines)
-
-    cleaned_lines = []
-    for line in first_cleaned_text.splitlines():
-        if "ที่มา:" in line:
-            continue
-        if "สภาพอากาศ" == line.strip():
-            continue
-        if "สัปดาห์ที่ผ่านมา" == line.strip():
-            continue
-        if "ข้อมูลเพิ่มเติม:" == line.strip():
-            continue
-        if "สัปดาห์ที่ผ่านมาสภาพอากาศ" == line.strip():
-            continue
-        if "ลักษณะกลุ่มเมฆจากภาพถ่ายดาวเทียม" in line.strip():
-            continue
-        if "กลุ่มเมฆและแผนที่อากาศ" == line.strip():
-            continue
-        if "ภาพแผนที่อากาศ กรมอุตุนิยมวิทยา" == line.strip():
-            continue
-        if "Digital Typhoon" in line.strip():
-            continue
-
-        line.strip()
-
-        cleaned_lines.append(line)
-
-    output_text = " ".join(cleaned_lines)
-
-    output_text = normalize(output_text)
-
-    return output_text.strip()
-
-def create_dataset_list(mapped_images_folder: str) -> List[Dict[str, List]]:
-    """Reads text and image files from mapped_images and returns a list of dictionaries for Dataset.from_list()."""
+IMAGE_EXTENSIONS = (".jpg", ".png", ".jpeg")
+
+def scan_folder(folder: str, extensions) -> List[str]:
+    """Lists a folder once and returns the sorted file names ending with one of `extensions`."""
+    return sorted(name for name in os.listdir(folder) if name.lower().endswith(extensions))
+
+def match_prefix(sorted_names: List[str], prefix: str) -> List[str]:
+    """Returns the names of a `scan_folder` index that start with `prefix`, in sorted order."""
+    start = bisect_left(sorted_names, prefix)
+    end = start
+    while end < len(sorted_names) and sorted_names[end].startswith(prefix):
+        end += 1
+    return sorted_names[start:end]
+
+def build_record(task):
+    """Builds one dataset record from a (base_name, text_file_path, image_paths, metadata_paths) task.
+
+    Returns the record and the report's detection columns; `image_metadata` is filled in from the
+    DetectionStore by `create_dataset_list`. Runs in a worker process when it is called with `num_proc`.
+    """
+    base_name, text_file_path, matched_images, metadata_paths = task
+
+    # Read text content
+    with open(text_file_path, "r", encoding="utf-8") as f:
+        caption = f.read().strip()
+
+    detections = read_detections(metadata_paths)
+    report_date = extract_date_from_filename(base_name)
+    caption = clean_text(caption)
+
+    return {"image": matched_images, "text": caption, "filename": base_name, "reportdate": report_date, 'image_metadata': None}, detections
+
+def report_files(task) -> List[str]:
+    """All input files a record is built from: the text file, its images and its metadata JSON files."""
+    base_name, text_file_path, matched_images, metadata_paths = task
+    return [text_file_path] + matched_images + metadata_paths
+
+def report_shard(base_name: str, num_shards: int) -> int:
+    """Stable shard id of a report: the same on every host and Python process, unlike `hash()`."""
+    return int(hashlib.md5(base_name.encode("utf-8")).hexdigest(), 16) % num_shards
+
+def create_dataset_list(mapped_images_folder: str, num_proc: Optional[int] = None, manifest_path: Optional[str] = None, detection_store_path: Optional[str] = None, num_shards: int = 1, shard_id: int = 0) -> List[Dict[str, List]]:
+    """Reads text and image files from mapped_images and returns a list of dictionaries for Dataset.from_list().
+
+    Each image folder is listed once into a sorted prefix index, so matching a report to its images and
+    metadata files is a binary search instead of a directory scan per report. When `num_proc` is greater
+    than 1, text cleaning and metadata parsing run in a process pool; records keep the `text/` listing order.
+
+    With `manifest_path`, records of reports whose text, image and metadata files are unchanged since the
+    last run are taken from the manifest, and only new or changed reports are rebuilt.
+
+    Detections are kept in a columnar DetectionStore, persisted at `detection_store_path` if given, and each
+    record's `image_metadata` string is formatted from its vectorized per-image class counts.
+
+    With `num_shards` greater than 1, only the reports assigned to `shard_id` by `report_shard` are read.
+    """
     dataset = []
 
     text_folder = os.path.join(mapped_images_folder, "text")
@@ -129,136 +130,198 @@ def create_dataset_list(mapped_images_folder: str) -> List[Dict[str, List]]:
       print(f"Skipping {mapped_images_folder} (Missing text/ or img/ folder)")
       return dataset  # Return empty dataset if folders don't exist
 
-    # Read all text files
+    # Scan every folder once
+    img_index = scan_folder(img_folder, IMAGE_EXTENSIONS)
+    air_img_index = scan_folder(air_img_folder, IMAGE_EXTENSIONS)
+    img_metadata_index = scan_folder(img_metadata_folder, ".json")
+
+    tasks = []
     for text_file in os.listdir(text_folder):
       if text_file.endswith(".txt"):
         base_name = os.path.splitext(text_file)[0]
-        text_file_path = os.path.join(text_folder, text_file)
-
-        # Read text content
-        with open(text_file_path, "r", encoding="utf-8") as f:
-            caption = f.read().strip()
+        if num_shards > 1 and report_shard(base_name, num_shards) != shard_id:
+          continue
 
         # Find matching images
-        matched_images = [
-            os.path.join(img_folder, img_file)
-            for img_file in os.listdir(img_folder)
-            if img_file.startswith(base_name) and img_file.lower().endswith((".jpg", ".png", ".jpeg"))
-        ] + [
-            os.path.join(air_img_folder, img_file)
-            for img_file in os.listdir(air_img_folder)
-            if img_file.startswith(base_name) and img_file.lower().endswith((".jpg", ".png", ".jpeg"))
-        ]
-        matched_images = sorted(matched_images)
-
-        matched_images_metadata = []
-        # Find matching images
-        for img_metadata_file in sorted(os.listdir(img_metadata_folder)):
-          if img_metadata_file.startswith(base_name) and img_metadata_file.lower().endswith((".json")):
-            # Read json file
-            with open(os.path.join(img_metadata_folder, img_metadata_file), 'r') as f:
-              data = json.load(f)
-
-              # Extract counts per image
-              for image, details in data.items():
-                cloud_count = sum(1 for det in details['detections'] if det['class_id'] == 0)
-                typhoon_count = sum(1 for det in details['detections'] if det['class_id'] == 1)
-                matched_images_metadata.append({"Cloudy": cloud_count, "Typhoon": typhoon_count})
-
-        report_date = extract_date_from_filename(base_name)
-        caption = clean_text(caption)
-
-        if matched_images:
-          dataset.append({"image": matched_images, "text": caption, "filename": base_name, "reportdate": report_date, 'image_metadata': matched_images_metadata})
+        matched_images = sorted(
+            [os.path.join(img_folder, img_file) for img_file in match_prefix(img_index, base_name)]
+            + [os.path.join(air_img_folder, img_file) for img_file in match_prefix(air_img_index, base_name)]
+        )
+        if not matched_images:
+          continue
+
+        metadata_paths = [os.path.join(img_metadata_folder, name) for name in match_prefix(img_metadata_index, base_name)]
+        tasks.append((base_name, os.path.join(text_folder, text_file), matched_images, metadata_paths))
+
+    manifest = PreprocessManifest(manifest_path) if manifest_path is not None else None
+    records = [None] * len(tasks)
+    pending = []
+    for i, task in enumerate(tasks):
+      cached = manifest.lookup(task[0], report_files(task)) if manifest is not None else None
+      if cached is not None:
+        records[i] = cached
+      else:
+        pending.append(i)
+
+    pending_tasks = [tasks[i] for i in pending]
+    if num_proc is not None and num_proc > 1 and len(pending_tasks) > 1:
+      with ProcessPoolExecutor(max_workers=num_proc) as executor:
+        built = list(executor.map(build_record, pending_tasks, chunksize=max(1, len(pending_tasks) // (num_proc * 4))))
+    else:
+      built = [build_record(task) for task in pending_tasks]
+
+    store = DetectionStore.load(detection_store_path) if detection_store_path is not None else DetectionStore()
+    fresh_detections = {tasks[i][0]: detections for i, (record, detections) in zip(pending, built)}
+    for task in tasks:
+      # Records from the manifest whose detections are missing from the store, e.g. a deleted store file
+      if task[0] not in store and task[0] not in fresh_detections:
+        fresh_detections[task[0]] = read_detections(task[3])
+    store.update(fresh_detections)
+    store.prune(task[0] for task in tasks)
+    if detection_store_path is not None:
+      store.save(detection_store_path)
+
+    image_metadata = store.format_image_metadata([tasks[i][0] for i in pending])
+    built = [record for record, detections in built]
+    for i, record in zip(pending, built):
+      record["image_metadata"] = image_metadata[tasks[i][0]]
+      records[i] = record
+    dataset = records
+
+    if manifest is not None:
+      for i, record in zip(pending, built):
+        manifest.update(tasks[i][0], report_files(tasks[i]), record)
+      manifest.prune(task[0] for task in tasks)
+      manifest.save()
+      print(f"Manifest {manifest_path}: {manifest.hits} unchanged, {manifest.misses} new or changed reports")
 
     print(f"✅ Total records created: {len(dataset)}")
     return dataset
 
-def split_train_val_test(dataset, train_json_path="train.json", validation_json_path="validation.json", test_json_path="test.json"):
-    """Splits the dataset into train, validation, and test sets."""
-    train_dataset = []
-    validation_dataset = []
-    test_dataset = []
-
-    for item in dataset:
-        filename = item['filename']
-        # print(filename)
-        if '202504' in filename  or '202505' in filename:
-            test_dataset.append(item)
-        elif '202502' in filename or '202503' in filename:
-            validation_dataset.append(item)
-        else:
-            train_dataset.append(item)
-
-    with open(train_json_path, "w", encoding="utf-8") as f:
-        json.dump(train_dataset, f, ensure_ascii=False, indent=4)
-
-    with open(validation_json_path, "w", encoding="utf-8") as f:
-        json.dump(validation_dataset, f, ensure_ascii=False, indent=4)
-
-    with open(test_json_path, "w", encoding="utf-8") as f:
-        json.dump(test_dataset, f, ensure_ascii=False, indent=4)
-
-    print(f"JSON file saved at: {train_json_path}, {test_json_path}, {validation_json_path}")
-    
-    def open_json_dataset(json_path):
-        # Load JSON data
-        with open(json_path, "r") as f:
-            dataset_list = json.load(f)
-        return dataset_list
-
-    train_dataset_list = open_json_dataset(train_json_path)
-    validation_dataset_list = open_json_dataset(validation_json_path)
-    test_dataset_list = open_json_dataset(test_json_path)
-
-    # Define dataset schema
-    features = Features({
-        "image": Sequence(HFImage()),
-        "text": Value("string"),
-        "filename": Value("string"),
-        "reportdate": Value("string"),
-        "image_metadata": Value("string")
-    })
-
-    # Resize and load images
-    def load_image(example):
-        resized_images = []
-        for img in example["image"]:
-            try:
+# Define dataset schema
+REPORT_FEATURES = Features({
+    "image": Sequence(HFImage()),
+    "text": Value("string"),
+    "filename": Value("string"),
+    "reportdate": Value("string"),
+    "image_metadata": Value("string")
+})
+
+def assign_split(filename: str) -> str:
+    """Date-based split: April-May 2025 reports are test, February-March 2025 are validation."""
+    if '202504' in filename  or '202505' in filename:
+        return "test"
+    elif '202502' in filename or '202503' in filename:
+        return "validation"
+    return "train"
+
+def load_resized_image(image_path: str, reducing_gap: Optional[float] = DRAFT_REDUCING_GAP, image_cache: Optional[ResizedImageCache] = None) -> Optional[bytes]:
+    """Decodes an image, resizes it to TARGET_SIZE and returns it PNG-encoded, or None if it cannot be read.
+
+    JPEGs are decoded at a reduced scale (1/2, 1/4 or 1/8) as long as the decoded image stays at least
+    `reducing_gap` times TARGET_SIZE, then resized as before. Pass `reducing_gap=None` for a full decode.
+    With `image_cache`, the resized pixels are reused from earlier runs and the image is not decoded again.
+    """
+    if image_cache is not None:
+        array = image_cache.resized_file(image_path, TARGET_SIZE, reducing_gap=reducing_gap)
+        if array is None:
+            return None
+        img = Image.fromarray(np.asarray(array))
+    else:
+        try:
+            with Image.open(image_path) as img:
+                if reducing_gap is not None:
+                    img.draft("RGB", (int(TARGET_SIZE[0] * reducing_gap), int(TARGET_SIZE[1] * reducing_gap)))
                 img = img.convert("RGB")
                 img = img.resize(TARGET_SIZE)
-                resized_images.append(img)
-            except UnidentifiedImageError:
-                print(f"Error loading image: {img}")
-                # Optionally, you can append a placeholder or None, or skip the image
-                # For now, we'll just skip the problematic image
-                pass
-        example["image"] = resized_images
-        return example
-
-    # Refine image metadata
-    def refine_image_metadata(sample):
-        metadata_list = ast.literal_eval(sample["image_metadata"])
-        # Format each entry with "วันที่ {i}"
-        lines = [
-            f"วันที่ {i+1}: {entry}"
-            for i, entry in enumerate(metadata_list)
-        ]
-
-        # Join lines into a single string
-        sample["image_metadata"] = "\n".join(lines)
-        return sample
+        except UnidentifiedImageError:
+            print(f"Error loading image: {image_path}")
+            return None
+    # PNG stays lossless at any level; the lowest one is several times faster to encode
+    buffer = BytesIO()
+    img.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+def load_resized_images(image_paths: List[str], image_cache: Optional[ResizedImageCache] = None) -> List[bytes]:
+    """Loads the images of one report, skipping unreadable ones. Runs in a worker process with `num_proc`."""
+    images = [load_resized_image(path, image_cache=image_cache) for path in image_paths]
+    return [image for image in images if image is not None]
+
+def bounded_map(executor, fn, items, window: int):
+    """Like `executor.map(fn, items)`, in order, but with at most `window` tasks submitted and not yet consumed,
+    so results do not pile up when the consumer is slower than the workers."""
+    pending = deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
+
+def write_report_shards(dataset, output_dir: str, rows_per_shard: int = 1000, num_proc: Optional[int] = None, image_cache: Optional[ResizedImageCache] = None) -> Dict[str, List[str]]:
+    """Streams records into train/validation/test Arrow shards with images stored pre-resized.
+
+    With `num_proc` greater than 1, images are decoded and resized in a process pool while the shards
+    are written in order, with at most `num_proc * 4` reports decoded ahead of the writer. Resized images are read from and added to `image_cache` if given.
+    """
+    writer = SplitShardWriter(output_dir, REPORT_FEATURES, rows_per_shard=rows_per_shard)
+    image_lists = [item["image"] for item in dataset]
+    load_images = partial(load_resized_images, image_cache=image_cache)
+    executor = ProcessPoolExecutor(max_workers=num_proc) if num_proc is not None and num_proc > 1 else None
+    try:
+        if executor is not None:
+            loaded = bounded_map(executor, load_images, image_lists, window=num_proc * 4)
+        else:
+            loaded = map(load_images, image_lists)
+        for item, images in zip(dataset, loaded):
+            writer.write(assign_split(item["filename"]), {
+                "image": [{"bytes": image, "path": None} for image in images],
+                "text": item["text"],
+                "filename": item["filename"],
+                "reportdate": item["reportdate"],
+                "image_metadata": item["image_metadata"],
+            })
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if image_cache is not None:
+        image_cache.trim()
+    return writer.close()
+
+def build_report_shards(dataset, shard_dir: str, num_proc: Optional[int] = None, image_cache: Optional[ResizedImageCache] = None) -> Dict[str, List[str]]:
+    """Writes the records as train/validation/test Arrow shards under `shard_dir`, unless the shards there
+    were already built from the same records, image files and resize settings. Returns the shard names."""
+    image_paths = sorted({path for item in dataset for path in item["image"]})
+    signature = shards_signature(dataset, image_paths, {"target_size": list(TARGET_SIZE), "draft_reducing_gap": DRAFT_REDUCING_GAP})
+
+    state = read_shard_state(shard_dir)
+    if state is not None and state["signature"] == signature:
+        print(f"Reusing Arrow shards at: {shard_dir}")
+        return state["shards"]
+
+    remove_shards(shard_dir)
+    shards = write_report_shards(dataset, shard_dir, num_proc=num_proc, image_cache=image_cache)
+    write_shard_state(shard_dir, signature, shards)
+    print(f"Arrow shards saved at: {shard_dir}")
+    return shards
+
+def open_conversation_splits(shard_dir: str, shards: Dict[str, List[str]]):
+    """Opens built shards memory-mapped as train, validation and test `ConversationDataset` views."""
+    splits = load_split_shards(shard_dir, shards, REPORT_FEATURES)
+    train_dataset, validation_dataset, test_dataset = splits["train"], splits["validation"], splits["test"]
+
+    train_conversation_dataset = ConversationDataset(train_dataset, INSTRUCTION, convert_to_conversation)
+    validation_conversation_dataset = ConversationDataset(validation_dataset, INSTRUCTION, convert_to_conversation)
+    test_conversation_dataset = ConversationDataset(test_dataset, INSTRUCTION, convert_to_conversation_test)
     
-    train_dataset = Dataset.from_list(train_dataset_list, features=features).map(load_image)
-    validation_dataset = Dataset.from_list(validation_dataset_list, features=features).map(load_image)
-    test_dataset = Dataset.from_list(test_dataset_list, features=features).map(load_image)
+    return train_conversation_dataset, validation_conversation_dataset, test_conversation_dataset
 
-    train_dataset = train_dataset.map(refine_image_metadata)
-    validation_dataset = validation_dataset.map(refine_image_metadata)
-    test_dataset = test_dataset.map(refine_image_metadata)
-    
-    train_conversation_dataset = [convert_to_conversation(sample, INSTRUCTION) for sample in train_dataset]
-    validation_conversation_dataset = [convert_to_conversation(sample, INSTRUCTION) for sample in validation_dataset]
-    test_conversation_dataset = [convert_to_conversation_test(sample, INSTRUCTION) for sample in test_dataset]
-    
-    return train_conversation_dataset, validation_conversation_dataset, test_conversation_dataset
\ No newline at end of file
+def split_train_val_test(dataset, shard_dir="train_cache/shards", num_proc: Optional[int] = None, image_cache: Optional[ResizedImageCache] = None):
+    """Splits the dataset into train, validation, and test sets.
+
+    The splits are written once as Arrow shards under `shard_dir`, opened memory-mapped and returned as lazy
+    `ConversationDataset` views, so images are only decoded for the samples that are read. If the records,
+    their image files and the resize settings are unchanged since the last build, the shards are reused as they are.
+    """
+    shards = build_report_shards(dataset, shard_dir, num_proc=num_proc, image_cache=image_cache)
+    return open_conversation_splits(shard_dir, shards)
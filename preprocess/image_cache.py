@@ -0,0 +1,129 @@
+import os
+import hashlib
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+from preprocess.manifest import file_sha1
+
+class ResizedImageCache:
+    """On-disk cache of decoded and resized uint8 RGB image arrays, keyed by source content and resize settings.
+
+    Entries are `.npy` files under `cache_dir`, read back memory-mapped. A hit bumps the file's mtime, and
+    `trim` evicts the least recently used entries until the directory fits in `max_bytes`. Each process trims
+    after writing `trim_every` bytes (1/16 of `max_bytes` by default), so with N processes sharing the directory
+    it stays within `max_bytes` plus N times that. Writes go through a temporary file and `os.replace`, so
+    worker processes and concurrent runs can share one cache directory.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 8 << 30, trim_every: Optional[int] = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.trim_every = trim_every if trim_every is not None else max(1, max_bytes // 16)
+        self.hits = 0
+        self.misses = 0
+        self._written = 0
+        # (path, size, mtime_ns) -> sha1, so a file is hashed once per process
+        self._digests: Dict[Tuple[str, int, int], str] = {}
+
+    def __getstate__(self):
+        # Worker processes start with fresh counters
+        return {"cache_dir": self.cache_dir, "max_bytes": self.max_bytes, "trim_every": self.trim_every}
+
+    def __setstate__(self, state):
+        self.__init__(state["cache_dir"], state["max_bytes"], state["trim_every"])
+
+    def file_digest(self, path: str) -> str:
+        stat = os.stat(path)
+        memo_key = (path, stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(memo_key)
+        if digest is None:
+            digest = self._digests[memo_key] = file_sha1(path)
+        return digest
+
+    @staticmethod
+    def key(source_digest: str, size: Tuple[int, int], **options) -> str:
+        settings = ",".join(f"{name}={options[name]}" for name in sorted(options))
+        return hashlib.sha1(f"{source_digest}:{size[0]}x{size[1]}:{settings}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".npy")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            # Missing, evicted by another process, or a truncated file
+            self.misses += 1
+            return None
+        self.hits += 1
+        return array
+
+    def put(self, key: str, array: np.ndarray) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(array, dtype=np.uint8))
+        os.replace(tmp_path, path)
+        self._written += os.path.getsize(path)
+        if self._written >= self.trim_every:
+            self.trim()
+
+    def get_or_create(self, key: str, create: Callable[[], Optional[np.ndarray]]) -> Optional[np.ndarray]:
+        array = self.get(key)
+        if array is None:
+            array = create()
+            if array is not None:
+                self.put(key, array)
+        return array
+
+    def resized_file(self, image_path: str, size: Tuple[int, int], reducing_gap: Optional[float] = None, resample: int = Image.BICUBIC) -> Optional[np.ndarray]:
+        """The RGB array of the image file resized to `size`, decoded only on a cache miss.
+
+        With `reducing_gap`, JPEGs are draft-decoded as in `Image.draft`. Returns None if the file cannot be read.
+        """
+        def create():
+            try:
+                with Image.open(image_path) as img:
+                    if reducing_gap is not None:
+                        img.draft("RGB", (int(size[0] * reducing_gap), int(size[1] * reducing_gap)))
+                    return np.asarray(img.convert("RGB").resize(size, resample))
+            except UnidentifiedImageError:
+                print(f"Error loading image: {image_path}")
+                return None
+
+        key = self.key(self.file_digest(image_path), size, reducing_gap=reducing_gap, resample=int(resample))
+        return self.get_or_create(key, create)
+
+    def trim(self) -> int:
+        """Evicts least recently used entries until the whole directory, written to by all processes, fits in
+        `max_bytes`. Returns the bytes freed."""
+        entries = []
+        total = 0
+        for directory, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith(".npy"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+                total += stat.st_size
+
+        freed = 0
+        for _, size, path in sorted(entries):
+            if total - freed <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            freed += size
+        self._written = 0
+        return freed
@@ -0,0 +1,84 @@
+import os
+import json
+import hashlib
+from typing import Dict, List, Optional
+
+# Bump when the record format or the cleaning rules change, so stale manifests are rebuilt from scratch
+MANIFEST_VERSION = 2
+
+def file_sha1(path: str, chunk_size: int = 1 << 20) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+class PreprocessManifest:
+    """Persistent map from report base name to its input file fingerprints and its cleaned record.
+
+    A file is unchanged when its size and mtime match the stored fingerprint. When only the mtime moved
+    (e.g. the archive was copied or touched) the content hash decides, so re-synced but identical files
+    are not re-processed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.entries = data["reports"]
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(path: str, sha1: Optional[str] = None) -> Dict:
+        stat = os.stat(path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": sha1 if sha1 is not None else file_sha1(path)}
+
+    def _file_unchanged(self, path: str, stored: Dict) -> bool:
+        stat = os.stat(path)
+        if stat.st_size != stored["size"]:
+            return False
+        if stat.st_mtime_ns == stored["mtime_ns"]:
+            return True
+        if file_sha1(path) != stored["sha1"]:
+            return False
+        stored["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+    def lookup(self, base_name: str, files: List[str]) -> Optional[Dict]:
+        """Returns the cached record of `base_name` if it was built from exactly `files`, unchanged."""
+        entry = self.entries.get(base_name)
+        if entry is None or sorted(entry["files"]) != sorted(files):
+            self.misses += 1
+            return None
+        try:
+            unchanged = all(self._file_unchanged(path, entry["files"][path]) for path in files)
+        except FileNotFoundError:
+            unchanged = False
+        if not unchanged:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["record"]
+
+    def update(self, base_name: str, files: List[str], record: Dict) -> None:
+        self.entries[base_name] = {"files": {path: self.fingerprint(path) for path in files}, "record": record}
+
+    def prune(self, base_names) -> None:
+        """Drops reports that are no longer in the archive."""
+        keep = set(base_names)
+        for base_name in list(self.entries):
+            if base_name not in keep:
+                del self.entries[base_name]
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "reports": self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,69 @@
+import os
+import hashlib
+from typing import Optional
+
+from preprocess.arrow_shards import SPLITS, read_shard_state, write_shard_state, remove_shards
+from preprocess.file_extraction import create_dataset_list, build_report_shards, open_conversation_splits
+from preprocess.image_cache import ResizedImageCache
+from preprocess.manifest import PreprocessManifest
+
+def partial_dir(cache_dir: str, shard_id: int, num_shards: int) -> str:
+    return os.path.join(cache_dir, f"partial-{shard_id:05d}-of-{num_shards:05d}")
+
+def preprocess_shard(mapped_images_folder: str, cache_dir: str, num_shards: int, shard_id: int, num_proc: Optional[int] = None, image_cache: Optional[ResizedImageCache] = None):
+    """Preprocesses the reports of one hash shard into its own manifest, detection store and Arrow shards.
+
+    Shards share nothing but the input folder, so they can run as independent processes or on several
+    hosts that see the same `cache_dir`. They may also share one `image_cache`.
+    """
+    if not 0 <= shard_id < num_shards:
+        raise ValueError(f"shard_id must be in [0, {num_shards}), got {shard_id}")
+    output_dir = partial_dir(cache_dir, shard_id, num_shards)
+    dataset_list = create_dataset_list(
+        mapped_images_folder,
+        num_proc=num_proc,
+        manifest_path=os.path.join(output_dir, "manifest.json"),
+        detection_store_path=os.path.join(output_dir, "detections.npz"),
+        num_shards=num_shards,
+        shard_id=shard_id,
+    )
+    return build_report_shards(dataset_list, os.path.join(output_dir, "shards"), num_proc=num_proc, image_cache=image_cache)
+
+def merge_shards(cache_dir: str, num_shards: int, shard_dir: Optional[str] = None):
+    """Assembles the train/validation/test splits and the manifest from every finished shard.
+
+    The partial Arrow files are referenced in place rather than copied, split by split in shard order;
+    each shard already assigned its reports with the same date-based `assign_split`. Returns the same
+    conversation views as `split_train_val_test`.
+    """
+    shard_dir = shard_dir if shard_dir is not None else os.path.join(cache_dir, "shards")
+    partial_states = []
+    for shard_id in range(num_shards):
+        state = read_shard_state(os.path.join(partial_dir(cache_dir, shard_id, num_shards), "shards"))
+        partial_states.append(state)
+    missing = [shard_id for shard_id, state in enumerate(partial_states) if state is None]
+    if missing:
+        raise ValueError(f"Cannot merge, shards {missing} of {num_shards} have not finished preprocessing")
+
+    shards = {split: [] for split in SPLITS}
+    signature = hashlib.sha1()
+    os.makedirs(shard_dir, exist_ok=True)
+    for shard_id, state in enumerate(partial_states):
+        partial_shard_dir = os.path.join(partial_dir(cache_dir, shard_id, num_shards), "shards")
+        signature.update(state["signature"].encode("utf-8"))
+        for split in SPLITS:
+            shards[split] += [os.path.relpath(os.path.join(partial_shard_dir, name), shard_dir) for name in state["shards"].get(split, [])]
+
+    merged_state = read_shard_state(shard_dir)
+    if merged_state is None or merged_state["signature"] != signature.hexdigest():
+        remove_shards(shard_dir)
+        write_shard_state(shard_dir, signature.hexdigest(), shards)
+
+        manifest = PreprocessManifest(os.path.join(cache_dir, "manifest.json"))
+        manifest.entries = {}
+        for shard_id in range(num_shards):
+            manifest.entries.update(PreprocessManifest(os.path.join(partial_dir(cache_dir, shard_id, num_shards), "manifest.json")).entries)
+        manifest.save()
+        print(f"Merged {num_shards} shards into: {shard_dir}")
+
+    return open_conversation_splits(shard_dir, shards)
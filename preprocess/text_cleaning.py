@@ -0,0 +1,83 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from pythainlp.util import normalize
+
+# Pattern to detect URLs
+URL_PATTERN = re.compile(r'https?://\S+')
+
+# Pattern to detect lines that start with a number and end with "น."
+DATE_LINE_PATTERN = re.compile(r'^\s*\d+.*น\.\s*$')
+
+# Section headers and captions dropped when the whole (stripped) line matches
+DROPPED_HEADER_LINES = frozenset([
+    "สภาพอากาศ",
+    "สัปดาห์ที่ผ่านมา",
+    "ข้อมูลเพิ่มเติม:",
+    "สัปดาห์ที่ผ่านมาสภาพอากาศ",
+    "กลุ่มเมฆและแผนที่อากาศ",
+    "ภาพแผนที่อากาศ กรมอุตุนิยมวิทยา",
+])
+
+# OCR fixups for detached Sara Am / tone marks, applied in order. Order matters: " า"->" ำ" must run before
+# the "ก ำ" rules so that "ก า" also ends up as "กำ".
+OCR_FIXUPS = (
+    (" า", " ำ"),
+    ("ต ่า", "ต่ำ"),
+    ("ก ำ", "กำ"),
+    ("ก  ำ", "กำ"),
+    ("ดำห์", "ดาห์"),
+    ("มำ", "มา"),
+)
+
+def filter_report_lines(text: str) -> str:
+    """Drops page numbers, URLs, timestamps and section headers from a report, fixes OCR artifacts
+    and joins the remaining lines with spaces."""
+    # None of the fixups touches digits, URLs, "น." or line breaks, so they can run over the whole text at once
+    for old, new in OCR_FIXUPS:
+        text = text.replace(old, new)
+
+    # Every URL contains "://" and every timestamp line contains "น.", so most lines skip the regexes
+    check_urls = "://" in text
+    check_dates = "น." in text
+
+    cleaned_lines = []
+    last_line_empty = False
+    for line in text.splitlines():
+        stripped_line = line.strip()
+        # Remove lines that are solely a number, contain any URL or match the date/time pattern
+        if stripped_line.isdigit():
+            continue
+        if check_urls and "://" in line and URL_PATTERN.search(line):
+            continue
+        if check_dates and "น." in line and DATE_LINE_PATTERN.match(line):
+            continue
+        last_line_empty = not line
+
+        # Remove section headers and source credits
+        if stripped_line in DROPPED_HEADER_LINES:
+            continue
+        if "ที่มา:" in line or "ลักษณะกลุ่มเมฆจากภาพถ่ายดาวเทียม" in line or "Digital Typhoon" in line:
+            continue
+        cleaned_lines.append(line)
+
+    # The two-pass version re-split the fixed lines joined by "\n", which loses a trailing empty line
+    if last_line_empty:
+        cleaned_lines.pop()
+
+    return " ".join(cleaned_lines)
+
+def clean_text(text: str) -> str:
+    output_text = filter_report_lines(text)
+
+    output_text = normalize(output_text)
+
+    return output_text.strip()
+
+def clean_texts(texts: List[str], num_proc: Optional[int] = None) -> List[str]:
+    """Cleans a batch of reports, fanning out to `num_proc` worker processes when it is greater than 1."""
+    if num_proc is None or num_proc <= 1 or len(texts) <= 1:
+        return [clean_text(text) for text in texts]
+    with ProcessPoolExecutor(max_workers=num_proc) as executor:
+        return list(executor.map(clean_text, texts, chunksize=max(1, len(texts) // (num_proc * 4))))
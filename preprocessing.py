@@ -1,8 +1,32 @@
+import os
+import argparse
+
 from preprocess.file_extraction import create_dataset_list, split_train_val_test
+from preprocess.sharding import preprocess_shard, merge_shards
+from preprocess.image_cache import ResizedImageCache
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mapped-images-folder", type=str, default="data")
+    parser.add_argument("--cache-dir", type=str, default="train_cache")
+    parser.add_argument("--num-proc", type=int, default=os.cpu_count())
+    parser.add_argument("--num-shards", type=int, default=1, help="split the reports into N hash shards")
+    parser.add_argument("--shard-id", type=int, default=None, help="preprocess only shard k of --num-shards")
+    parser.add_argument("--merge", action="store_true", help="assemble the splits from all finished shards")
+    parser.add_argument("--image-cache-dir", type=str, default=None, help="resized image cache (default: <cache-dir>/images)")
+    parser.add_argument("--image-cache-gb", type=float, default=8.0)
+    args = parser.parse_args()
+    if args.num_shards > 1 and args.shard_id is None and not args.merge:
+        parser.error("--num-shards needs --shard-id to preprocess one shard or --merge to assemble them")
+    if args.shard_id is not None and not 0 <= args.shard_id < args.num_shards:
+        parser.error(f"--shard-id must be in [0, {args.num_shards})")
+
+    image_cache = ResizedImageCache(args.image_cache_dir or os.path.join(args.cache_dir, "images"), max_bytes=int(args.image_cache_gb * 2**30))
 
-mapped_images_folder = "data"
-dataset_list = create_dataset_list(mapped_images_folder)
-train_conversation_dataset, validation_conversation_dataset, test_conversation_dataset = split_train_val_test(dataset_list, 
-                                                                                                              train_json_path="train_cache/train_conversation.json", 
-                                                                                                              validation_json_path="train_cache/validation_conversation.json", 
-                                                                                                              test_json_path="train_cache/test_conversation.json")
\ No newline at end of file
+    if args.shard_id is not None:
+        preprocess_shard(args.mapped_images_folder, args.cache_dir, args.num_shards, args.shard_id, num_proc=args.num_proc, image_cache=image_cache)
+    elif args.merge:
+        train_conversation_dataset, validation_conversation_dataset, test_conversation_dataset = merge_shards(args.cache_dir, args.num_shards)
+    else:
+        dataset_list = create_dataset_list(args.mapped_images_folder, num_proc=args.num_proc, manifest_path=os.path.join(args.cache_dir, "manifest.json"), detection_store_path=os.path.join(args.cache_dir, "detections.npz"))
+        train_conversation_dataset, validation_conversation_dataset, test_conversation_dataset = split_train_val_test(dataset_list, shard_dir=os.path.join(args.cache_dir, "shards"), num_proc=args.num_proc, image_cache=image_cache)
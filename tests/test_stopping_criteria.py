@@ -0,0 +1,91 @@
+import pytest
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import PreTrainedTokenizerFast
+
+from oryx.mm_utils import KeywordsStoppingCriteria
+
+STOP = "<|im_end|>"
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    special_tokens = ["<|endoftext|>", "<|im_start|>", STOP]
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    texts = ["the report is done", "###", "no findings today", "a b c d e f g"] * 8
+    tokenizer.train_from_iterator(texts, trainers.BpeTrainer(vocab_size=300, special_tokens=special_tokens))
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|endoftext|>",
+                                   additional_special_tokens=special_tokens[1:])
+
+
+def ids(tokenizer, text):
+    return tokenizer(text).input_ids
+
+
+def run(criteria, prompt, generated):
+    """The step at which each row of `generated` (B×steps) stops, or -1, generating after `prompt` (B×N or None)."""
+    stopped = torch.full((generated.shape[0],), -1)
+    for step in range(generated.shape[1]):
+        output_ids = generated[:, :step + 1] if prompt is None else torch.cat([prompt, generated[:, :step + 1]], dim=1)
+        finished = criteria(output_ids, None)
+        stopped[(stopped < 0) & finished] = step
+    return stopped.tolist()
+
+
+def test_rows_stop_independently(tokenizer):
+    prompt = torch.tensor([ids(tokenizer, "the report")] * 3)
+    stop = ids(tokenizer, STOP)[0]
+    filler = ids(tokenizer, "a")[0]
+    generated = torch.full((3, 6), filler)
+    generated[0, 1] = stop
+    generated[2, 4] = stop
+    criteria = KeywordsStoppingCriteria([STOP], tokenizer, prompt)
+    assert run(criteria, prompt, generated) == [1, -1, 4]
+
+
+def test_multi_token_keyword(tokenizer):
+    keyword = "no findings"
+    prompt = torch.tensor([ids(tokenizer, "the report")])
+    generated = torch.tensor([ids(tokenizer, "a b ") + ids(tokenizer, keyword) + ids(tokenizer, " c")])
+    criteria = KeywordsStoppingCriteria([keyword, STOP], tokenizer, prompt)
+    assert run(criteria, prompt, generated) == [len(ids(tokenizer, "a b ")) + len(ids(tokenizer, keyword)) - 1]
+
+
+def test_keyword_in_prompt_does_not_stop(tokenizer):
+    prompt = torch.tensor([ids(tokenizer, "the report") + ids(tokenizer, STOP)])
+    generated = torch.tensor([ids(tokenizer, "a b c")])
+    criteria = KeywordsStoppingCriteria([STOP], tokenizer, prompt)
+    # Only the newest tokens are matched, so a stop string ending the prompt does not stop generation
+    assert run(criteria, prompt, generated) == [-1]
+
+
+def test_decode_fallback_matches_differently_tokenized_keyword(tokenizer):
+    keyword = "###"
+    prompt = torch.tensor([ids(tokenizer, "the report")])
+    # The keyword generated one character at a time does not match its own token ids
+    split = [ids(tokenizer, "#")[0]] * 3
+    assert split != ids(tokenizer, keyword)
+    generated = torch.tensor([ids(tokenizer, "a b") + split + ids(tokenizer, " c")])
+    criteria = KeywordsStoppingCriteria([keyword], tokenizer, prompt)
+    assert run(criteria, prompt, generated) == [len(ids(tokenizer, "a b")) + 2]
+
+
+def test_inputs_embeds_and_reuse(tokenizer):
+    # With inputs_embeds, generate passes only the generated tokens, shorter than the prompt
+    prompt = torch.tensor([ids(tokenizer, "the report is done no findings today")] * 2)
+    stop = ids(tokenizer, STOP)[0]
+    generated = torch.full((2, 4), ids(tokenizer, "a")[0])
+    generated[1, 2] = stop
+    criteria = KeywordsStoppingCriteria([STOP], tokenizer, prompt)
+    assert run(criteria, None, generated) == [-1, 2]
+    # A second generation with the same criterion starts with no row finished
+    generated[1, 2] = generated[0, 0]
+    generated[0, 3] = stop
+    assert run(criteria, None, generated) == [3, -1]
+
+
+def test_keywords_without_tokens(tokenizer):
+    with pytest.raises(ValueError):
+        KeywordsStoppingCriteria([""], tokenizer, torch.zeros(1, 1, dtype=torch.long))
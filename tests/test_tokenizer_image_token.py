@@ -0,0 +1,94 @@
+import pytest
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, processors, trainers
+from transformers import PreTrainedTokenizerFast
+
+from oryx.constants import IMAGE_TOKEN_INDEX
+from oryx.mm_utils import ChunkTokenCache, tokenizer_image_token, tokenizer_image_token_batch
+
+PROMPTS = [
+    "",
+    "no images here",
+    "<image>",
+    "<image>\ndescribe the picture",
+    "before <image> between <image>\n<image> after",
+    "<image><image>\ntwo in a row",
+    "trailing image <image>",
+    "<|im_start|>user\n<image>\n<image>\nสรุปรายงาน<|im_end|>\n<|im_start|>assistant\n",
+]
+
+
+def legacy_tokenizer_image_token(prompt, tokenizer, image_token_index=IMAGE_TOKEN_INDEX, return_tensors=None):
+    """`tokenizer_image_token` before the chunk cache."""
+    prompt_chunks = [tokenizer(chunk).input_ids for chunk in prompt.split('<image>')]
+
+    def insert_separator(X, sep):
+        return [ele for sublist in zip(X, [sep]*len(X)) for ele in sublist][:-1]
+
+    input_ids = []
+    offset = 0
+    if len(prompt_chunks) > 0 and len(prompt_chunks[0]) > 0 and prompt_chunks[0][0] == tokenizer.bos_token_id:
+        offset = 1
+        input_ids.append(prompt_chunks[0][0])
+
+    for x in insert_separator(prompt_chunks, [image_token_index] * (offset + 1)):
+        input_ids.extend(x[offset:])
+
+    if return_tensors == 'pt':
+        return torch.tensor(input_ids, dtype=torch.long)
+    return input_ids
+
+
+def train_tokenizer(bos):
+    special_tokens = ["<|endoftext|>", "<s>", "<|im_start|>", "<|im_end|>"]
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator([prompt.replace("<image>", "") for prompt in PROMPTS] * 4,
+                                  trainers.BpeTrainer(vocab_size=300, special_tokens=special_tokens))
+    if bos:
+        tokenizer.post_processor = processors.TemplateProcessing(single="<s> $A", special_tokens=[("<s>", 1)])
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|endoftext|>", bos_token="<s>",
+                                   additional_special_tokens=special_tokens[2:])
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["no-bos", "bos"])
+def tokenizer(request):
+    return train_tokenizer(bos=request.param)
+
+
+@pytest.mark.parametrize("prompt", PROMPTS)
+def test_matches_legacy(tokenizer, prompt):
+    expected = legacy_tokenizer_image_token(prompt, tokenizer)
+    assert tokenizer_image_token(prompt, tokenizer) == expected
+    # Second call is served from the chunk cache
+    assert tokenizer_image_token(prompt, tokenizer) == expected
+
+
+def test_batch_matches_single(tokenizer):
+    batch = tokenizer_image_token_batch(PROMPTS, tokenizer)
+    assert batch == [legacy_tokenizer_image_token(prompt, tokenizer) for prompt in PROMPTS]
+
+
+def test_return_tensors(tokenizer):
+    prompt = PROMPTS[4]
+    ids = tokenizer_image_token(prompt, tokenizer, return_tensors="pt")
+    assert ids.dtype == torch.long
+    assert torch.equal(ids, legacy_tokenizer_image_token(prompt, tokenizer, return_tensors="pt"))
+    with pytest.raises(ValueError):
+        tokenizer_image_token(prompt, tokenizer, return_tensors="np")
+
+
+def test_cache_is_keyed_by_tokenizer():
+    cache = ChunkTokenCache(maxsize=4)
+    plain, with_bos = train_tokenizer(bos=False), train_tokenizer(bos=True)
+    chunks = ["describe the picture", "between", "describe the picture"]
+    plain_ids = [ids.tolist() for ids in cache.encode(plain, chunks)]
+    bos_ids = [ids.tolist() for ids in cache.encode(with_bos, chunks)]
+    assert plain_ids == [plain(chunk).input_ids for chunk in chunks]
+    assert bos_ids == [with_bos(chunk).input_ids for chunk in chunks]
+    assert bos_ids[0][0] == with_bos.bos_token_id != plain_ids[0][0]
+    assert cache.hits == 0
+    assert [ids.tolist() for ids in cache.encode(with_bos, chunks)] == bos_ids
+    assert cache.hits == len(chunks)
+    assert len(cache._entries) <= cache.maxsize
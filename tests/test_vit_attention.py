@@ -0,0 +1,74 @@
+import pytest
+import torch
+
+from oryx.model.multimodal_encoder.oryx_vit import chunked_attention, flash_attn_func, vit_attention
+
+HEADS, HEAD_DIM = 4, 32
+SCALE = HEAD_DIM ** -0.5
+
+CASES = {
+    "dense batch 2": (2, None),
+    "packed unequal": (1, [144, 160, 64]),
+    "packed equal": (1, [64, 64, 64]),
+    "packed repeated unequal": (1, [144, 64, 144, 64]),
+}
+
+
+def reference_attention(q, k, v, scale, cu_slens=None):
+    """float64 attention over B×N×heads×head_dim q, k, v, per segment of `cu_slens` if given."""
+    q, k, v = q.double(), k.double(), v.double()
+    bounds = cu_slens.tolist() if cu_slens is not None else [0, q.shape[1]]
+    x = torch.empty_like(q)
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        scores = torch.einsum("bqhd,bkhd->bhqk", q[:, start:end], k[:, start:end]) * scale
+        x[:, start:end] = torch.einsum("bhqk,bkhd->bqhd", scores.softmax(dim=-1), v[:, start:end])
+    return x
+
+
+def make_inputs(batch, lengths, device="cpu", dtype=torch.float32):
+    generator = torch.Generator().manual_seed(0)
+    num_tokens = sum(lengths) if lengths else 256
+    q, k, v = torch.randn(3, batch, num_tokens, HEADS, HEAD_DIM, generator=generator).to(device, dtype).unbind(0)
+    cu_slens = None
+    if lengths:
+        cu_slens = torch.tensor([0] + lengths, dtype=torch.int32, device=device).cumsum(0, dtype=torch.int32)
+    return q, k, v, cu_slens
+
+
+@pytest.mark.parametrize("backend", ["sdpa", "chunked"])
+@pytest.mark.parametrize("case", list(CASES))
+def test_backend_matches_reference(backend, case):
+    q, k, v, cu_slens = make_inputs(*CASES[case])
+    out = vit_attention(q, k, v, SCALE, cu_slens, backend=backend)
+    assert out.shape == q.shape
+    torch.testing.assert_close(out.double(), reference_attention(q, k, v, SCALE, cu_slens), atol=1e-4, rtol=0)
+
+
+def test_chunked_matches_sdpa_across_chunks():
+    q, k, v, _ = make_inputs(2, None)
+    out = chunked_attention(q, k, v, SCALE, chunk_size=96)
+    torch.testing.assert_close(out, vit_attention(q, k, v, SCALE, backend="sdpa"), atol=1e-5, rtol=0)
+
+
+def test_padding_mask_matches_unpadded():
+    q, k, v, _ = make_inputs(1, None)
+    padded = [torch.nn.functional.pad(t, (0, 0, 0, 0, 0, 64)) for t in (q, k, v)]
+    mask = (torch.arange(q.shape[1] + 64) < q.shape[1])[None, None, None, :]
+    out = vit_attention(*padded, SCALE, attn_mask=mask)[:, :q.shape[1]]
+    torch.testing.assert_close(out, vit_attention(q, k, v, SCALE, backend="sdpa"), atol=1e-5, rtol=0)
+
+
+@pytest.mark.skipif(flash_attn_func is None or not torch.cuda.is_available(), reason="needs flash_attn and CUDA")
+@pytest.mark.parametrize("case", list(CASES))
+def test_flash_matches_reference(case):
+    q, k, v, cu_slens = make_inputs(*CASES[case], device="cuda", dtype=torch.bfloat16)
+    out = vit_attention(q, k, v, SCALE, cu_slens, backend="flash")
+    torch.testing.assert_close(out.double(), reference_attention(q, k, v, SCALE, cu_slens), atol=2e-2, rtol=0)
+
+
+def test_flash_backend_requires_flash_attn():
+    if flash_attn_func is not None:
+        pytest.skip("flash_attn is installed")
+    q, k, v, _ = make_inputs(1, None)
+    with pytest.raises(ImportError):
+        vit_attention(q, k, v, SCALE, backend="flash")